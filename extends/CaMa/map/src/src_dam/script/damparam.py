@@ -0,0 +1,282 @@
+'''
+Steps of the dam parameter estimation (s01-calc_damparam.sh), as functions
+
+The p01-p04, modify_damloc.py and est_fldsto_totalsto.py scripts are command line wrappers of
+the functions below.  Inputs are read from ./inp (linked by s00-link.sh) and the results are
+written to ./{tag}, as before.  The array kernels (outflow gather, peak detection, Gumbel fit,
+ReGeom interpolation, duplicate removal) are shared with the CoLM dam stages in
+extends/CaMa/preprocess/dam/dam_kernels.py.
+
+Oct 2026
+'''
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# map/src/src_dam/script and map/{map}/src_dam/script are both 4 levels below extends/CaMa
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../../preprocess/dam'))
+from dam_kernels import (read_outflw_bin, annual_peaks, gumbel_return_level, read_grsad_area,
+                         read_regeom, use_storage_at_area, keep_largest_per_grid,
+                         best_uparea_grid, NEIGHBOURS_3x3, NEIGHBOURS_5x5)
+
+INPDIR   = './inp/'
+DAM_FILE = './inp/damlist.txt'
+
+
+
+def read_map_dim(mapdir):
+    with open(mapdir + '/params.txt', 'r') as f:
+        nx = int(f.readline().strip().split(' ')[0])
+        ny = int(f.readline().strip().split(' ')[0])
+    return nx, ny
+
+
+def read_damlist(dam_file=DAM_FILE):
+    return pd.read_csv(dam_file, sep=r'\s+', header=0, skipinitialspace=True)
+
+
+
+def get_annualmax_mean(syear, eyear, tag, maxdays=1, natdir=INPDIR + 'natsim/', mapdir=INPDIR + 'map/',
+                       dam_file=DAM_FILE):
+    '''
+    (a) annual maximum and mean discharge at the dam grids from the natsim outflw{year}.bin
+    '''
+    nx, ny = read_map_dim(mapdir)
+    print('CaMa map dim (nx,ny):', nx, ny)
+
+    damcsv = read_damlist(dam_file)
+    ndams  = len(damcsv)
+    print('number of dams:', ndams)
+
+    max_outf  = './' + tag + '/tmp_p01_AnnualMax.bin'
+    mean_outf = './' + tag + '/tmp_p01_AnnualMean.bin'
+
+    years = eyear - syear + 1
+    max_finarray   = np.zeros((years*maxdays, ndams))
+    mean_yeararray = np.zeros((years, ndams))
+
+    x_arr = damcsv['ix'].values - 1
+    y_arr = damcsv['iy'].values - 1
+
+    for i, year in enumerate(range(syear, eyear+1, 1)):
+        ## read NAT outflw of the dam grids only
+        outflw_file = natdir + '/outflw' + str(year) + '.bin'
+        outflw_dam  = read_outflw_bin(outflw_file, nx, ny, x_arr, y_arr)
+        print('read natsim outflw: year=', year, outflw_dam.shape)
+
+        mean_yeararray[i,:] = np.mean(outflw_dam, axis=0)
+        max_finarray[i*maxdays:(i+1)*maxdays, :] = annual_peaks(outflw_dam, maxdays)
+
+    print('save flood and mean discharge at dam grids')
+    max_finarray.astype('float32').tofile(max_outf)
+
+    mean_finarray = np.mean(mean_yeararray, axis=0)
+    mean_finarray = np.where(mean_finarray<1.E-10, 1.E-10, mean_finarray)
+    mean_finarray.astype('float32').tofile(mean_outf)
+
+    print('Output Plain Binary Files')
+    print('-- flood discharge [nyear * ndams]', max_outf)
+    print('-- mean  discharge [nyear * ndams]', mean_outf)
+    return max_outf, mean_outf
+
+
+
+def get_100yr_discharge(syear, eyear, tag, pyear=100, maxdays=1, dam_file=DAM_FILE):
+    '''
+    (b) pyear-year discharge at the dam grids from the annual maxima of (a)
+    '''
+    ndams = len(read_damlist(dam_file))
+    years = (eyear - syear + 1) * maxdays
+
+    readdatapath = './' + tag + '/tmp_p01_AnnualMax.bin'
+    print('read annual max files: ', readdatapath)
+    readdata = np.fromfile(str(readdatapath), 'float32').reshape(years, ndams)
+
+    outputpath = './' + tag + '/tmp_p02_' + str(pyear) + 'year.bin'
+    finarray = gumbel_return_level(readdata, pyear)
+    finarray.astype('float32').tofile(outputpath)
+
+    print('Output Plain Binary Files')
+    print('-- ' + str(pyear) + 'yr-discharge [ndams]', outputpath)
+    return outputpath
+
+
+
+def est_fldsto_surfacearea(tag, pc=75, dam_file=DAM_FILE, GRSADdir=INPDIR + 'GRSAD/',
+                           ReGeomdir=INPDIR + 'ReGeom/'):
+    '''
+    (c) flood control storage from the GRSAD surface area at normal water level (percentile pc)
+    and the ReGeom area-storage curve; -996..-999 mark dams whose storage cannot be defined
+    '''
+    output_file = './' + tag + '/tmp_p03_fldsto.csv'
+    grand = read_damlist(dam_file)
+
+    cols = ['ID', 'damname', 'ave_area', 'fldsto_mcm', 'totalsto_mcm']
+    rows = []
+    for damid, damname, totalsto in zip(grand['ID'].values, grand['damname'].values, grand['cap_mcm'].values):
+        grsadpath = GRSADdir + '/' + str(damid) + '_intp'
+        if not os.path.isfile(grsadpath):
+            print(damid, 'No GRSAD file: ' + str(grsadpath))
+            rows.append([damid, damname, -998, -998, totalsto])
+            continue
+
+        data = read_grsad_area(grsadpath)
+        if len(data) < 2:
+            print('Too short GRSAD data: ' + str(grsadpath))
+            rows.append([damid, damname, -997, -997, totalsto])
+            continue
+
+        ## surface water area at normal water level and max level
+        fld_area = np.percentile(data, pc)
+        areamax  = np.max(data)
+
+        regeompath = ReGeomdir + '/' + str(damid) + '.csv'
+        if not os.path.isfile(regeompath):
+            print(damid, 'No ReGeom file: ' + str(regeompath))
+            rows.append([damid, damname, -996, -996, totalsto])
+            continue
+
+        depth, area, storage = read_regeom(regeompath)
+        if len(area) <= 1:
+            print(damid, 'ReGeom data was empty!!!')
+            rows.append([damid, damname, -999, -999, totalsto])
+            continue
+
+        ## adjust area to fit max value to ReGeom (avoid error in GRSAD)
+        fld_area = fld_area * area[-1] / areamax
+        use_sto, fld_sto, sto_max = use_storage_at_area(area, storage, fld_area, totalsto)
+
+        if sto_max == 0:
+            print(damid, 'ERR: sto_max == 0')
+            use_sto = np.mean(storage[area == area[-1]]) * totalsto / storage[-1]
+            print(totalsto - use_sto, totalsto)
+            sys.exit()
+        if fld_sto == 0:
+            print('error!')
+            print(damid, fld_area)
+            sys.exit()
+        if fld_sto < 0:
+            fld_sto = 0.0
+
+        rows.append([damid, damname, fld_area, fld_sto, totalsto])
+
+    df_new = pd.DataFrame(rows, columns=cols, index=[0]*len(rows))
+    print('save results [CSV file]')
+    print(df_new)
+    df_new.to_csv(output_file)
+    print(output_file)
+    return output_file
+
+
+
+def complete_damcsv(tag, minuparea, pyear=100, dam_file=DAM_FILE):
+    '''
+    (d) merge dam locations, discharge and storage parameters; remove small dams and keep the
+    largest dam of every grid
+    '''
+    output_file  = './' + tag + '/tmp_p04_damparams.csv'
+    Qmean_file   = './' + tag + '/tmp_p01_AnnualMean.bin'
+    Q100_file    = './' + tag + '/tmp_p02_' + str(pyear) + 'year.bin'
+    storage_file = './' + tag + '/tmp_p03_fldsto.csv'
+
+    Qn_all   = np.fromfile(Qmean_file, 'float32')
+    Q100_all = np.fromfile(Q100_file,  'float32')
+
+    damcsv = read_damlist(dam_file)
+    damcsv['Qn'] = Qn_all
+    damcsv['Qf'] = Q100_all * 0.3
+
+    ## flood control storage from (c); 0.37 of the total capacity when it is undefined
+    stocsv   = pd.read_csv(storage_file).drop_duplicates('ID').set_index('ID')
+    fldsto   = stocsv['fldsto_mcm'].reindex(damcsv['ID']).values
+    totalsto = stocsv['totalsto_mcm'].reindex(damcsv['ID']).values
+    fldsto   = np.where((fldsto != fldsto) | (fldsto < -99), totalsto * 0.37, fldsto)
+    damcsv['fldsto_mcm'] = fldsto
+    damcsv['consto_mcm'] = totalsto - fldsto
+
+    ## adjustment for flood discharge smaller than mean
+    Qf, Qn = damcsv['Qf'].values, damcsv['Qn'].values
+    Q40 = Q100_all * 0.4
+    damcsv['Qf'] = np.where(Qf < Qn, np.where(Q40 >= Qn, Q40.astype(np.float64), Qn.astype(np.float64) * 1.1),
+                            Qf.astype(np.float64))
+
+    ## remove dams with small drainage area
+    damcsv = damcsv.query('area_CaMa >= @minuparea')
+    damcsv = damcsv.dropna()
+
+    ## treat multiple dams in one grid (remove smaller dam)
+    print('treat multiple dams in one grid')
+    keep = keep_largest_per_grid(damcsv, cap='cap_mcm', tiebreak='fldsto_mcm')
+    for (ix, iy), rmdams in damcsv[~keep].groupby(['ix', 'iy'], sort=False):
+        ndam = int(((damcsv['ix'] == ix) & (damcsv['iy'] == iy)).sum())
+        print('-- multiple dams on one grid!!:', (ix, iy), ndam, 'dams exist. removed below')
+        print(rmdams.loc[:,['ID','lat','lon','area_CaMa']].to_string(index=False, header=False))
+    damcsv2 = damcsv[keep]
+    print(damcsv2)
+
+    damcsv2 = damcsv2.rename(columns={'ID': 'GRAND_ID', 'damname':'DamName', 'lon':'DamLon', 'lat':'DamLat', 'ix':'DamIX', 'iy':'DamIY', 'fldsto_mcm':'FldVol_mcm', 'consto_mcm':'ConVol_mcm', 'cap_mcm':'TotalVol_mcm'})
+    damcsv2 = damcsv2[['GRAND_ID', 'DamName', 'DamLat', 'DamLon', 'area_CaMa', 'DamIX', 'DamIY', 'FldVol_mcm', 'ConVol_mcm', 'TotalVol_mcm', 'Qn', 'Qf', 'year']]
+    damcsv2.to_csv(output_file, index=None)
+    print('dam parameters:', output_file)
+    return output_file
+
+
+
+def modify_damloc(tag, minuparea, minerror=0.1, mapdir=INPDIR + 'map/'):
+    '''
+    Move dams whose CaMa drainage area differs from the reported one by more than minerror to
+    the best of the 8 neighbour grids, or else of the 5x5 grids around
+    '''
+    inputfile  = './' + tag + '/damloc_tmp.txt'
+    outputfile = './' + tag + '/damloc_modified.csv'
+
+    nx, ny = read_map_dim(mapdir)
+    print('NX=', nx, 'NY=', ny)
+
+    dam_data = pd.read_csv(inputfile, sep=r'\s+', header=0)
+    # uparea (nx, ny) view of the (ny, nx) file, in km2
+    uparea_cama = (np.fromfile(mapdir + '/uparea.bin', 'float32').reshape(ny, nx) / (1e+6)).T
+
+    ix = dam_data['ix'].values.astype(int) - 1
+    iy = dam_data['iy'].values.astype(int) - 1
+    upreal = dam_data['upreal'].values
+    error  = np.abs(uparea_cama[ix, iy] - upreal)
+
+    # search only for dams with a reported drainage area and a large error
+    todo = np.where((upreal >= 0) & (error >= upreal * minerror))[0]
+    ix_m, iy_m = ix.copy(), iy.copy()
+    x3, y3, e3 = best_uparea_grid(uparea_cama, ix[todo], iy[todo], upreal[todo], NEIGHBOURS_3x3)
+    ix_m[todo], iy_m[todo] = x3, y3
+
+    still = e3 >= upreal[todo] * minerror
+    x5, y5, e5 = best_uparea_grid(uparea_cama, ix[todo[still]], iy[todo[still]], upreal[todo[still]], NEIGHBOURS_5x5)
+    ix_m[todo[still]], iy_m[todo[still]] = x5, y5
+    print('dams checked:', len(ix), ', searched:', len(todo), ', moved:', int(np.sum((ix_m != ix) | (iy_m != iy))))
+
+    dam_data_m = dam_data.copy()
+    dam_data_m['uparea_cama'] = uparea_cama[ix_m, iy_m]
+    dam_data_m['ix'] = ix_m + 1
+    dam_data_m['iy'] = iy_m + 1
+    print(dam_data_m)
+
+    dam_data_m.to_csv(outputfile, index=False)
+    print("file outputted to:", outputfile)
+    return outputfile
+
+
+
+def est_fldsto_totalsto(dam_file, tag, fldstorate=0.37):
+    '''
+    (c') flood control storage as a fixed fraction of the total capacity, without GRSAD/ReGeom
+    '''
+    output_file = tag + '/tmp_p03_fldsto.csv'
+
+    damcsv = pd.read_csv(dam_file)
+    damcsv['fldsto_mcm'] = damcsv['totalsto_mcm'].values * fldstorate
+    damcsv['consto_mcm'] = damcsv['totalsto_mcm']  - damcsv['fldsto_mcm']
+
+    stocsv = damcsv[['damid', 'damname', 'totalsto_mcm', 'fldsto_mcm', 'consto_mcm']]
+    stocsv.to_csv(output_file, index=None)
+    print('file outputted:', output_file)
+    return output_file
@@ -1,9 +1,6 @@
-import calendar
-from datetime import datetime
 import os
-import numpy as np
-import pandas as pd
 import sys
+from damparam import est_fldsto_totalsto
 
 print(os.path.basename(__file__))
 
@@ -12,22 +9,10 @@ print(os.path.basename(__file__))
 DAM_FILE = sys.argv[1]
 TAG = sys.argv[2]
 
-output_file = TAG+'/tmp_p03_fldsto.csv'
-
 fldstorate = 0.37
 
-####========================================================
-
-damcsv = pd.read_csv(DAM_FILE)
-
-damcsv['fldsto_mcm'] = damcsv['totalsto_mcm'].values * fldstorate
-damcsv['consto_mcm'] = damcsv['totalsto_mcm']  - damcsv['fldsto_mcm']
-
-stocsv = damcsv[['damid', 'damname', 'totalsto_mcm', 'fldsto_mcm', 'consto_mcm']]
-stocsv.to_csv(output_file, index=None)
-
-print('file outputted:', output_file)
+est_fldsto_totalsto(DAM_FILE, TAG, fldstorate)
 print('###########################################')
 print(' ')
 
-sys.exit()
\ No newline at end of file
+sys.exit()
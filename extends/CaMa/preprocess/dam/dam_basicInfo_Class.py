@@ -4,15 +4,25 @@ import os
 import numpy as np
 import pandas as pd
 import multiprocessing
-from collections import defaultdict
 import time
+from dam_context import DamPipelineContext
+from dam_kernels import keep_largest_per_grid
+from dam_logging import get_logger, start_progress, advance, stop_progress
 
+log = get_logger('dam_basicInfo')
 
 
+# instance used by the forked workers of p02; passing self.process_dam to the pool would
+# pickle the whole object, including the map arrays, for every chunk of dams
+_pool_self = None
+
+def _pool_process_dam(dam):
+    return _pool_self.process_dam(dam)
+
 
 class dam_basicInfo_Class:
    
-    def __init__(self, namelist):
+    def __init__(self, namelist, context=None):
 
         self.name       = 'dam_basicInfo_Class'
         self.version    = '0.1'
@@ -33,6 +43,9 @@ class dam_basicInfo_Class:
         if not os.path.exists(self.savedir):
             os.makedirs(self.savedir)
 
+        #-- map and dam table shared with the other stages
+        self.context    = context if context is not None else DamPipelineContext(namelist)
+
         # save file
         self.GRanD_of   = self.savedir + '/dam_inplist.csv'
         self.damfile    = self.savedir + '/damloc.csv'
@@ -55,15 +68,16 @@ class dam_basicInfo_Class:
         nan_rows = dam_inp['DAM_NAME'].isna()
         dam_inp.loc[nan_rows, 'DAM_NAME'] = "GRanD-" + dam_inp.loc[nan_rows, 'GRAND_ID'].astype(str)
         if self.debug :
-            print("dam_inp.loc[nan_rows, 'DAM_NAME']",dam_inp.loc[nan_rows, 'DAM_NAME'])
+            log.debug("dam_inp.loc[nan_rows, 'DAM_NAME'] %s", dam_inp.loc[nan_rows, 'DAM_NAME'])
 
         # update main_use
         dam_inp['MAIN_USE'] = dam_inp['MAIN_USE'].fillna('Other-NA')
         dam_inp['MAIN_USE'] = dam_inp['MAIN_USE'].str.replace(" ", "-")
         if self.debug :
-            print("dam_inp['MAIN_USE'].unique()",dam_inp['MAIN_USE'].unique())
+            log.debug("dam_inp['MAIN_USE'].unique() %s", dam_inp['MAIN_USE'].unique())
 
-        # save file
+        # keep the list for p02, and save file as checkpoint
+        self.dam_info = dam_inp.reset_index(drop=True)
         dam_inp.to_csv(self.GRanD_of, index=False)
 
         with open(self.GRanD_of, 'r') as f:
@@ -94,53 +108,54 @@ class dam_basicInfo_Class:
         
         out_vars = ['GRAND_ID','ix', 'iy', 'uparea_cama']
 
-        # read dam info
-        self.dam_info = pd.read_csv(self.GRanD_of, header=1)
+        # read dam info (checkpoint of p01 if it was not run in this process)
+        if getattr(self, 'dam_info', None) is None:
+            self.dam_info = pd.read_csv(self.GRanD_of, header=1)
         ndams    = self.dam_info.shape[0]
         if self.debug :
-            print(self.dam_info)
-            print("---------------------------")
-            print("")
+            log.debug('%s', self.dam_info)
         
         # read map files
-        fparam = os.path.join(self.mapdir, 'params.txt')
-        with open(fparam, 'r') as f:
-            lines = f.readlines()
-            self.nx = int(lines[0].split()[0])
-            self.ny = int(lines[1].split()[0])
-            self.gsize = float(lines[3].split()[0])
-            self.west = float(lines[4].split()[0])
-            self.east = float(lines[5].split()[0])
-            self.south = float(lines[6].split()[0])
-            self.north = float(lines[7].split()[0])
-        f.close()
+        cmap = self.context.cmap
+        self.nx, self.ny = cmap.nx, cmap.ny
+        self.gsize = cmap.gsize
+        self.west, self.east = cmap.west, cmap.east
+        self.south, self.north = cmap.south, cmap.north
         if self.debug :
-            print('Map Domain W-E-S-N: ', self.west, self.east, self.south, self.north)
-            print('Map Resolution    : ', self.gsize)
-            print('Map NX,NY         : ', self.nx, self.ny)
-            print("---------------------------")
-            print("")
+            log.debug('Map Domain W-E-S-N: %s %s %s %s', self.west, self.east, self.south, self.north)
+            log.debug('Map Resolution    : %s', self.gsize)
+            log.debug('Map NX,NY         : %s %s', self.nx, self.ny)
 
         # read map bin files
         self.read_bin_data()
         save_list = []
         # calculate ix iy for each dam
         if self.ptag:
-            print("parallel computing..................................")
-            pool = multiprocessing.Pool(self.ncores)
-            save_list = pool.map(self.process_dam, range(ndams))
+            log.info('parallel computing: %d dams on %d cores', ndams, self.ncores)
+            start_progress('dam_basicInfo', ndams, 'dams')
+            global _pool_self
+            _pool_self = self
+            pool = multiprocessing.get_context('fork').Pool(self.ncores)
+            save_list = pool.map(_pool_process_dam, range(ndams))
+            pool.close()
+            pool.join()
 
         else:
-            print("serial computing....................................")
+            log.info('serial computing: %d dams', ndams)
+            start_progress('dam_basicInfo', ndams, 'dams')
             for inp in range(ndams):
                 save_temp = self.process_dam(inp)
                 save_list.append(save_temp)
-        # print("save_list",save_list)
+        stop_progress(ndams)
+        nundef = sum(1 for save in save_list if save is None)
+        if nundef > 0:
+            log.info('%d dams could not be allocated on the map', nundef)
 
         # save data
         out_data = pd.DataFrame(save_list, columns = out_vars)
         out_data = out_data.sort_values(by=out_data.columns[0])
         out_data = pd.merge(self.dam_info,out_data,on='GRAND_ID')
+        self.damcsv = out_data
         out_data.to_csv(self.damtmpfile, index=False)
 
 
@@ -150,57 +165,31 @@ class dam_basicInfo_Class:
         # save file
         self.damfile = os.path.join(self.outdir, 'damloc.csv')
         
-        self.damcsv  = pd.read_csv(self.damtmpfile)
+        if getattr(self, 'damcsv', None) is None:
+            self.damcsv  = pd.read_csv(self.damtmpfile)
 
-        # treat multiple dams in one grid
+        # treat multiple dams in one grid: keep the dam with the largest capacity
         if self.debug :
-            print('')
-            print('treat multiple dams in one grid')
-        # count grids with multiple dams allocated
-        cnt = defaultdict(int)
-        for index, row in self.damcsv.iterrows():
-            grandid, ix, iy = row['GRAND_ID'], row['ix'], row['iy']
-            key = tuple([ix,iy])
-            cnt[key] += 1
+            log.debug('treat multiple dams in one grid')
+        keep = keep_largest_per_grid(self.damcsv, cap='CAP_MCM')
+        damcsv_update = self.damcsv[keep].copy()
         if self.debug :
-            print('cnt=', cnt)
-
-        # remove smaller dams in such grids
-        damcsv_update = self.damcsv.copy()
-        for k, v in cnt.items():
-            if v > 1:
-                if self.debug :
-                    print('')
-                    print('multiple dams on one grid!!:', k, v)
-                ix, iy = k
-                dams = self.damcsv.query('ix == @ix & iy == @iy')
-                maxsto = np.max(dams['CAP_MCM'])
-                rmdams = dams.query('CAP_MCM != @maxsto')
-                # if len(rmdams) == 0:
-                #     maxfsto = np.max(dams['fldsto_mcm'])
-                #     rmdams = dams.query('fldsto_mcm != @maxfsto')
-                if self.debug :
-                    print('remove:', rmdams)
-                damcsv_update.drop(index=rmdams.index, inplace=True)
-                if self.debug :
-                    print(damcsv_update.query('ix==@ix & iy==@iy'))
-        if self.debug :
-            print('-----------------------------------')
+            for index, row in self.damcsv[~keep].iterrows():
+                log.debug('multiple dams on one grid!! remove: %s %s %s %s', row['GRAND_ID'], row['ix'], row['iy'], row['CAP_MCM'])
 
         # remove dams with small drainage area
         if self.debug :
-            print('')
-            print('remove dams with small drainage area')
-            print('-----------------------------------')
+            log.debug('remove dams with small drainage area')
         damcsv_update = damcsv_update.query('uparea_cama >= @self.minuparea')
         damcsv_update = damcsv_update.dropna()
 
+        # hand the dam table over to the next stages
+        self.context.set_dams(damcsv_update)
 
         # save output
         damcsv_update.to_csv(self.damfile, index=None)
         if self.debug :
-            print(' ')
-            print('dam locations:', self.damfile)
+            log.debug('dam locations: %s', self.damfile)
 
         # add the first row
         with open(self.damfile, 'r') as f:
@@ -216,60 +205,40 @@ class dam_basicInfo_Class:
 
 
     def read_bin_data(self):
+        cmap = self.context.cmap
 
-        finp = os.path.join(self.mapdir, 'nextxy.bin')
-        with open(finp, 'rb') as f:
-            self.nextx = np.fromfile(f, dtype=np.int32, count=self.nx * self.ny, sep='')
-            self.nexty = np.fromfile(f, dtype=np.int32, count=self.nx * self.ny, sep='')
-        self.nextx = np.reshape(self.nextx, (self.nx, self.ny), order='F')
-        self.nexty = np.reshape(self.nexty, (self.nx, self.ny), order='F')
+        self.nextx, self.nexty = cmap.read('nextxy')
         if self.debug :
-            print('Read nextxy.bin successfully')
+            log.debug('Read nextxy.bin successfully')
 
-        finp = os.path.join(self.mapdir, 'basin.bin')
-        with open(finp, 'rb') as f:
-            self.basin = np.fromfile(f, dtype=np.int32, count=self.nx * self.ny, sep='')
-        self.basin = np.reshape(self.basin, (self.nx, self.ny), order='F')
+        self.basin = cmap.read('basin')
         if self.debug :
-            print('Read basin.bin successfully')
+            log.debug('Read basin.bin successfully')
 
-        finp = os.path.join(self.mapdir, 'upgrid.bin')
-        with open(finp, 'rb') as f:
-            self.upgrid = np.fromfile(f, dtype=np.int32, count=self.nx * self.ny, sep='')
-        self.upgrid = np.reshape(self.upgrid, (self.nx, self.ny), order='F')
+        self.upgrid = cmap.read('upgrid')
         if self.debug :
-            print('Read upgrid.bin successfully')
+            log.debug('Read upgrid.bin successfully')
 
-        finp = os.path.join(self.mapdir, 'uparea.bin')
-        with open(finp, 'rb') as f:
-            self.uparea = np.fromfile(f, dtype=np.float32, count=self.nx * self.ny, sep='')
-        self.uparea = np.reshape(self.uparea, (self.nx, self.ny), order='F')         
+        self.uparea = cmap.read('uparea')
         self.uparea = self.uparea * 1e-6      ##### unit conversion !!!!!!!!!
         if self.debug :
-            print('Read uparea.bin successfully')
+            log.debug('Read uparea.bin successfully')
 
-        finp = os.path.join(self.mapdir, 'ctmare.bin')
-        with open(finp, 'rb') as f:
-            self.ctmare = np.fromfile(f, dtype=np.float32, count=self.nx * self.ny, sep='')
-        self.ctmare = np.reshape(self.ctmare, (self.nx, self.ny), order='F')
+        self.ctmare = cmap.read('ctmare')
         if self.debug :
-            print('Read ctmare.bin successfully')
+            log.debug('Read ctmare.bin successfully')
 
-        finp = os.path.join(self.mapdir, 'elevtn.bin')
-        with open(finp, 'rb') as f:
-            self.elevtn = np.fromfile(f, dtype=np.float32, count=self.nx * self.ny, sep='')
-        self.elevtn = np.reshape(self.elevtn, (self.nx, self.ny), order='F')
+        self.elevtn = cmap.read('elevtn')
         if self.debug :
-            print('Read elevtn.bin successfully')
-
-        finp = os.path.join(self.mapdir, 'lonlat.bin')
-        with open(finp, 'rb') as f:
-            self.outlon = np.fromfile(f, dtype=np.float32, count=self.nx * self.ny, sep='')
-            self.outlat = np.fromfile(f, dtype=np.float32, count=self.nx * self.ny, sep='')
-        self.outlon = np.reshape(self.outlon, (self.nx, self.ny), order='F')
-        self.outlat = np.reshape(self.outlat, (self.nx, self.ny), order='F')
+            log.debug('Read elevtn.bin successfully')
+
+        self.outlon, self.outlat = cmap.read('lonlat')
         if self.debug :
-            print('Read lonlat.bin successfully')
+            log.debug('Read lonlat.bin successfully')
+
+        # hires catchment map used by calc_ixiy, read once before the workers are forked
+        if cmap.read_hires('15sec') is None:
+            cmap.read_hires('1min')
 
 
 
@@ -284,12 +253,11 @@ class dam_basicInfo_Class:
         ix = 0
         iy = 0
         if self.debug :
-            print('')
-            print("grandid:", grandid, " damname:", damname, " uparea:", upreal," lon:", lon, " lat:", lat, " totalsto:", totalsto)
-            print("nx:", self.nx, " ny:", self.ny,"west:", self.west, " north:", self.north,  ix, iy)
+            log.debug('grandid: %s damname: %s uparea: %s lon: %s lat: %s totalsto: %s', grandid, damname, upreal, lon, lat, totalsto)
+            log.debug('nx: %s ny: %s west: %s north: %s %s %s', self.nx, self.ny, self.west, self.north, ix, iy)
         ix,iy = self.calc_ixiy(lon, lat, ix, iy)
         if self.debug : 
-            print("ix,iy", ix, iy)
+            log.debug('ix,iy %s %s', ix, iy)
 
         if ix < 0 or iy < 0:
             for cnt in range(1, 5):
@@ -307,13 +275,14 @@ class dam_basicInfo_Class:
                     break
 
         if (ix < 0 or iy < 0):
-            print(grandid, damname, lon, lat, ix, iy, upreal, "undefined", totalsto)
+            log.debug('%s %s %s %s %s %s %s undefined %s', grandid, damname, lon, lat, ix, iy, upreal, totalsto)
+            advance()
 
             #-- save the identified ix iy
             # return grandid, ix, iy, -9999
 
         elif (ix > 0 and iy > 0):
-            print(grandid,damname, lon, lat, ix, iy, upreal, self.uparea[ix-1,iy-1], totalsto)
+            log.debug('%s %s %s %s %s %s %s %s %s', grandid, damname, lon, lat, ix, iy, upreal, self.uparea[ix-1,iy-1], totalsto)
 
             #-- check area error
             error = abs(self.uparea[ix-1,iy-1] - upreal)
@@ -321,6 +290,7 @@ class dam_basicInfo_Class:
                 ix, iy, error = self.modify_damloc(ix, iy, error, upreal, self.uparea)
 
             #-- save the identified ix iy
+            advance()
             return grandid, ix, iy, self.uparea[ix-1,iy-1]
 
 
@@ -328,30 +298,13 @@ class dam_basicInfo_Class:
         isHires = 0
         # print('')
 
-        # check 15sec hires map availability
-        floc = self.mapdir + '/15sec/location.txt'
-        if os.path.isfile(floc):
-            with open(floc, 'r') as f:
-                f.readline()
-                f.readline()
-                line = f.readline()
-                buf, tag, _, _, _, _, mx, my, csize = line.split()
-                mx=int(mx)
-                my=int(my)
-                csize=np.float32(csize)
-            if tag == '15sec':
+        # check 15sec hires map availability (read once and kept in the context)
+        hires = self.context.cmap.read_hires('15sec')
+        if hires is not None:
             #print('USE 15sec hires map')
                 isHires = 15
 
-                catmx = np.zeros((mx, my), dtype=np.int32)
-                catmy = np.zeros((mx, my), dtype=np.int32)
-                finp = self.mapdir + '/15sec/15sec.catmxy.bin'
-                print('finp', finp)
-                with open(finp, 'rb') as f:
-                    catmx_bytes = f.read(2*mx*my)
-                    catmx = np.frombuffer(catmx_bytes, dtype=np.int16).astype(np.int32).reshape((mx, my))
-                    catmy_bytes = f.read(2*mx*my)
-                    catmy = np.frombuffer(catmy_bytes, dtype=np.int16).astype(np.int32).reshape((mx, my))
+                mx, my, csize, catmx, catmy = hires
 
                 jx = int((lon-self.west)/csize) + 1
                 jy = int((self.north-lat)/csize) + 1
@@ -370,22 +323,10 @@ class dam_basicInfo_Class:
 
         if isHires != 15:
             # check 1min hires map availability
-            floc = self.mapdir + '/1min/location.txt'
-            if os.path.isfile(floc):
-                with open(floc, 'r') as f:
-                    f.readline()
-                    f.readline()
-                    line = f.readline()
-                    buf, tag, _, _, _, _, mx, my, csize = line.split()
-                    mx=int(mx)
-                    my=int(my)
-                    csize=np.float32(csize)
-                if tag == '1min':
+            hires = self.context.cmap.read_hires('1min')
+            if hires is not None:
                     isHires = 60
-                    finp = self.mapdir + '/1min/1min.catmxy.bin'
-                    with open(finp, 'rb') as f:
-                        catmx = np.fromfile(f, dtype=np.int16, count=mx*my).reshape((mx, my), order='F')
-                        catmy = np.fromfile(f, dtype=np.int16, count=mx*my).reshape((mx, my), order='F')
+                    mx, my, csize, catmx, catmy = hires
                     jx = int((lon - self.west) / csize) + 1
                     jy = int((self.north - lat) / csize) + 1
                     if jx <= 0 or jx > mx or jy <= 0 or jy > my:
@@ -410,7 +351,7 @@ class dam_basicInfo_Class:
         if ix > 0 and iy > 0:
         # print("nextx(ix,iy):", nextx[ix-1, iy-1])
             if self.nextx[ix-1, iy-1] == -9999:
-                print('NOT LAND GRID')
+                log.debug('NOT LAND GRID: %s %s', lon, lat)
                 ix = -99
                 iy = -99
         # print(ix,iy)
@@ -424,8 +365,8 @@ class dam_basicInfo_Class:
 
     def modify_damloc(self, ix, iy, error, upreal, uparea):
         if self.debug :
-            print("error >= uparea_real*minerror ; modify dam location")
-            print("uparea_real=", upreal, " uparea=", uparea[ix-1,iy-1], " error=", error)  
+            log.debug('error >= uparea_real*minerror ; modify dam location')
+            log.debug('uparea_real= %s uparea= %s error= %s', upreal, uparea[ix-1,iy-1], error)
 
         # searching -------------------------------------------
         ix_m,iy_m = ix,iy
@@ -442,12 +383,11 @@ class dam_basicInfo_Class:
                     ix_m, iy_m = ix_tmp, iy_tmp
                     error_m = error_tmp
                 if self.debug :
-                    print("modified location:", ix_m, iy_m, 'up_real=', uparea[ix_m-1,iy_m-1], 'error=', error_m)
+                    log.debug('modified location: %s %s up_real= %s error= %s', ix_m, iy_m, uparea[ix_m-1,iy_m-1], error_m)
 
         if error_m >= self.minerror * upreal:
             if self.debug :
-                print('')
-                print("still have error >= minerror!!!!!!")
+                log.debug('still have error >= minerror!!!!!!')
             ix_m,iy_m = ix,iy
             error_m   = error
 
@@ -463,10 +403,10 @@ class dam_basicInfo_Class:
                         ix_m, iy_m = ix_tmp, iy_tmp
                         error_m = error_tmp
                         if self.debug :
-                            print("modified location:", ix_m, iy_m, 'up_cama=', uparea[ix_m-1,iy_m-1], 'error=', error_m)
+                            log.debug('modified location: %s %s up_cama= %s error= %s', ix_m, iy_m, uparea[ix_m-1,iy_m-1], error_m)
         
         if self.debug :
-            print("final modified location:", ix_m, iy_m, 'up_cama=' ,uparea[ix_m-1,iy_m-1], 'error=', error_m)
+            log.debug('final modified location: %s %s up_cama= %s error= %s', ix_m, iy_m, uparea[ix_m-1,iy_m-1], error_m)
 
         return ix_m,iy_m,error_m
 
@@ -476,22 +416,23 @@ class dam_basicInfo_Class:
     def check_dir(self,dir):
         if os.path.exists(dir):
             if self.debug :
-                print (dir+' exists')
+                log.debug('%s exists', dir)
         else:
             os.makedirs(dir)
             if self.debug :
-                print (dir+' created')
+                log.debug('%s created', dir)
 
 
 
     def main_func(self):
         start_time = time.time()
 
-        print('--- Start Process Dam Basic Info ---')
+        log.info('--- Start Process Dam Basic Info ---')
         self.p01_creat_damlist()
         self.p02_identify_damloc()
         self.p03_complete_damcsv()
-        print('--- Done ---')
+        log.info('--- Done: dam_basicInfo, %.1f s ---', time.time() - start_time)
+        return self.context
 
 
 
@@ -0,0 +1,403 @@
+'''
+Benchmark suite for the dam pipeline on synthetic datasets (dam_synthetic.py)
+
+Each stage (dam_basicInfo, dam_discharge, dam_storage, dam_wuse) is run in its own process
+and measured, once on its own (stages) and once the way dam_pipeline runs it (stages_context:
+one shared DamPipelineContext, the map rasters of the stage read before it is forked and the
+dam table loaded once dam_basicInfo is done, so that reading is not part of the stage):
+    wall_s        wall-clock time of the stage
+    peak_rss_mb   peak resident memory of the stage process and of its pool workers
+    files_opened  files opened through Python I/O by the stage and its workers
+                  (netCDF files opened by the netCDF4 C library are not counted)
+
+The results are written as JSON (bench_results/dam_bench_{size}_{time}.json by default) and can
+be compared with an earlier run with --baseline.  The registered equivalence checks (CHECKS)
+verify that the fast paths give the same outputs as the reference implementations (e.g. the
+pipeline vs. the stages run on their own, the kernels of dam_kernels.py vs. the per-dam loops
+they replace, the cost of the context runs vs. the stages run on their own); a failed check
+makes the
+benchmark exit with status 1.
+
+Usage:
+    python dam_benchmark.py [--size toy] [--years 3] [--hires] [--workdir DIR] [--baseline FILE]
+
+Oct 2026
+'''
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import read_nml as nml
+from dam_context import CamaMap, DamPipelineContext
+from dam_pipeline import STAGES, dam_pipeline_Class, run_stage
+from dam_synthetic import SIZES, dam_synthetic_Class
+
+
+#-- a stage run with the shared context may take at most CONTEXT_FACTOR times the wall time
+#   and peak RSS of the stage run on its own, plus a slack for the noise of short runs
+CONTEXT_FACTOR = 2.0
+CONTEXT_SLACK  = {'wall_s': 0.5, 'peak_rss_mb': 50.0}
+
+
+
+def _measure_stage(stage, namelist, context, queue):
+    '''
+    Run one stage in the current (child) process and put its measurements on the queue
+    '''
+    # import the stage module first, so module files are not counted as opened files
+    __import__(STAGES[stage]['class'][0])
+    nopen = multiprocessing.Value('L', 0)
+
+    def audit(event, args):
+        if event == 'open':
+            with nopen.get_lock():
+                nopen.value += 1
+    sys.addaudithook(audit)
+
+    start = time.time()
+    run_stage(stage, namelist, context)
+    wall = time.time() - start
+
+    # ru_maxrss is in KB on Linux
+    rss_self     = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    queue.put({'wall_s'      : round(wall, 4),
+               'peak_rss_mb' : round(max(rss_self, rss_children) / 1024.0, 1),
+               'files_opened': int(nopen.value)})
+
+
+
+def compare_outputs(dir_ref, dir_new, rtol=1e-6):
+    '''
+    Compare the files of two Save_Dir trees: csv by value, bin as float32, other files by content
+    '''
+    diffs = []
+    for path_ref in sorted(glob.glob(os.path.join(dir_ref, '**', '*'), recursive=True)):
+        if not os.path.isfile(path_ref) or path_ref.endswith(('.json', '.log')):
+            continue
+        rel      = os.path.relpath(path_ref, dir_ref)
+        path_new = os.path.join(dir_new, rel)
+        if not os.path.isfile(path_new):
+            diffs.append(f'{rel}: missing')
+            continue
+        if path_ref.endswith('.bin'):
+            a = np.fromfile(path_ref, dtype=np.float32)
+            b = np.fromfile(path_new, dtype=np.float32)
+            same = a.shape == b.shape and np.allclose(a, b, rtol=rtol, equal_nan=True)
+        elif path_ref.endswith('.csv'):
+            # the first row of some files is the NDAMS line, so compare row by row
+            with open(path_ref, 'r') as f1, open(path_new, 'r') as f2:
+                a, b = list(csv.reader(f1)), list(csv.reader(f2))
+            same = len(a) == len(b) and all(_same_row(ra, rb, rtol) for ra, rb in zip(a, b))
+        else:
+            with open(path_ref, 'rb') as f1, open(path_new, 'rb') as f2:
+                same = f1.read() == f2.read()
+        if not same:
+            diffs.append(f'{rel}: values differ')
+    return diffs
+
+
+def _same_row(a, b, rtol):
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if x == y:
+            continue
+        try:
+            if not np.isclose(float(x), float(y), rtol=rtol, equal_nan=True):
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+
+def check_pipeline_context(bench):
+    '''
+    dam_pipeline_Class (stages sharing one DamPipelineContext) and the measured context runs
+    vs. every stage class run on its own, reading its inputs from the csv checkpoints (the
+    reference flow of test.py, Save_Dir of the benchmark)
+    '''
+    dir_ref  = bench.namelist['General']['Save_Dir']
+    namelist = bench.namelist_copy('save_pipeline')
+    state    = dam_pipeline_Class(namelist).main_func()
+    diffs    = [f'{stage}: {status}' for stage, status in state.items() if status != 'done']
+    diffs   += compare_outputs(dir_ref, namelist['General']['Save_Dir'])
+    dir_ctx  = os.path.join(bench.datadir, 'save_context')
+    if os.path.isdir(dir_ctx):
+        diffs += ['stages_context: ' + d for d in compare_outputs(dir_ref, dir_ctx)]
+    return len(diffs) == 0, diffs
+
+
+def check_context_cost(bench):
+    '''
+    Wall time and peak RSS of every stage run with the shared context (stages_context) vs.
+    the same stage run on its own (stages)
+    '''
+    diffs = []
+    for stage, ref in bench.stages.items():
+        new = bench.stages_context[stage]
+        for key, slack in CONTEXT_SLACK.items():
+            if new[key] > CONTEXT_FACTOR * ref[key] + slack:
+                diffs.append(f'{stage}: {key} {new[key]} with the context, {ref[key]} on its own')
+    return len(diffs) == 0, diffs
+
+
+def check_kernels(bench):
+    '''
+    Array kernels of dam_kernels.py vs. the per-dam loops they replace, on the dataset inputs
+    '''
+    import netCDF4 as nc
+    import dam_kernels as dk
+    general = bench.namelist['General']
+    savedir = general['Save_Dir']
+    diffs   = []
+
+    def same(a, b):
+        return all(np.array_equal(x, y, equal_nan=True) for x, y in zip(np.atleast_1d(a), np.atleast_1d(b)))
+
+    #-- outflow gather reader and peak detection
+    dams  = pd.read_csv(os.path.join(savedir, 'tmp_damloc.csv')).dropna()
+    ix    = dams['ix'].values.astype(int) - 1
+    iy    = dams['iy'].values.astype(int) - 1
+    syear = bench.namelist['dam_discharge']['Start_Year']
+    fsim  = os.path.join(bench.namelist['dam_discharge']['Sim_Dir'], f'o_outflw{syear}.nc')
+    with nc.Dataset(fsim, 'r') as cdf:
+        full = cdf.variables['outflw'][:][:, iy, ix]
+    gather = dk.read_outflw_nc(fsim, ix, iy)
+    if not np.array_equal(np.ma.getdata(full), np.ma.getdata(gather)):
+        diffs.append('read_outflw_nc')
+    if not np.array_equal(dk.annual_peaks(gather), dk.annual_peaks_ref(np.ma.getdata(gather))):
+        diffs.append('annual_peaks')
+
+    #-- Gumbel fit of the annual maxima
+    amax = np.fromfile(os.path.join(savedir, 'tmp_p01_AnnualMax.bin'), 'float32')
+    amax = amax.reshape(-1, len(pd.read_csv(bench.namelist['General']['Save_Dir'] + '/damloc.csv', header=1)))
+    if not np.array_equal(dk.gumbel_return_level(amax, 100), dk.gumbel_return_level_ref(amax, 100), equal_nan=True):
+        diffs.append('gumbel_return_level')
+
+    #-- ReGeom interpolation at the GRSAD percentiles
+    regeomdir = bench.namelist['dam_storage']['ReGeomdir']
+    for fregeom in sorted(glob.glob(os.path.join(regeomdir, '*.csv')))[:200]:
+        fgrsad = os.path.join(bench.namelist['dam_storage']['GRSADdir'], os.path.basename(fregeom)[:-4] + '_intp')
+        if not os.path.isfile(fgrsad):
+            continue
+        data = dk.read_grsad_area(fgrsad)
+        depth, area, storage = dk.read_regeom(fregeom)
+        if len(data) < 2 or len(area) < 2:
+            continue
+        targets = [np.percentile(data, pc) * area[-1] / np.max(data) for pc in (1, 50, 75, 99)]
+        new = dk.storage_at_area(area, storage, targets, 1000.0)
+        ref = [dk.storage_at_area_ref(area, storage, t, 1000.0) for t in targets]
+        if not same(new, ref) or not all(same(dk.use_storage_at_area(area, storage, t, 1000.0),
+                                              dk.use_storage_at_area_ref(area, storage, t, 1000.0)) for t in targets):
+            diffs.append('storage_at_area: ' + fregeom)
+
+    #-- duplicate removal, with a few dams moved onto the grid of their neighbour
+    dup = dams.copy().reset_index(drop=True)
+    for i in range(0, len(dup) - 1, 7):
+        dup.loc[i, ['ix', 'iy']] = dup.loc[i + 1, ['ix', 'iy']].values
+        if i % 2 == 0:
+            dup.loc[i, 'CAP_MCM'] = dup.loc[i + 1, 'CAP_MCM']
+    for tiebreak in (None, 'uparea_cama'):
+        if not np.array_equal(dk.keep_largest_per_grid(dup, 'CAP_MCM', tiebreak),
+                              dk.keep_largest_per_grid_ref(dup, 'CAP_MCM', tiebreak)):
+            diffs.append(f'keep_largest_per_grid (tiebreak {tiebreak})')
+
+    #-- drainage area search around the dams
+    uparea = CamaMap(general['Map_Dir']).read('uparea') * 1e-6
+    upreal = dams['CATCH_SKM'].values
+    for neighbours in (dk.NEIGHBOURS_3x3, dk.NEIGHBOURS_5x5):
+        if not same(dk.best_uparea_grid(uparea, ix, iy, upreal, neighbours),
+                    dk.best_uparea_grid_ref(uparea, ix, iy, upreal, neighbours)):
+            diffs.append(f'best_uparea_grid ({len(neighbours)} neighbours)')
+    return len(diffs) == 0, diffs
+
+
+#-- equivalence checks: name -> function(bench) returning (ok, details)
+CHECKS = {
+    'pipeline_context': check_pipeline_context,
+    'context_cost'    : check_context_cost,
+    'kernels'         : check_kernels,
+}
+
+
+
+class dam_benchmark_Class:
+
+    def __init__(self, workdir, size='toy', years=3, hires=False, ncores=4, para=False,
+                 repeat=1, checks=True):
+
+        self.name     = 'dam_benchmark_Class'
+        self.version  = '0.1'
+        self.release  = '0.1'
+        self.date     = 'Oct 2026'
+
+        self.workdir  = os.path.abspath(workdir)
+        self.size     = size
+        self.years    = years
+        self.hires    = hires
+        self.ncores   = ncores
+        self.para     = para
+        self.repeat   = repeat
+        self.checks   = checks
+
+        #-- synthetic dataset, generated once per (size, years, hires)
+        self.datadir  = os.path.join(self.workdir, f'{size}_y{years}' + ('_hires' if hires else ''))
+        nml_file      = os.path.join(self.datadir, 'dam.nml')
+        gen           = dam_synthetic_Class(self.datadir, size, years, hires=hires)
+        if not os.path.isfile(nml_file):
+            gen.main_func(ncores, para)
+        else:
+            gen.write_namelist(ncores, para)
+        self.namelist = nml.read_namelist(nml_file)
+
+
+    def namelist_copy(self, savedir):
+        '''
+        Namelist writing to another Save_Dir of the dataset (emptied first)
+        '''
+        namelist = json.loads(json.dumps(self.namelist))
+        path = os.path.join(self.datadir, savedir)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        namelist['General']['Save_Dir'] = path
+        return namelist
+
+
+    def run_stages(self, shared=False):
+        '''
+        Time every stage in its own process; the fastest of self.repeat runs is kept.
+        With shared, the stages get one DamPipelineContext as in dam_pipeline (Save_Dir save_context)
+        '''
+        results  = {}
+        ctx      = multiprocessing.get_context('fork')
+        namelist = self.namelist_copy('save_context') if shared else self.namelist
+        context  = DamPipelineContext(namelist) if shared else None
+        for stage in STAGES:
+            if shared:
+                context.preload(STAGES[stage]['maps'])
+            best = None
+            for _ in range(self.repeat):
+                queue = ctx.Queue()
+                proc  = ctx.Process(target=_measure_stage, args=(stage, namelist, context, queue))
+                proc.start()
+                proc.join()
+                if proc.exitcode != 0:
+                    raise RuntimeError(f'{stage} failed with exit code {proc.exitcode}')
+                res = queue.get()
+                if best is None or res['wall_s'] < best['wall_s']:
+                    best = res
+            if shared:
+                context.release()
+            results[stage] = best
+            print(f'[{stage}{" context" if shared else ""}] {best}')
+            if shared and 'damloc.csv' in STAGES[stage]['outputs']:
+                context.load_damloc()
+        return results
+
+
+    def main_func(self):
+        print(f'--- Start Dam Benchmark: {self.size}, {self.years} years ---')
+        self.namelist = self.namelist_copy('save')
+        self.stages         = self.run_stages()
+        self.stages_context = self.run_stages(shared=True)
+
+        checks = {}
+        if self.checks:
+            for name, func in CHECKS.items():
+                start = time.time()
+                ok, details = func(self)
+                checks[name] = {'ok': bool(ok), 'details': details, 'seconds': round(time.time() - start, 3)}
+                print(f'[check {name}] {"ok" if ok else "FAILED"}', '' if ok else details)
+
+        gen = SIZES[self.size]
+        self.results = {
+            'size'     : self.size,
+            'nx'       : gen['nx'],
+            'ny'       : gen['ny'],
+            'ndams'    : int(pd.read_csv(self.namelist['General']['Save_Dir'] + '/damloc.csv', header=1).shape[0]),
+            'years'    : self.years,
+            'hires'    : self.hires,
+            'ncores'   : self.ncores,
+            'para'     : self.para,
+            'repeat'   : self.repeat,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'host'     : platform.node(),
+            'cpu_count': os.cpu_count(),
+            'python'   : platform.python_version(),
+            'numpy'    : np.__version__,
+            'pandas'   : pd.__version__,
+            'stages'   : self.stages,
+            'stages_context': self.stages_context,
+            'checks'   : checks,
+        }
+        print('--- Done ---')
+        return self.results
+
+
+    def write_results(self, resultdir):
+        os.makedirs(resultdir, exist_ok=True)
+        fout = os.path.join(resultdir, f'dam_bench_{self.size}_{time.strftime("%Y%m%d-%H%M%S")}.json')
+        with open(fout, 'w') as f:
+            json.dump(self.results, f, indent=2)
+        print('results saved:', fout)
+        return fout
+
+
+    def compare_baseline(self, baseline_file):
+        '''
+        Print the change of every stage measurement relative to an earlier result file
+        '''
+        with open(baseline_file, 'r') as f:
+            base = json.load(f)
+        if base.get('size') != self.size or base.get('years') != self.years:
+            print('Warning: baseline was run on another dataset:', base.get('size'), base.get('years'), 'years')
+        print(f'{"stage":23s} {"wall_s":>22s} {"peak_rss_mb":>22s} {"files_opened":>16s}')
+        for key in ('stages', 'stages_context'):
+            for stage, new in self.results[key].items():
+                old = base.get(key, {}).get(stage)
+                if old is None:
+                    continue
+                label = stage if key == 'stages' else stage + ' context'
+                ratio = old['wall_s'] / new['wall_s'] if new['wall_s'] > 0 else float('inf')
+                print(f'{label:23s} {old["wall_s"]:8.3f} -> {new["wall_s"]:8.3f} (x{ratio:4.1f})'
+                      f' {old["peak_rss_mb"]:8.1f} -> {new["peak_rss_mb"]:8.1f}'
+                      f' {old["files_opened"]:6d} -> {new["files_opened"]:6d}')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the dam pipeline stages on a synthetic dataset')
+    parser.add_argument('--size', default='toy', choices=list(SIZES.keys()))
+    parser.add_argument('--years', type=int, default=3, help='number of natsim years')
+    parser.add_argument('--hires', action='store_true', help='use a 1min catmxy map in dam_basicInfo')
+    parser.add_argument('--ncores', type=int, default=4, help='Num_Cores of the stages')
+    parser.add_argument('--para', action='store_true', help='run the stages with Para_Tag = True')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the fastest is kept')
+    parser.add_argument('--workdir', default='./bench_data', help='where the synthetic datasets are kept')
+    parser.add_argument('--results', default='./bench_results', help='where the JSON results are written')
+    parser.add_argument('--baseline', default=None, help='earlier JSON result to compare with')
+    parser.add_argument('--no-checks', action='store_true', help='skip the equivalence checks')
+    args = parser.parse_args()
+
+    bench = dam_benchmark_Class(args.workdir, args.size, args.years, args.hires, args.ncores,
+                                args.para, args.repeat, not args.no_checks)
+    results = bench.main_func()
+    bench.write_results(args.results)
+    if args.baseline:
+        bench.compare_baseline(args.baseline)
+    if not all(c['ok'] for c in results['checks'].values()):
+        sys.exit(1)
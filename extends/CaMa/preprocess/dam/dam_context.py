@@ -0,0 +1,195 @@
+'''
+Shared in-memory state of the dam parameterization stages
+
+DamPipelineContext is created once from the namelist and handed from one stage to the next:
+it holds the parsed namelist, the CaMa-Flood map (CamaMap, rasters loaded on first use and
+kept, or by preload before a stage process is forked and dropped by release once it is) and
+the current dam table as typed numpy arrays.  The csv files written by the stages
+(dam_inplist.csv, damloc.csv, ...) are checkpoints; a stage only reads damloc.csv back when
+the context does not hold a dam table yet, e.g. when dam_basicInfo was skipped.
+
+Oct 2026
+'''
+import os
+import numpy as np
+import pandas as pd
+
+
+#-- map files: (dtype, number of nx*ny fields)
+MAP_FILES = {
+    'nextxy': (np.int32,   2),
+    'basin' : (np.int32,   1),
+    'upgrid': (np.int32,   1),
+    'uparea': (np.float32, 1),
+    'ctmare': (np.float32, 1),
+    'elevtn': (np.float32, 1),
+    'grdare': (np.float32, 1),
+    'lonlat': (np.float32, 2),
+}
+
+#-- columns of damloc.csv and their types in the dam table
+DAM_FIELDS = {
+    'GRAND_ID'   : np.int64,
+    'DAM_NAME'   : object,
+    'LONG_DD'    : np.float64,
+    'LAT_DD'     : np.float64,
+    'CAP_MCM'    : np.float64,
+    'CATCH_SKM'  : np.float64,
+    'MAIN_USE'   : object,
+    'YEAR'       : np.int64,
+    'ix'         : np.int32,
+    'iy'         : np.int32,
+    'uparea_cama': np.float64,
+}
+
+
+
+class CamaMap:
+    '''
+    CaMa-Flood map of Map_Dir: domain from params.txt, rasters read on first access
+    '''
+
+    def __init__(self, mapdir):
+        self.mapdir = mapdir
+        self.fields = {}
+        self.hires  = {}
+
+        fparam = os.path.join(self.mapdir, 'params.txt')
+        with open(fparam, 'r') as f:
+            lines = f.readlines()
+        self.nx    = int(lines[0].split()[0])
+        self.ny    = int(lines[1].split()[0])
+        self.gsize = float(lines[3].split()[0])
+        self.west  = float(lines[4].split()[0])
+        self.east  = float(lines[5].split()[0])
+        self.south = float(lines[6].split()[0])
+        self.north = float(lines[7].split()[0])
+
+
+    def read(self, name):
+        '''
+        Return the (nx, ny) field(s) of {name}.bin; two-field files (nextxy, lonlat) give a tuple
+        '''
+        if name not in self.fields:
+            dtype, nfield = MAP_FILES[name]
+            finp = os.path.join(self.mapdir, name + '.bin')
+            with open(finp, 'rb') as f:
+                data = [np.reshape(np.fromfile(f, dtype=dtype, count=self.nx * self.ny),
+                                   (self.nx, self.ny), order='F') for _ in range(nfield)]
+            self.fields[name] = data[0] if nfield == 1 else tuple(data)
+        return self.fields[name]
+
+
+    def read_hires(self, tag):
+        '''
+        Return (mx, my, csize, catmx, catmy) of the {tag} ('15sec' or '1min') hires map,
+        or None if Map_Dir/{tag}/location.txt does not describe such a map
+        '''
+        if tag not in self.hires:
+            self.hires[tag] = None
+            floc = os.path.join(self.mapdir, tag, 'location.txt')
+            if os.path.isfile(floc):
+                with open(floc, 'r') as f:
+                    f.readline()
+                    f.readline()
+                    line = f.readline()
+                buf, loc_tag, _, _, _, _, mx, my, csize = line.split()
+                mx, my, csize = int(mx), int(my), np.float32(csize)
+                if loc_tag == tag:
+                    finp = os.path.join(self.mapdir, tag, tag + '.catmxy.bin')
+                    with open(finp, 'rb') as f:
+                        catmx = np.fromfile(f, dtype=np.int16, count=mx*my)
+                        catmy = np.fromfile(f, dtype=np.int16, count=mx*my)
+                    # keep the array layout used by calc_ixiy for each resolution
+                    if tag == '15sec':
+                        catmx = catmx.astype(np.int32).reshape((mx, my))
+                        catmy = catmy.astype(np.int32).reshape((mx, my))
+                    else:
+                        catmx = catmx.reshape((mx, my), order='F')
+                        catmy = catmy.reshape((mx, my), order='F')
+                    self.hires[tag] = (mx, my, csize, catmx, catmy)
+        return self.hires[tag]
+
+
+
+class DamPipelineContext:
+    '''
+    State shared by dam_basicInfo, dam_discharge, dam_storage and dam_wuse
+    '''
+
+    def __init__(self, namelist):
+        self.namelist = namelist
+        self.mapdir   = namelist['General']['Map_Dir' ]
+        self.savedir  = namelist['General']['Save_Dir']
+        self.damfile  = self.savedir + '/damloc.csv'
+        self._cmap    = None
+        self.dams     = None     # dict of column name -> numpy array
+
+
+    @property
+    def cmap(self):
+        if self._cmap is None:
+            self._cmap = CamaMap(self.mapdir)
+        return self._cmap
+
+
+    def preload(self, names):
+        '''
+        Read the given rasters ('hires': the 15sec catchment map, else the 1min one) now, so
+        that processes forked afterwards inherit them instead of reading them again
+        '''
+        cmap = self.cmap
+        for name in names:
+            if name == 'hires':
+                if cmap.read_hires('15sec') is None:
+                    cmap.read_hires('1min')
+            else:
+                cmap.read(name)
+
+
+    def release(self):
+        '''
+        Drop the rasters read so far; processes already forked keep their own copy
+        '''
+        if self._cmap is not None:
+            self._cmap.fields.clear()
+            self._cmap.hires.clear()
+
+
+    @property
+    def ndams(self):
+        return len(self.dam_table()['GRAND_ID'])
+
+
+    def set_dams(self, df):
+        '''
+        Replace the dam table by the rows of a DataFrame, converted to typed arrays
+        '''
+        self.dams = {}
+        for column in df.columns:
+            values = df[column].values
+            dtype  = DAM_FIELDS.get(column)
+            if dtype is not None and dtype is not object:
+                values = values.astype(dtype)
+            self.dams[column] = np.asarray(values)
+
+
+    def load_damloc(self):
+        '''
+        (Re)load the dam table from the damloc.csv checkpoint (first row: NDAMS)
+        '''
+        self.set_dams(pd.read_csv(self.damfile, header=1))
+        return self.dams
+
+
+    def dam_table(self):
+        if self.dams is None:
+            self.load_damloc()
+        return self.dams
+
+
+    def dam_frame(self):
+        '''
+        DataFrame view of the dam table, for the stages working on pandas objects
+        '''
+        return pd.DataFrame(self.dam_table())
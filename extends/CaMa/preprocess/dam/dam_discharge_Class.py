@@ -1,6 +1,7 @@
 import calendar
+import multiprocessing
 from datetime import datetime
-from multiprocessing import Pool, sharedctypes
+from multiprocessing import sharedctypes
 import os
 import numpy as np
 import matplotlib.pyplot as plt
@@ -8,12 +9,28 @@ import matplotlib.ticker as tick
 import pandas as pd
 import matplotlib.dates as mdates
 from matplotlib import colors
-from scipy.signal import argrelmax
 import sys
-import netCDF4 as nc
+import time
+from dam_context import DamPipelineContext
+from dam_kernels import read_outflw_nc, annual_peaks, gumbel_return_level, plotting_position
+from dam_logging import get_logger, start_progress, advance, stop_progress
+
+log = get_logger('dam_discharge')
+
+
+# instance used by the forked workers; passing self.read_outflw_* to the pool would pickle the
+# whole object, including the shared context and its map arrays, for every task
+_pool_self = None
+
+def _pool_read_outflw_p01(inp):
+    return _pool_self.read_outflw_p01(inp)
+
+def _pool_read_outflw_opt(inp):
+    return _pool_self.read_outflw_opt(inp)
+
 
 class dam_discharge_Class:
-    def __init__(self, namelist):
+    def __init__(self, namelist, context=None):
 
         self.name     = 'dam_discharge_Class'
         self.version  = '0.1'
@@ -46,15 +63,17 @@ class dam_discharge_Class:
         self.Q100_file   = self.outdir + '/tmp_p02_100year.bin'
         self.fc_outf     = self.outdir + '/damfcperiod.csv'
 
-        self.damcsv = pd.read_csv(self.dam_file,header=1)
+        #-- dam table shared with the other stages (damloc.csv if not in memory yet)
+        self.context = context if context is not None else DamPipelineContext(namelist)
+        self.damcsv = self.context.dam_frame()
         self.ndams  = len(self.damcsv)
         self.x_arr  = self.damcsv['ix'].values - 1
         self.y_arr  = self.damcsv['iy'].values - 1
         self.x_arr  = self.x_arr.astype(int)
         self.y_arr  = self.y_arr.astype(int)
-        print('x_arr of dams: ', self.x_arr)
-        print('y_arr of dams: ', self.y_arr)
-        print('shape of x_arr: ', self.x_arr.shape)
+        log.debug('x_arr of dams: %s', self.x_arr)
+        log.debug('y_arr of dams: %s', self.y_arr)
+        log.debug('shape of x_arr: %s', self.x_arr.shape)
 
         self.mean_yeararray  = np.ctypeslib.as_ctypes(np.zeros((self.years, self.ndams), dtype=np.float32))
         self.max_finarray    = np.ctypeslib.as_ctypes(np.zeros((self.years*self.maxdays, self.ndams), dtype=np.float32))
@@ -74,8 +93,7 @@ class dam_discharge_Class:
     def read_outflw_p01(self, inp):
         year = self.year_list[inp]
 
-        print(' ')
-        print('read natsim outflw: year=', year)
+        log.debug('read natsim outflw: year= %s', year)
 
         self.mean_yeararray   = np.ctypeslib.as_array(self.shared_array_mean_yeararray)
         self.max_finarray     = np.ctypeslib.as_array(self.shared_array_max_finarray  )
@@ -84,35 +102,21 @@ class dam_discharge_Class:
         # outflw_file = simdir + '/outflw' + str(year) + '.bin'
         # outflw_all = np.fromfile(outflw_file, 'float32').reshape(-1,ny,nx)
 
-        ## read NAT outflw-nc
+        ## read NAT outflw-nc: daily outflw of the dam grids
         outflw_file = self.simdir + '/o_outflw' + str(year) + '.nc'
-        with nc.Dataset(outflw_file, "r") as cdf:
-            outflw_all = cdf.variables["outflw"][:]
-        # print(outflw_file)
-
-        ## dam outflw: daily
-        outflw_dam = outflw_all[:,self.y_arr,self.x_arr]
+        outflw_dam = read_outflw_nc(outflw_file, self.x_arr, self.y_arr)
 
         ## dam outflw: annual average
         self.mean_yeararray[inp,:] = np.mean(outflw_dam, axis=0)
 
         ## dam outflw: annual maximum
-        for j, row in self.damcsv.iterrows():
-            outflw = outflw_dam[:,j]
-            maxindex = argrelmax(outflw, order=8*7)
-            maxarray = outflw[maxindex]
-            maxarray_sorted = np.sort(maxarray)[::-1]
-            if len(maxarray_sorted) > 0:
-                self.max_finarray[inp * self.maxdays : (inp+1)*self.maxdays, j] = maxarray_sorted[0:self.maxdays]
-            else:
-                outflw_sorted = np.sort(outflw)[::-1]
-                self.max_finarray[inp * self.maxdays : (inp+1)*self.maxdays, j] = outflw_sorted[0:self.maxdays]
+        self.max_finarray[inp * self.maxdays : (inp+1)*self.maxdays, :] = annual_peaks(outflw_dam, self.maxdays)
+        advance()
 
     def read_outflw_opt(self, inp):
         year = self.year_list[inp]
 
-        print(' ')
-        print('read natsim outflw: year=', year)
+        log.debug('read natsim outflw: year= %s', year)
 
         self.mean_montharray  = np.ctypeslib.as_array(self.shared_array_mean_montharray )
 
@@ -120,14 +124,9 @@ class dam_discharge_Class:
         # outflw_file = outdir + '/outflw' + str(year) + '.bin'
         # outflw_all = np.fromfile(outflw_file, 'float32').reshape(-1,ny,nx)
 
-        ## read NAT outflw-nc
+        ## read NAT outflw-nc: daily outflw of the dam grids
         outflw_file = self.simdir + '/o_outflw' + str(year) + '.nc'
-        with nc.Dataset(outflw_file, "r") as cdf:
-            outflw_all = cdf.variables["outflw"][:]
-        # print(outflw_file)
-
-        ## dam outflw: daily
-        outflw_dam = outflw_all[:,self.y_arr,self.x_arr]
+        outflw_dam = read_outflw_nc(outflw_file, self.x_arr, self.y_arr)
 
         ## dam outflw: monthly average
         start_date = f'{year}0101'
@@ -137,47 +136,19 @@ class dam_discharge_Class:
         df = pd.DataFrame(outflw_dam, index=dates)
         df_monthly = df.resample('M').mean()
         self.mean_montharray[inp,:,:] = df_monthly.values
+        advance()
 
-    def PlottingPosition(slef, n):
-        alpha = 0.0  #weibull
-        ii = np.arange(n)+1
-        pp = (ii-alpha)/(n+1-2*alpha)
-
-        return pp
-
-    def func_gum(self, xx):
-        n=len(xx)
-        b0=np.sum(xx)/n
-        j=np.arange(0,n)
-        b1=np.sum(j*xx)/n/(n-1)
-        lam1=b0
-        lam2=2*b1-b0
-        aa=lam2/np.log(2)
-        cc=lam1-0.5772*aa
-        return aa,cc
-
-    def est_gum(self, aa, cc, pp):
-        return cc-aa*np.log(-np.log(pp))
-
-    def gum(self, xx, pp, pyear):
-        aa,cc=self.func_gum(xx)
-        # estimation
-        ye=self.est_gum(aa,cc,pp)
-        rr=np.corrcoef(xx, ye)[0][1]
-        # probable value
-        prob=1.0-1.0/pyear
-        yp=self.est_gum(aa,cc,prob)
-        res=np.array([aa,cc,rr])
-        ss='GUM\na={0:8.3f}\nc={1:8.3f}\nr={2:8.3f}\nn={3:4.0f}'.format(res[0],res[1],res[2],len(xx))
-
-        #print(res,ye,yp,ss)
-        return res,ye,yp,ss
+    def PlottingPosition(self, n):
+        return plotting_position(n, alpha=0.0)  #weibull
 
     def p01_get_annual_discharge(self):
 
+        start_progress('dam_discharge', len(self.inputlist), 'years')
         if self.para_flag:
-            p = Pool(self.num_cores)
-            res = list(p.map(self.read_outflw_p01, self.inputlist))
+            global _pool_self
+            _pool_self = self
+            p = multiprocessing.get_context('fork').Pool(self.num_cores)
+            res = list(p.map(_pool_read_outflw_p01, self.inputlist))
             self.mean_yeararray = np.ctypeslib.as_array(self.shared_array_mean_yeararray)
             self.max_finarray = np.ctypeslib.as_array(self.shared_array_max_finarray)
             p.close()
@@ -185,17 +156,16 @@ class dam_discharge_Class:
             self.read_outflw_p01(inpi)
             self.mean_yeararray = np.ctypeslib.as_array(self.shared_array_mean_yeararray)
             self.max_finarray = np.ctypeslib.as_array(self.shared_array_max_finarray)
+        stop_progress(len(self.inputlist))
 
         ##------ save data[1]: annual average discharge ------------
         mean_finarray = np.nanmean(self.mean_yeararray, axis=0)
-        print(' ')
-        print('-- save mean discharge: ', self.mean_outf)
+        log.debug('-- save mean discharge: %s', self.mean_outf)
         # print(mean_finarray.shape)
         mean_finarray.astype('float32').tofile(self.mean_outf)
 
         ##------ save data[2]:flood discharge ------------------
-        print(' ')
-        print('-- save flood discharge: ', self.max_outf)
+        log.debug('-- save flood discharge: %s', self.max_outf)
         # print(max_finarray.shape)
         self.max_finarray.astype('float32').tofile(self.max_outf)
 
@@ -204,30 +174,11 @@ class dam_discharge_Class:
         #### initial setting -------------------------------------
         outputpath = self.outdir + '/tmp_p02_'+str(self.pyear)+'year.bin'
         self.max_data = np.fromfile(str(self.max_outf), 'float32').reshape(self.years, self.ndams)
-        for dam in range(self.ndams):
-            site_arr = self.max_data[:, dam]
-            if np.max(site_arr) >= 1e+20:
-                self.finarray[dam] = np.nan
-                continue
-            if np.max(site_arr) == np.min(site_arr):
-                self.finarray[dam] = np.nan
-                continue
-            site_arr = np.where(site_arr<0, 0, site_arr)
-            site_arr = np.sort(site_arr)
-            res, ye, yp, ss = self.gum(site_arr, self.pps, self.pyear)
-            #print(str(pyear)+'yr discharge=', yp)
-
-            if yp > 0:
-                self.finarray[dam] = yp
-            else:
-                self.finarray[dam] = np.nan
-
-            # print('damID:', dam+1, ", 100yr discharge:", "{:.1f}".format(yp))
+        # Gumbel fit of all dams at once; NaN where the annual maxima do not allow a fit
+        self.finarray = gumbel_return_level(self.max_data, self.pyear)
 
         self.finarray.astype('float32').tofile(outputpath)
-        print('file outputted:', outputpath)
-        print('###########################################')
-        print(' ')
+        log.debug('file outputted: %s', outputpath)
 
     def p03_complete_discharge(self):
         Qn_all   = np.fromfile(self.Qmean_file, 'float32')
@@ -240,25 +191,26 @@ class dam_discharge_Class:
 
         # check Qn & Qf
         damout.fillna(-999,inplace=True)
-        print(damout)
+        log.debug('%s', damout)
 
         ## save output
         damout.to_csv(self.output_file, index=None)
-        print(' ')
-        print('###############################')
-        print('dam parameters:', self.output_file)
-        print(' ')
+        log.info('dam parameters: %s', self.output_file)
 
     def opt_dam_fcperiod(self):
+        start_progress('dam_discharge', len(self.inputlist), 'years')
         if self.para_flag:
-            p = Pool(self.num_cores)
-            res = list(p.map(self.read_outflw_opt, self.inputlist))
+            global _pool_self
+            _pool_self = self
+            p = multiprocessing.get_context('fork').Pool(self.num_cores)
+            res = list(p.map(_pool_read_outflw_opt, self.inputlist))
             self.mean_montharray = np.ctypeslib.as_array(self.shared_array_mean_montharray)
             p.close()
         else:
             for inpi in self.inputlist:
                 self.read_outflw_opt(inpi)
                 self.mean_montharray = np.ctypeslib.as_array(self.shared_array_mean_montharray)
+        stop_progress(len(self.inputlist))
 
         ##------ FC period -----------------------
         # calculate FC period: STFC NDFC STOP ------------
@@ -305,15 +257,19 @@ class dam_discharge_Class:
         fc_data['NDFC'] = NDFC + 1
         fc_data['STOP'] = STOP + 1
         fc_data.fillna(0,inplace=True)
-        print(fc_data)
-        print('-- save FC period: ', self.fc_outf)
+        log.debug('%s', fc_data)
+        log.info('-- save FC period: %s', self.fc_outf)
         fc_data.to_csv(self.fc_outf, index=False)
     
 
 
 
     def main_func(self):
+        start_time = time.time()
+        log.info('--- Start Process Dam Discharge ---')
         self.p01_get_annual_discharge()
         self.p02_est_100yr_discharge()
         self.p03_complete_discharge()
         self.opt_dam_fcperiod()
+        log.info('--- Done: dam_discharge, %.1f s ---', time.time() - start_time)
+        return self.context
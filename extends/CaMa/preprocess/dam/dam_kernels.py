@@ -0,0 +1,384 @@
+'''
+Array kernels shared by the dam stages (preprocess/dam) and the dam parameter scripts of
+CaMa-Flood (map/src/src_dam/script)
+
+    read_outflw_bin / read_outflw_nc   outflow of the dam grids only (gather reader)
+    annual_peaks                       largest flood peaks of every dam in one argrelmax call
+    gumbel_return_level                L-moment Gumbel fit and return level of all dams at once
+    read_grsad_area                    cleaned GRSAD surface area series of one reservoir
+    storage_at_area                    ReGeom storage at several surface areas (dam_storage)
+    use_storage_at_area                ReGeom water-use storage at one surface area (src_dam p03)
+    keep_largest_per_grid              one dam per grid: the dams with the largest capacity stay
+    best_uparea_grid                   neighbour grid whose drainage area is closest to the
+                                       reported one
+
+The per-dam loops they replace are kept at the end of the file (*_ref); the equivalence checks
+of dam_benchmark.py compare both on the synthetic datasets.
+
+Oct 2026
+'''
+import numpy as np
+import pandas as pd
+
+
+#-- neighbour grids searched by best_uparea_grid, in the order of the original search loops
+NEIGHBOURS_3x3 = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+NEIGHBOURS_5x5 = [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3)]
+
+
+
+def read_outflw_bin(path, nx, ny, ix, iy):
+    '''
+    Daily outflow (nt, ndams) of the grids (ix, iy) (0-based) from a plain binary outflw{year}.bin
+    '''
+    data = np.memmap(path, dtype=np.float32, mode='r').reshape(-1, ny, nx)
+    return np.array(data[:, iy, ix])
+
+
+def read_outflw_nc(path, ix, iy, varname='outflw'):
+    '''
+    Daily outflow (nt, ndams) of the grids (ix, iy) (0-based) from o_outflw{year}.nc;
+    only the box around the dams is read
+    '''
+    # netCDF4 is only needed for the CoLM stages; the src_dam scripts read plain binary files
+    import netCDF4 as nc
+    with nc.Dataset(path, 'r') as cdf:
+        x0, x1 = int(np.min(ix)), int(np.max(ix)) + 1
+        y0, y1 = int(np.min(iy)), int(np.max(iy)) + 1
+        data = cdf.variables[varname][:, y0:y1, x0:x1]
+    return data[:, iy - y0, ix - x0]
+
+
+def local_maxima(q, order):
+    '''
+    (rows, cols) of the values of q (nt, ndams) larger than the order values before and after
+    them in their column; same result as scipy.signal.argrelmax(q, axis=0, order=order)
+    '''
+    results = np.ones(q.shape, dtype=bool)
+    locs = np.arange(q.shape[0])
+    for shift in range(1, order + 1):
+        results &= q > q.take(locs + shift, axis=0, mode='clip')
+        results &= q > q.take(locs - shift, axis=0, mode='clip')
+        if not results.any():
+            break
+    return np.nonzero(results)
+
+
+def annual_peaks(outflw, maxdays=1, order=8*7):
+    '''
+    The maxdays largest peaks (local maxima over +-order days) of every column of
+    outflw (nt, ndams), sorted in decreasing order; columns without a peak give their largest
+    values instead
+    '''
+    q = np.ma.getdata(outflw)
+    rows, cols = local_maxima(q, order)
+    peaks = np.full(q.shape, -np.inf, dtype=q.dtype)
+    peaks[rows, cols] = q[rows, cols]
+    top = np.sort(peaks, axis=0)[::-1][:maxdays]
+
+    npeak = np.bincount(cols, minlength=q.shape[1])
+    nopeak = npeak == 0
+    if np.any(nopeak):
+        top[:, nopeak] = np.sort(q[:, nopeak], axis=0)[::-1][:maxdays]
+    # fewer peaks than maxdays: the largest peak fills the remaining days
+    short = (npeak > 0) & (npeak < maxdays)
+    if np.any(short):
+        top[:, short] = np.where(np.isneginf(top[:, short]), top[0, short], top[:, short])
+    return top
+
+
+def plotting_position(n, alpha=0.0):
+    # alpha = 0: Weibull
+    ii = np.arange(n) + 1
+    return (ii - alpha) / (n + 1 - 2 * alpha)
+
+
+def gumbel_return_level(annual_max, pyear):
+    '''
+    pyear-year return level of every column of annual_max (nyears, ndams) from a Gumbel
+    distribution fitted by L-moments; NaN where the fit is not possible or not positive
+    '''
+    x = np.asarray(annual_max)
+    n = x.shape[0]
+    out = np.full(x.shape[1], np.nan)
+
+    xmax, xmin = np.max(x, axis=0), np.min(x, axis=0)
+    valid = ~((xmax >= 1e+20) | (xmax == xmin))
+    # one row per dam, so the sums are taken over contiguous rows like the 1-D sums of the loop
+    xx = np.ascontiguousarray(np.sort(np.where(x < 0, 0, x), axis=0)[:, valid].T)
+
+    b0 = np.sum(xx, axis=1) / n
+    j  = np.arange(0, n)
+    b1 = np.sum(j * xx, axis=1) / n / (n - 1)
+    lam1 = b0
+    lam2 = 2 * b1 - b0
+    aa = lam2 / np.log(2)
+    cc = lam1 - 0.5772 * aa
+    prob = 1.0 - 1.0 / pyear
+    yp = cc - aa * np.log(-np.log(prob))
+
+    out[valid] = np.where(yp > 0, yp, np.nan)
+    return out
+
+
+def read_grsad_area(path, column='3water_enh', maxrepeat=12):
+    '''
+    Surface area series of a GRSAD {id}_intp file; values repeated more than maxrepeat times
+    are suspicious and removed
+    '''
+    df = pd.read_table(path, index_col=0)
+    data = df.dropna()
+    counts = df[column].value_counts()
+    if np.max(counts) > maxrepeat:
+        data = data[~data[column].isin(counts[counts > maxrepeat].index)]
+    return data[column]
+
+
+def read_regeom(path):
+    '''
+    Depth, Area, Storage arrays of a ReGeom {id}.csv file (7 header lines)
+    '''
+    regeom = pd.read_csv(path, header=7)
+    return tuple(regeom.iloc[:, i].values for i in range(3))
+
+
+def storage_at_area(area, storage, targets, totalsto):
+    '''
+    Storage at each target surface area, linearly interpolated in the ReGeom area-storage
+    curve and scaled to the total capacity totalsto; 0 where the curve never reaches the target
+    '''
+    area, storage = np.asarray(area), np.asarray(storage)
+    targets = np.atleast_1d(np.asarray(targets, dtype=np.float64))
+    out = np.zeros(len(targets))
+    adj = totalsto / storage[-1]
+
+    ge  = area[None, :] >= targets[:, None]
+    has = ge.any(axis=1)
+    k   = ge.argmax(axis=1)
+    eq  = has & (area[k] == targets)
+    gt  = has & ~eq
+    if np.any(gt & (k == 0)):
+        raise IndexError('ReGeom curve starts above the target surface area')
+
+    for i in np.where(eq)[0]:
+        out[i] = np.mean(storage[area == targets[i]]) * adj
+    kk = k[gt]
+    sto_min, area_min = storage[kk-1], area[kk-1]
+    sto_max, area_max = storage[kk],   area[kk]
+    out[gt] = (sto_min + (sto_max - sto_min) * (targets[gt] - area_min) / (area_max - area_min)) * adj
+    return out
+
+
+def use_storage_at_area(area, storage, fld_area, totalsto):
+    '''
+    (use_sto, fld_sto, sto_max) at the surface area fld_area, with the rules of the CaMa-Flood
+    p03 script: the interpolation is redone on every later rising segment that starts below
+    fld_area, and a flat segment or an exact match ends the search
+    '''
+    area, storage = np.asarray(area), np.asarray(storage)
+    prev = np.roll(area, 1)
+
+    ge  = area >= fld_area
+    eq  = area == fld_area
+    gt  = ge & ~eq
+    if len(area) > 0 and gt[0]:
+        raise IndexError('ReGeom curve starts above the target surface area')
+    stop = np.where(eq | (gt & (area == prev)))[0]
+    last = stop[0] if len(stop) > 0 else len(area) - 1
+
+    use_sto, fld_sto, sto_max = np.nan, 0, 0
+    upd = np.where(gt[:last+1] & (prev[:last+1] <= fld_area) & (area[:last+1] != prev[:last+1]))[0]
+    upd = upd[upd != last] if len(stop) > 0 else upd
+    if len(upd) > 0:
+        i = upd[-1]
+        use_sto = storage[i-1] + (storage[i] - storage[i-1]) * (fld_area - area[i-1]) / (area[i] - area[i-1])
+        use_sto = use_sto * totalsto / storage[-1]
+        fld_sto = totalsto - use_sto
+        if use_sto > totalsto:
+            use_sto = totalsto
+            fld_sto = 0
+    gts = np.where(gt[:last+1])[0]
+    if len(gts) > 0:
+        sto_max = storage[gts[-1]]
+
+    if len(stop) > 0:
+        i = stop[0]
+        if eq[i]:
+            use_sto = np.mean(storage[eq])
+            sto_max = use_sto
+            use_sto = use_sto * totalsto / storage[-1]
+        else:
+            use_sto = storage[i-1]
+        fld_sto = totalsto - use_sto
+    return use_sto, fld_sto, sto_max
+
+
+def keep_largest_per_grid(df, cap='CAP_MCM', tiebreak=None, ix='ix', iy='iy'):
+    '''
+    Boolean mask of the rows of df kept when several dams are allocated to the same grid:
+    the dams with the largest capacity stay; if they all have the same capacity, the largest
+    tiebreak column decides
+    '''
+    grp  = df.groupby([ix, iy], sort=False)
+    keep = (df[cap] == grp[cap].transform('max')).values
+    if tiebreak is not None:
+        size = grp[cap].transform('size')
+        tie  = ((size > 1) & (grp[cap].transform('nunique') == 1)).values
+        keep = np.where(tie, (df[tiebreak] == grp[tiebreak].transform('max')).values, keep)
+    # grids not defined: nothing to compare with
+    keep |= (df[ix].isna() | df[iy].isna()).values
+    return keep
+
+
+def best_uparea_grid(uparea, ix, iy, upreal, neighbours, clip=True):
+    '''
+    For every dam at the 0-based grid (ix, iy) of uparea (nx, ny), the neighbour grid whose
+    drainage area is closest to upreal, if it is closer than the dam grid itself;
+    returns (ix, iy, error)
+    '''
+    ix, iy = np.asarray(ix), np.asarray(iy)
+    nx, ny = uparea.shape
+    dx = np.array([d[0] for d in neighbours])
+    dy = np.array([d[1] for d in neighbours])
+    cx = ix[:, None] + dx[None, :]
+    cy = iy[:, None] + dy[None, :]
+    if clip:
+        cx = np.clip(cx, 0, nx - 1)
+        cy = np.clip(cy, 0, ny - 1)
+
+    err0 = np.abs(uparea[ix, iy] - upreal)
+    err  = np.abs(uparea[cx, cy] - np.asarray(upreal)[:, None])
+    k    = np.argmin(err, axis=1)
+    emin = err[np.arange(len(ix)), k]
+    better = emin < err0
+    rows = np.arange(len(ix))
+    return (np.where(better, cx[rows, k], ix), np.where(better, cy[rows, k], iy),
+            np.where(better, emin, err0))
+
+
+
+#-- reference implementations: the per-dam loops of the original scripts, for dam_benchmark.py
+
+def annual_peaks_ref(outflw, maxdays=1, order=8*7):
+    from scipy.signal import argrelmax
+    out = np.zeros((maxdays, outflw.shape[1]), dtype=outflw.dtype)
+    for j in range(outflw.shape[1]):
+        q = outflw[:, j]
+        maxarray_sorted = np.sort(q[argrelmax(q, order=order)])[::-1]
+        if len(maxarray_sorted) > 0:
+            out[:, j] = maxarray_sorted[0:maxdays]
+        else:
+            out[:, j] = np.sort(q)[::-1][0:maxdays]
+    return out
+
+
+def gumbel_return_level_ref(annual_max, pyear):
+    n = annual_max.shape[0]
+    pps = plotting_position(n)
+    out = np.zeros(annual_max.shape[1])
+    for dam in range(annual_max.shape[1]):
+        site_arr = annual_max[:, dam]
+        if np.max(site_arr) >= 1e+20 or np.max(site_arr) == np.min(site_arr):
+            out[dam] = np.nan
+            continue
+        xx = np.sort(np.where(site_arr < 0, 0, site_arr))
+        b0 = np.sum(xx) / n
+        j  = np.arange(0, n)
+        b1 = np.sum(j * xx) / n / (n - 1)
+        aa = (2 * b1 - b0) / np.log(2)
+        cc = b0 - 0.5772 * aa
+        yp = cc - aa * np.log(-np.log(1.0 - 1.0 / pyear))
+        out[dam] = yp if yp > 0 else np.nan
+    return out
+
+
+def storage_at_area_ref(area, storage, target, totalsto):
+    regeom = pd.DataFrame({'Area': area, 'Storage': storage})
+    fld_sto = 0
+    for i in range(len(regeom)):
+        rg = regeom.iloc[i:i+1]
+        if rg['Area'].values[0] < target:
+            continue
+        elif rg['Area'].values[0] == target:
+            fld_sto = np.mean(regeom.query('Area == @target')['Storage'])
+            adj     = totalsto / regeom['Storage'].values[-1]
+            fld_sto = fld_sto * adj
+            break
+        elif rg['Area'].values[0] > target:
+            rg_p = regeom.iloc[i-1:i]
+            sto_min, area_min = rg_p['Storage'].values[0], rg_p['Area'].values[0]
+            sto_max, area_max = rg['Storage'].values[0], rg['Area'].values[0]
+            fld_sto = sto_min + (sto_max - sto_min) * (target - area_min) / (area_max - area_min)
+            adj     = totalsto / regeom['Storage'].values[-1]
+            fld_sto = fld_sto * adj
+            break
+    return fld_sto
+
+
+def use_storage_at_area_ref(area, storage, fld_area, totalsto):
+    regeom = pd.DataFrame({'Area': area, 'Storage': storage})
+    use_sto, fld_sto, sto_max = np.nan, 0, 0
+    for i in range(len(regeom)):
+        rg = regeom.iloc[i:i+1]
+        if rg['Area'].values[0] < fld_area:
+            continue
+        elif rg['Area'].values[0] == fld_area:
+            use_sto = np.mean(regeom.query('Area == @fld_area')['Storage'])
+            sto_max = np.mean(regeom.query('Area == @fld_area')['Storage'])
+            use_sto = use_sto * totalsto / regeom['Storage'].values[-1]
+            fld_sto = totalsto - use_sto
+            break
+        elif rg['Area'].values[0] > fld_area:
+            sto_max  = rg['Storage'].values[0]
+            area_max = rg['Area'].values[0]
+            rg_p     = regeom.iloc[i-1:i]
+            sto_min  = rg_p['Storage'].values[0]
+            area_min = rg_p['Area'].values[0]
+            if area_max == area_min:
+                use_sto = sto_min
+                fld_sto = totalsto - use_sto
+                break
+            if area_min <= fld_area:
+                use_sto = sto_min + (sto_max - sto_min) * (fld_area - area_min) / (area_max - area_min)
+                use_sto = use_sto * totalsto / regeom['Storage'].values[-1]
+                fld_sto = totalsto - use_sto
+                if use_sto > totalsto:
+                    use_sto = totalsto
+                    fld_sto = 0
+    return use_sto, fld_sto, sto_max
+
+
+def keep_largest_per_grid_ref(df, cap='CAP_MCM', tiebreak=None, ix='ix', iy='iy'):
+    cnt = {}
+    for index, row in df.iterrows():
+        key = (row[ix], row[iy])
+        cnt[key] = cnt.get(key, 0) + 1
+    dfk = df.copy()
+    for k, v in cnt.items():
+        if v > 1:
+            dams = df[(df[ix] == k[0]) & (df[iy] == k[1])]
+            rmdams = dams[dams[cap] != np.max(dams[cap])]
+            if tiebreak is not None and len(rmdams) == 0:
+                rmdams = dams[dams[tiebreak] != np.max(dams[tiebreak])]
+            dfk.drop(index=rmdams.index, inplace=True)
+    return df.index.isin(dfk.index)
+
+
+def best_uparea_grid_ref(uparea, ix, iy, upreal, neighbours, clip=True):
+    nx, ny = uparea.shape
+    out_x, out_y, out_e = [], [], []
+    for i in range(len(ix)):
+        ix_m, iy_m = ix[i], iy[i]
+        error_m = abs(uparea[ix_m, iy_m] - upreal[i])
+        for dx, dy in neighbours:
+            ix_tmp, iy_tmp = ix[i] + dx, iy[i] + dy
+            if clip:
+                ix_tmp = min(max(ix_tmp, 0), nx - 1)
+                iy_tmp = min(max(iy_tmp, 0), ny - 1)
+            error_tmp = abs(uparea[ix_tmp, iy_tmp] - upreal[i])
+            if error_tmp < error_m:
+                ix_m, iy_m, error_m = ix_tmp, iy_tmp, error_tmp
+        out_x.append(ix_m)
+        out_y.append(iy_m)
+        out_e.append(error_m)
+    return np.array(out_x), np.array(out_y), np.array(out_e)
@@ -0,0 +1,185 @@
+'''
+Logging and progress reporting for the dam parameterization stages
+
+All stages log through the 'dam' logger (get_logger).  setup_logging configures it once per
+run: INFO and above go to stdout, everything (DEBUG included when Debug_Tag = True) goes to a
+per-run file Save_Dir/logs/{run_name}_{time}.log.  Records are passed through a
+multiprocessing queue to a listener thread of the main process, so pool workers and stage
+processes do not write to stdout or to the log file concurrently.
+
+Progress of the per-dam / per-year loops is counted with start_progress / advance /
+stop_progress.  The counters of the (forked) pool workers are sent in batches through a queue
+and aggregated by a thread of the process that started the progress, which logs a throughput
+line (e.g. dams/s) every few seconds.
+
+Oct 2026
+'''
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+LOGGER = 'dam'
+
+_listener = None
+_progress = None
+
+
+
+def get_logger(name):
+    '''
+    Logger of a stage; without setup_logging, INFO and above are printed to stdout
+    '''
+    root = logging.getLogger(LOGGER)
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        root.propagate = False
+    return logging.getLogger(f'{LOGGER}.{name}')
+
+
+def setup_logging(namelist, run_name='dam_pipeline'):
+    '''
+    Configure the console and per-run file logging; returns the path of the log file
+    '''
+    global _listener
+    debug   = namelist['General']['Debug_Tag']
+    logdir  = os.path.join(namelist['General']['Save_Dir'], 'logs')
+    os.makedirs(logdir, exist_ok=True)
+    logfile = os.path.join(logdir, f'{run_name}_{time.strftime("%Y%m%d-%H%M%S")}.log')
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(logging.INFO)
+    console.setFormatter(logging.Formatter('%(asctime)s %(message)s', '%H:%M:%S'))
+    logf = logging.FileHandler(logfile)
+    logf.setLevel(logging.DEBUG)
+    logf.setFormatter(logging.Formatter('%(asctime)s %(processName)s %(name)s %(levelname)s: %(message)s'))
+
+    shutdown_logging()
+    queue = multiprocessing.Queue(-1)
+    _listener = logging.handlers.QueueListener(queue, console, logf, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger(LOGGER)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(queue))
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+    root.propagate = False
+    return logfile
+
+
+def shutdown_logging():
+    '''
+    Flush the records still in the queue and stop the listener thread
+    '''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+
+class Progress:
+    '''
+    Counter of processed items aggregated from the workers through a queue
+    '''
+
+    def __init__(self, stage, total, unit='dams', interval=10.0, batch=0.5):
+        self.log      = get_logger(stage)
+        self.stage    = stage
+        self.total    = total
+        self.unit     = unit
+        self.interval = interval      # seconds between throughput lines
+        self.batch    = batch         # seconds between sends of a worker
+        self.done     = 0
+        self.queue    = multiprocessing.Queue()
+        self.pending  = 0
+        self.last_put = time.time()
+        self.start    = time.time()
+        self.thread   = threading.Thread(target=self.collect, daemon=True)
+        self.thread.start()
+
+
+    def advance(self, n=1):
+        # called in the workers: batch the increments to keep the queue traffic low
+        self.pending += n
+        now = time.time()
+        if now - self.last_put >= self.batch:
+            self.queue.put(self.pending)
+            self.pending  = 0
+            self.last_put = now
+
+
+    def flush(self):
+        if self.pending:
+            self.queue.put(self.pending)
+            self.pending = 0
+
+
+    def collect(self):
+        last_report = time.time()
+        while True:
+            try:
+                n = self.queue.get(timeout=self.interval)
+            except Exception:
+                n = 0
+            if n is None:
+                break
+            self.done += n
+            now = time.time()
+            if now - last_report >= self.interval:
+                self.report(now)
+                last_report = now
+
+
+    def report(self, now, final=False):
+        elapsed = max(now - self.start, 1e-9)
+        rate    = self.done / elapsed
+        if final:
+            self.log.info('[%s] %d %s in %.1f s (%.1f %s/s)', self.stage, self.done, self.unit,
+                          elapsed, rate, self.unit)
+        else:
+            eta = (self.total - self.done) / rate if rate > 0 else float('nan')
+            self.log.info('[%s] %d/%d %s (%.0f%%), %.1f %s/s, eta %.0f s', self.stage, self.done,
+                          self.total, self.unit, 100.0 * self.done / max(self.total, 1), rate,
+                          self.unit, eta)
+
+
+    def close(self, done=None):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if done is not None:
+            self.done = done
+        self.report(time.time(), final=True)
+
+
+
+def start_progress(stage, total, unit='dams', interval=10.0):
+    '''
+    Start counting; must be called before the pool workers are forked
+    '''
+    global _progress
+    _progress = Progress(stage, total, unit, interval)
+    return _progress
+
+
+def advance(n=1):
+    if _progress is not None:
+        _progress.advance(n)
+
+
+def stop_progress(done=None):
+    '''
+    Stop counting; done overrides the count (batches of workers are sent only periodically)
+    '''
+    global _progress
+    if _progress is not None:
+        _progress.close(done)
+        _progress = None
@@ -0,0 +1,416 @@
+'''
+DAG runner for the dam parameterization (dam_basicInfo -> dam_discharge / dam_storage / dam_wuse)
+
+Every stage declares the namelist keys, input files and upstream outputs it depends on,
+together with the files it writes to Save_Dir.  Before a stage is run, a digest of all its
+inputs is computed and compared with the one recorded in the manifest
+(Save_Dir/dam_pipeline_manifest.json); the stage is skipped when the digest is unchanged and
+its outputs are still on disk as they were written.  Stages whose dependencies are done are
+run concurrently, each in its own process, so that dam_discharge, dam_storage and dam_wuse
+(which only need damloc.csv) overlap.  The stage processes inherit one DamPipelineContext
+(dam_context.py), so the dam table is parsed once and not by every stage; the map rasters a
+stage reads are loaded into the context just before it is forked (and dropped from the
+pipeline process after), so they are read once as well.
+
+File contents are hashed once and memoized in the manifest by (size, mtime), so large inputs
+such as o_outflw{year}.nc are only re-read when they change.  Directories holding one file
+per dam (GRSADdir, ReGeomdir) are fingerprinted by the (name, size, mtime) of their entries.
+
+Usage:
+    python dam_pipeline.py [dam.nml] [--force STAGE ...] [--jobs N] [--dry-run]
+
+Oct 2026
+'''
+import argparse
+import copy
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import sys
+import time
+
+import read_nml as nml
+from dam_context import DamPipelineContext
+from dam_logging import get_logger, setup_logging, shutdown_logging
+
+log = get_logger('dam_pipeline')
+
+
+#-- stage declarations
+#   class   : module/class implementing the stage and the method to call
+#   after   : upstream stages that have to be finished first
+#   keys    : namelist keys that change the stage results
+#   files   : input files ('{year}' is expanded over Start_Year..End_Year); missing files
+#             are hashed as missing, so optional inputs (hires maps) are tracked as well
+#   dirs    : input directories, fingerprinted by the stat of their entries
+#   outputs : files written by the stage, relative to Save_Dir
+#   maps    : CaMa-Flood rasters the stage reads through the context ('hires': the 15sec
+#             catchment map, else the 1min one); read in the pipeline process right before
+#             the stage is forked, so the stage process inherits them, and dropped after
+STAGES = {
+    'dam_basicInfo': {
+        'class'  : ('dam_basicInfo_Class', 'main_func'),
+        'after'  : [],
+        'keys'   : {'General'      : ['Map_Tag', 'Map_Dir'],
+                    'dam_basicInfo': ['Min_Error', 'Min_Uparea', 'GRanD_If']},
+        'files'  : ['{GRanD_If}',
+                    '{Map_Dir}/params.txt',
+                    '{Map_Dir}/nextxy.bin',
+                    '{Map_Dir}/basin.bin',
+                    '{Map_Dir}/upgrid.bin',
+                    '{Map_Dir}/uparea.bin',
+                    '{Map_Dir}/ctmare.bin',
+                    '{Map_Dir}/elevtn.bin',
+                    '{Map_Dir}/lonlat.bin',
+                    '{Map_Dir}/15sec/location.txt',
+                    '{Map_Dir}/15sec/15sec.catmxy.bin',
+                    '{Map_Dir}/1min/location.txt',
+                    '{Map_Dir}/1min/1min.catmxy.bin'],
+        'dirs'   : [],
+        'outputs': ['dam_inplist.csv', 'tmp_damloc.csv', 'damloc.csv'],
+        'maps'   : ['nextxy', 'basin', 'upgrid', 'uparea', 'ctmare', 'elevtn', 'lonlat', 'hires'],
+    },
+
+    'dam_discharge': {
+        'class'  : ('dam_discharge_Class', 'main_func'),
+        'after'  : ['dam_basicInfo'],
+        'keys'   : {'dam_discharge': ['Start_Year', 'End_Year', 'Period_Year', 'Max_Days',
+                                      'Qf1', 'Qf2', 'Sim_Dir']},
+        'files'  : ['{Save_Dir}/damloc.csv',
+                    '{Sim_Dir}/o_outflw{year}.nc'],
+        'dirs'   : [],
+        'outputs': ['tmp_p01_AnnualMax.bin', 'tmp_p01_AnnualMean.bin',
+                    'tmp_p02_{Period_Year}year.bin', 'damflow.csv', 'damfcperiod.csv'],
+        'maps'   : [],
+    },
+
+    'dam_storage': {
+        'class'  : ('dam_storage_Class', 'main_func'),
+        'after'  : ['dam_basicInfo'],
+        'keys'   : {'dam_storage': ['Pc_Fld', 'Pc_Nor', 'Pc_Con', 'GRSADdir', 'ReGeomdir',
+                                    'ReGeom_ErrorFile']},
+        'files'  : ['{Save_Dir}/damloc.csv',
+                    '{ReGeom_ErrorFile}'],
+        'dirs'   : ['{GRSADdir}', '{ReGeomdir}'],
+        'outputs': ['damsto.csv'],
+        'maps'   : [],
+    },
+
+    'dam_wuse': {
+        'class'  : ('dam_wuse_Class', 'main_function'),
+        'after'  : ['dam_basicInfo'],
+        'keys'   : {'General': ['Map_Tag', 'Map_Dir']},
+        'files'  : ['{Save_Dir}/damloc.csv',
+                    '{Map_Dir}/params.txt',
+                    '{Map_Dir}/grdare.bin',
+                    '{Map_Dir}/elevtn.bin'],
+        'dirs'   : [],
+        'outputs': ['WaterUse_grids/ix_{Map_Tag}.txt', 'WaterUse_grids/iy_{Map_Tag}.txt',
+                    'WaterUse_grids/grid_share_{Map_Tag}.txt'],
+        'maps'   : ['grdare', 'elevtn'],
+    },
+}
+
+
+def run_stage(stage, namelist, context):
+    '''
+    Entry point of the stage process: construct the stage class and call its main method
+    '''
+    module_name, method = STAGES[stage]['class']
+    module = importlib.import_module(module_name)
+    mainf = getattr(module, module_name)(namelist, context)
+    return getattr(mainf, method)()
+
+
+class dam_pipeline_Class:
+
+    def __init__(self, namelist, force=(), jobs=None, dry_run=False):
+
+        self.name     = 'dam_pipeline_Class'
+        self.version  = '0.1'
+        self.release  = '0.1'
+        self.date     = 'Oct 2026'
+
+        #-- read namelist
+        self.namelist = namelist
+        self.ncores   = int(namelist['General']['Num_Cores'])
+        self.savedir  = namelist['General']['Save_Dir']
+        if not os.path.exists(self.savedir):
+            os.makedirs(self.savedir)
+
+        self.force    = set(force)
+        self.dry_run  = dry_run
+        # number of stages run at the same time; dam_discharge/dam_storage/dam_wuse can overlap
+        self.jobs     = jobs if jobs else len(STAGES) - 1
+        for stage in self.force:
+            if stage not in STAGES:
+                log.error('Error: unknown stage %s; the supported stages are: %s', stage, list(STAGES.keys()))
+                sys.exit(1)
+
+        #-- flat view of the namelist used to expand the path templates
+        self.params = {}
+        for dict_name in namelist:
+            self.params.update(namelist[dict_name])
+
+        #-- map and dam table inherited by the stage processes
+        self.context       = DamPipelineContext(namelist)
+
+        self.manifest_file = os.path.join(self.savedir, 'dam_pipeline_manifest.json')
+        self.manifest      = self.read_manifest()
+
+
+
+    def read_manifest(self):
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == self.version:
+                    return manifest
+            except ValueError:
+                log.warning('Warning: manifest is corrupted and will be rebuilt: %s', self.manifest_file)
+        return {'version': self.version, 'stages': {}, 'hashes': {}}
+
+
+    def write_manifest(self):
+        # write to a temporary file first, so an interrupted run never leaves a broken manifest
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
+
+
+
+    def expand(self, template):
+        '''
+        Expand a path template; '{year}' gives one path per natsim year
+        '''
+        if '{year}' in template:
+            syear = int(self.params['Start_Year'])
+            eyear = int(self.params['End_Year'])
+            return [template.format(year=year, **self.params) for year in range(syear, eyear + 1)]
+        return [template.format(**self.params)]
+
+
+    def file_digest(self, path):
+        '''
+        Content hash of a file, memoized in the manifest by (size, mtime)
+        '''
+        if not os.path.isfile(path):
+            return 'missing'
+        st  = os.stat(path)
+        key = os.path.abspath(path)
+        memo = self.manifest['hashes'].get(key)
+        if memo is not None and memo['size'] == st.st_size and memo['mtime'] == st.st_mtime_ns:
+            return memo['sha1']
+
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 22), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        self.manifest['hashes'][key] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': digest}
+        return digest
+
+
+    def dir_digest(self, path):
+        '''
+        Fingerprint of a directory from the name, size and mtime of its entries
+        '''
+        if not os.path.isdir(path):
+            return 'missing'
+        sha = hashlib.sha1()
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            st = entry.stat()
+            sha.update(f'{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode())
+        return sha.hexdigest()
+
+
+    def stage_digest(self, stage):
+        '''
+        Digest of everything the results of a stage depend on
+        '''
+        spec = STAGES[stage]
+        sha  = hashlib.sha1()
+        sha.update(stage.encode())
+        for dict_name in sorted(spec['keys']):
+            for key in spec['keys'][dict_name]:
+                value = self.namelist[dict_name][key]
+                sha.update(f'{dict_name}%{key}={value!r}\n'.encode())
+        for template in spec['files']:
+            for path in self.expand(template):
+                sha.update(f'{path}:{self.file_digest(path)}\n'.encode())
+        for template in spec['dirs']:
+            for path in self.expand(template):
+                sha.update(f'{path}/:{self.dir_digest(path)}\n'.encode())
+        return sha.hexdigest()
+
+
+    def stage_outputs(self, stage):
+        outputs = []
+        for template in STAGES[stage]['outputs']:
+            outputs.extend(os.path.join(self.savedir, p) for p in self.expand(template))
+        return outputs
+
+
+    def is_up_to_date(self, stage, digest):
+        record = self.manifest['stages'].get(stage)
+        if record is None or record['digest'] != digest or record['status'] != 'done':
+            return False
+        # outputs removed or modified since they were written -> rerun
+        for path, stat in record['outputs'].items():
+            if not os.path.isfile(path):
+                return False
+            st = os.stat(path)
+            if st.st_size != stat['size'] or st.st_mtime_ns != stat['mtime']:
+                return False
+        return True
+
+
+    def record_stage(self, stage, digest, status, seconds):
+        outputs = {}
+        if status == 'done':
+            for path in self.stage_outputs(stage):
+                if not os.path.isfile(path):
+                    log.warning('Warning: %s did not write %s', stage, path)
+                    status = 'failed'
+                    continue
+                st = os.stat(path)
+                outputs[path] = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+        self.manifest['stages'][stage] = {
+            'digest'  : digest,
+            'status'  : status,
+            'seconds' : round(seconds, 3),
+            'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'outputs' : outputs,
+        }
+        self.write_manifest()
+        return status
+
+
+
+    def stage_namelist(self, nrunning):
+        '''
+        Namelist for a stage process: the cores are shared among the stages running together
+        '''
+        namelist = copy.deepcopy(self.namelist)
+        namelist['General']['Num_Cores'] = max(1, self.ncores // max(1, nrunning))
+        return namelist
+
+
+    def update_context(self, stage):
+        '''
+        Load the dam table written by a finished stage once, before the next stages are forked
+        '''
+        if not self.dry_run and 'damloc.csv' in STAGES[stage]['outputs']:
+            self.context.load_damloc()
+
+
+    def preload_context(self, stage):
+        '''
+        Read the map rasters of a stage into the context, before the stage process is forked;
+        released again once it is, so the pipeline process holds no more than one stage's maps
+        '''
+        try:
+            self.context.preload(STAGES[stage]['maps'])
+        except OSError as err:
+            # the stage reports the missing map itself
+            log.warning('Warning: [%s] map not preloaded: %s', stage, err)
+
+
+    def main_func(self):
+        '''
+        Run the pipeline; returns a dict of stage -> done/skipped/failed/blocked
+        '''
+        logfile = setup_logging(self.namelist)
+        try:
+            return self.run_pipeline(logfile)
+        finally:
+            shutdown_logging()
+
+
+    def run_pipeline(self, logfile):
+        log.info('--- Start Dam Pipeline ---')
+        log.info('log file: %s', logfile)
+        state   = {stage: 'pending' for stage in STAGES}
+        running = {}   # sentinel -> (stage, process, digest, start_time)
+
+        while True:
+            #-- stages whose upstream failed can not run
+            for stage, spec in STAGES.items():
+                if state[stage] == 'pending' and any(state[s] in ('failed', 'blocked') for s in spec['after']):
+                    state[stage] = 'blocked'
+                    log.error('[%s] blocked by failed upstream stage', stage)
+
+            ready = [stage for stage, spec in STAGES.items()
+                     if state[stage] == 'pending' and all(state[s] in ('done', 'skipped') for s in spec['after'])]
+
+            progressed = False
+            for stage in ready:
+                digest = self.stage_digest(stage)
+                if stage not in self.force and self.is_up_to_date(stage, digest):
+                    state[stage] = 'skipped'
+                    progressed = True
+                    log.info('[%s] up to date, skipped', stage)
+                    self.update_context(stage)
+                    continue
+                if self.dry_run:
+                    state[stage] = 'done'
+                    progressed = True
+                    log.info('[%s] would run', stage)
+                    continue
+                if len(running) >= self.jobs:
+                    break
+                nrunning = min(self.jobs, len(running) + len(ready))
+                self.preload_context(stage)
+                proc = multiprocessing.Process(target=run_stage, name=stage,
+                                               args=(stage, self.stage_namelist(nrunning), self.context))
+                proc.start()
+                self.context.release()
+                state[stage] = 'running'
+                running[proc.sentinel] = (stage, proc, digest, time.time())
+                log.info('[%s] started (pid %d)', stage, proc.pid)
+
+            # skipped stages may have released downstream stages: schedule those before waiting
+            if progressed:
+                continue
+            if not running:
+                break
+
+            for sentinel in wait(list(running.keys())):
+                stage, proc, digest, start = running.pop(sentinel)
+                proc.join()
+                seconds = time.time() - start
+                status  = 'done' if proc.exitcode == 0 else 'failed'
+                state[stage] = self.record_stage(stage, digest, status, seconds)
+                level = logging.INFO if state[stage] == 'done' else logging.ERROR
+                log.log(level, '[%s] %s in %.1f seconds (exit code %s)', stage, state[stage], seconds, proc.exitcode)
+                if state[stage] == 'done':
+                    self.update_context(stage)
+
+        self.write_manifest()
+        log.info('--- Dam Pipeline Summary ---')
+        for stage in STAGES:
+            log.info('  %-15s %s', stage, state[stage])
+        return state
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run the dam parameterization stages that are out of date')
+    parser.add_argument('namelist', nargs='?', default='./dam.nml', help='dam namelist (default: ./dam.nml)')
+    parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', help='rerun these stages')
+    parser.add_argument('--jobs', type=int, default=None, help='number of stages run at the same time')
+    parser.add_argument('--dry-run', action='store_true', help='only report which stages would run')
+    args = parser.parse_args()
+
+    namelist = nml.read_namelist(args.namelist)
+    state = dam_pipeline_Class(namelist, force=args.force, jobs=args.jobs, dry_run=args.dry_run).main_func()
+    if any(s in ('failed', 'blocked') for s in state.values()):
+        sys.exit(1)
@@ -9,7 +9,13 @@ import numpy as np
 import pandas as pd
 import sys
 from dateutil.relativedelta import relativedelta
+import time
 import warnings
+from dam_context import DamPipelineContext
+from dam_kernels import read_grsad_area, read_regeom, storage_at_area
+from dam_logging import get_logger, start_progress, advance, stop_progress
+
+log = get_logger('dam_storage')
 
 # ignore FutureWarning messages
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -18,9 +24,17 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 pd.options.mode.chained_assignment = None  # default='warn'
 
 
+# instance used by the forked workers; passing self.process_dam to the pool would pickle the whole
+# object, including the shared context and its map arrays, for every task
+_pool_self = None
+
+def _pool_process_dam(dam):
+    return _pool_self.process_dam(dam)
+
+
 class dam_storage_Class:
    
-    def __init__(self, namelist):
+    def __init__(self, namelist, context=None):
 
         self.name     = 'dam_storage_Class'
         self.version  = '0.1'
@@ -43,7 +57,9 @@ class dam_storage_Class:
         self.damfile          = self.savedir + '/damloc.csv'
         self.outfile          = self.savedir + '/damsto.csv'
 
-        self.grand            = pd.read_csv(self.damfile,header=1)
+        #-- dam table shared with the other stages (damloc.csv if not in memory yet)
+        self.context          = context if context is not None else DamPipelineContext(namelist)
+        self.grand            = self.context.dam_frame()
         self.ndams            = self.grand.shape[0]
         self.error            = pd.read_csv(self.ReGeom_ErrorFile)
 
@@ -63,54 +79,41 @@ class dam_storage_Class:
         ## read timeseries file -----
         grsadpath = self.GRSADdir + '/'+ str(nm) + '_intp'
         if not os.path.isfile(grsadpath):
-            print('file not found: ' +str(grsadpath)) 
+            log.debug('file not found: %s', grsadpath)
         else:
-            df = pd.read_table(grsadpath, index_col=0, parse_dates=True)
-            data = df.dropna()
-            if np.max(df['3water_enh'].value_counts()) > 12:
-                rm_df = df['3water_enh'].value_counts()
-                rm_df = rm_df[rm_df > 12]
-                rm_df = rm_df.index
-                for j in range(len(rm_df)):
-                    rm_val = rm_df[j]
-                    data['3water_enh'] = data['3water_enh'].replace(rm_val, np.nan)
-                data = data.dropna()
-
-            data = data['3water_enh']
+            data = read_grsad_area(grsadpath)
 
             if len(data) < 2:
-                print('low data quality: ' +str(grsadpath)) 
+                log.debug('low data quality: %s', grsadpath)
             else:
                 areamax  = np.max(data)
                 fld_area = np.percentile(data, self.pc_fld)
                 nor_area = np.minimum(np.percentile(data, self.pc_nor), fld_area*0.9)
                 con_area = np.minimum(np.percentile(data, 1),      nor_area*0.9) 
                 if self.debug:
-                    print('fld_area_org', fld_area,'nor_area_org', nor_area,'con_area_org', con_area)
+                    log.debug('fld_area_org %s nor_area_org %s con_area_org %s', fld_area, nor_area, con_area)
 
                 ## read reservoir bathymetry data --------------
                 regeompath = self.ReGeomdir + '/'+ str(nm) + '.csv'
                 if not os.path.isfile(regeompath):
-                    print('file not found: ' +str(regeompath)) 
+                    log.debug('file not found: %s', regeompath)
                 else:
-                    regeom = pd.read_csv(regeompath, header=7)
-                    regeom.columns = ['Depth', 'Area', 'Storage']
-                    if len(regeom) < 2:
-                        print('ReGeom data was empty!!!')
+                    depth, area, storage = read_regeom(regeompath)
+                    if len(area) < 2:
+                        log.debug('ReGeom data was empty: %s', regeompath)
                     else:
-                        adj      = regeom['Area'].values[-1] / areamax           
+                        adj      = area[-1] / areamax           
                         fld_area = fld_area * adj
                         nor_area = nor_area * adj
                         con_area = con_area * adj
                         if self.debug:
-                            print('fld_area', fld_area, 'areamax', areamax, 'regeom_max', regeom['Area'].values[-1])
+                            log.debug('fld_area %s areamax %s regeom_max %s', fld_area, areamax, area[-1])
 
-                        fld_sto = self.est_sto_by_area(fld_area,regeom,totalsto)                
-                        nor_sto = self.est_sto_by_area(nor_area,regeom,totalsto)
-                        con_sto = self.est_sto_by_area(con_area,regeom,totalsto) 
+                        fld_sto, nor_sto, con_sto = storage_at_area(area, storage, [fld_area, nor_area, con_area], totalsto)
     
         ## save data                
         df_i = [nm, totalsto, fld_sto, nor_sto, con_sto, fld_area, nor_area, con_area]
+        advance()
 
         return df_i
 
@@ -118,52 +121,34 @@ class dam_storage_Class:
 
 
     def est_sto_by_area(self, fld_area,regeom,totalsto):
-        # sto_max = 0
-        fld_sto = 0
-        for i in range(len(regeom)):
-            rg = regeom.iloc[i:i+1]
-            if rg['Area'].values[0] < fld_area:
-                continue
-            elif rg['Area'].values[0] == fld_area:
-                #fld_sto = rg['Storage'].values[0]
-                fld_sto = np.mean(regeom.query('Area == @fld_area')['Storage'])
-                sto_max = np.mean(regeom.query('Area == @fld_area')['Storage'])
-
-                adj     = totalsto / regeom['Storage'].values[-1]       
-                fld_sto = fld_sto * adj
-                # ext_sto = totalsto - fld_sto
-                break
-            
-            elif rg['Area'].values[0] > fld_area:
-                rg_p    = regeom.iloc[i-1:i]
-                sto_min, area_min = rg_p['Storage'].values[0], rg_p['Area'].values[0]
-                sto_max, area_max =   rg['Storage'].values[0],   rg['Area'].values[0]
-        
-                fld_sto = sto_min + (sto_max - sto_min) * (fld_area - area_min) / (area_max - area_min)
-        
-                # adj = error_i['V_GRanD_mcm'].values[0] / error_i['V_est_mcm'].values[0]
-                adj     = totalsto / regeom['Storage'].values[-1]         
-                fld_sto = fld_sto * adj
-                # ext_sto = totalsto - fld_sto
-                break       
-
-        return fld_sto
+        return storage_at_area(regeom['Area'].values, regeom['Storage'].values, fld_area, totalsto)[0]
 
 
 
 
     def main_func(self):
+        start_time = time.time()
+        log.info('--- Start Process Dam Storage ---')
+        start_progress('dam_storage', self.ndams, 'dams')
         if self.ptag:
-            pool = multiprocessing.Pool(self.ncores)
-            save_list = pool.map(self.process_dam, range(self.ndams))
+            global _pool_self
+            _pool_self = self
+            pool = multiprocessing.get_context('fork').Pool(self.ncores)
+            save_list = pool.map(_pool_process_dam, range(self.ndams))
         else:
             save_list = []
             for inp in range(self.ndams):
                 save_temp = self.process_dam(inp)
                 save_list.append(save_temp)
+        stop_progress(self.ndams)
         # save data
         out_vars = ['grand_id', 'totalsto_mcm', 'fldsto_mcm', 'norsto_mcm', 'consto_mcm', 'fldarea', 'norarea','conarea']
         out_data = pd.DataFrame(save_list, columns = out_vars)
         out_data = out_data.sort_values(by=out_data.columns[0])
-        print(out_data)
+        log.debug('%s', out_data)
+        nmiss = int(out_data['fldsto_mcm'].isna().sum())
+        if nmiss > 0:
+            log.info('%d dams without storage estimate (GRSAD/ReGeom data missing or too short)', nmiss)
         out_data.to_csv(self.outfile, index=False)
+        log.info('--- Done: dam_storage, %.1f s ---', time.time() - start_time)
+        return self.context
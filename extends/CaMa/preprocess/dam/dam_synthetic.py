@@ -0,0 +1,354 @@
+'''
+Synthetic CaMa-Flood map and dam datasets for testing and benchmarking the dam pipeline
+
+Writes, under one directory, everything dam.nml points to:
+    map/                params.txt, nextxy/basin/upgrid/uparea/ctmare/grdare/elevtn/lonlat.bin,
+                        optional 1min/location.txt + 1min/1min.catmxy.bin
+    GRanD.csv           GRanD-like reservoir list
+    GRSAD/{id}_intp     monthly surface area time series
+    ReGeom/{id}.csv     area-storage-depth curves, ReGeomData_WOW_V1.csv
+    sim/o_outflw{year}.nc  daily naturalized outflow
+    save/               Save_Dir
+    dam.nml             namelist for the dam pipeline
+
+The river network is made of north-south strips: every land cell flows horizontally to the
+center column of its strip, which flows south down to the river mouth.  Upstream area is then
+a pair of cumulative sums, so maps up to glb_06min are generated in a few seconds while the
+flow directions, drainage areas and elevations stay consistent with each other.
+
+Usage:
+    python dam_synthetic.py OUTDIR [--size toy|small|glb_15min|glb_06min] [--years N] [--hires]
+
+Oct 2026
+'''
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import netCDF4 as nc
+
+
+#-- nx, ny, grid size [deg], number of dams, strip width [grids]
+SIZES = {
+    'toy'      : {'nx':   72, 'ny':   36, 'gsize': 5.0,  'ndams':   40, 'strip':  6},
+    'small'    : {'nx':  360, 'ny':  180, 'gsize': 1.0,  'ndams':  500, 'strip': 12},
+    'glb_15min': {'nx': 1440, 'ny':  720, 'gsize': 0.25, 'ndams': 7320, 'strip': 40},
+    'glb_06min': {'nx': 3600, 'ny': 1800, 'gsize': 0.1,  'ndams': 7320, 'strip': 80},
+}
+
+MAIN_USE = ['Irrigation', 'Hydroelectricity', 'Water supply', 'Flood control', 'Recreation',
+            'Navigation', 'Fisheries', 'Other', np.nan]
+
+RADIUS = 6371000.0   # earth radius [m]
+
+
+
+class dam_synthetic_Class:
+
+    def __init__(self, outdir, size='toy', years=3, start_year=2000, hires=False, seed=0):
+
+        self.name     = 'dam_synthetic_Class'
+        self.version  = '0.1'
+        self.release  = '0.1'
+        self.date     = 'Oct 2026'
+
+        if size not in SIZES:
+            raise ValueError(f'unknown size {size}; the supported sizes are: {list(SIZES.keys())}')
+        self.size     = size
+        self.outdir   = os.path.abspath(outdir)
+        self.nx       = SIZES[size]['nx']
+        self.ny       = SIZES[size]['ny']
+        self.gsize    = SIZES[size]['gsize']
+        self.ndams    = SIZES[size]['ndams']
+        self.strip    = SIZES[size]['strip']
+        self.syear    = start_year
+        self.eyear    = start_year + years - 1
+        self.hires    = hires
+        self.rng      = np.random.default_rng(seed)
+
+        self.mapdir   = os.path.join(self.outdir, 'map')
+        self.grsaddir = os.path.join(self.outdir, 'GRSAD')
+        self.regeomdir= os.path.join(self.outdir, 'ReGeom')
+        self.simdir   = os.path.join(self.outdir, 'sim')
+        self.savedir  = os.path.join(self.outdir, 'save')
+        self.grand_if = os.path.join(self.outdir, 'GRanD.csv')
+        self.error_if = os.path.join(self.regeomdir, 'ReGeomData_WOW_V1.csv')
+        self.nml_file = os.path.join(self.outdir, 'dam.nml')
+        for d in (self.mapdir, self.grsaddir, self.regeomdir, self.simdir, self.savedir):
+            os.makedirs(d, exist_ok=True)
+
+
+
+    def write_bin(self, name, *fields):
+        # CaMa-Flood binaries are Fortran ordered (nx, ny) records
+        with open(os.path.join(self.mapdir, name + '.bin'), 'wb') as f:
+            for field in fields:
+                field.flatten(order='F').tofile(f)
+
+
+    def make_map(self):
+        '''
+        River map: strips of width self.strip draining to the south through their center column
+        '''
+        nx, ny, gsize = self.nx, self.ny, self.gsize
+        west, north = -180.0, 90.0
+
+        ix = np.arange(nx)[:, None] * np.ones((1, ny), dtype=int)    # 0-based
+        iy = np.ones((nx, 1), dtype=int) * np.arange(ny)[None, :]
+
+        #-- land between 70N and 60S, mouth row varies from strip to strip
+        strip_id = ix // self.strip
+        nstrip   = strip_id.max() + 1
+        center   = strip_id * self.strip + np.minimum(self.strip, nx - strip_id * self.strip) // 2
+        top      = int(round(20.0 / gsize))
+        bottom   = int(round(150.0 / gsize)) - 1 - self.rng.integers(0, max(1, int(10.0 / gsize)), nstrip)
+        bottom_c = bottom[strip_id]
+        land     = (iy >= top) & (iy <= bottom_c)
+
+        #-- flow directions (Fortran 1-based); -9 river mouth, -9999 ocean
+        nextx = np.full((nx, ny), -9999, dtype=np.int32)
+        nexty = np.full((nx, ny), -9999, dtype=np.int32)
+        step  = np.sign(center - ix)
+        horiz = land & (step != 0)
+        nextx[horiz] = (ix + step)[horiz] + 1
+        nexty[horiz] = iy[horiz] + 1
+        south = land & (step == 0) & (iy < bottom_c)
+        nextx[south] = ix[south] + 1
+        nexty[south] = iy[south] + 2
+        mouth = land & (step == 0) & (iy == bottom_c)
+        nextx[mouth] = -9
+        nexty[mouth] = -9
+
+        #-- grid area [m2] and outlet coordinates
+        lat_n  = north - gsize * iy
+        lat_s  = lat_n - gsize
+        grdare = (RADIUS**2 * np.deg2rad(gsize) *
+                  (np.sin(np.deg2rad(lat_n)) - np.sin(np.deg2rad(lat_s)))).astype(np.float32)
+        outlon = (west + gsize * (ix + 0.5)).astype(np.float32)
+        outlat = (north - gsize * (iy + 0.5)).astype(np.float32)
+
+        #-- upstream area: accumulate toward the center column, then southward along it
+        area = np.where(land, grdare, 0.0).astype(np.float64)
+        ngrd = land.astype(np.int64)
+        left = ix < center
+        acc_area = np.zeros((nx, ny))
+        acc_ngrd = np.zeros((nx, ny), dtype=np.int64)
+        for s in range(nstrip):
+            i0, i1, ic = s * self.strip, min(nx, (s + 1) * self.strip), center[s * self.strip, 0]
+            a, g = area[i0:i1], ngrd[i0:i1]
+            l = left[i0:i1]
+            acc_area[i0:i1] = np.where(l, np.cumsum(a, axis=0), np.cumsum(a[::-1], axis=0)[::-1])
+            acc_ngrd[i0:i1] = np.where(l, np.cumsum(g, axis=0), np.cumsum(g[::-1], axis=0)[::-1])
+            # center column: its row (both sides) accumulated, then down the river
+            row_area = area[i0:i1].sum(axis=0)
+            row_ngrd = ngrd[i0:i1].sum(axis=0)
+            acc_area[ic] = np.cumsum(row_area)
+            acc_ngrd[ic] = np.cumsum(row_ngrd)
+        uparea = np.where(land, acc_area, -9999).astype(np.float32)
+        upgrid = np.where(land, acc_ngrd, -9999).astype(np.int32)
+        basin  = np.where(land, strip_id + 1, -9999).astype(np.int32)
+        ctmare = np.where(land, grdare, -9999).astype(np.float32)
+
+        #-- elevation decreasing along the flow paths
+        dist   = np.abs(ix - center) + (bottom_c - iy)
+        elevtn = np.where(land, 2.0 * dist * gsize * 100 + self.rng.random((nx, ny)), -9999).astype(np.float32)
+
+        with open(os.path.join(self.mapdir, 'params.txt'), 'w') as f:
+            f.write(f'{nx:12d} !! grid number (east-west)\n')
+            f.write(f'{ny:12d} !! grid number (north-south)\n')
+            f.write(f'{1:12d} !! floodplain layer\n')
+            f.write(f'{gsize:12.8f} !! grid size  [deg]\n')
+            f.write(f'{west:12.3f} !! west  edge [deg]\n')
+            f.write(f'{-west:12.3f} !! east  edge [deg]\n')
+            f.write(f'{-north:12.3f} !! south edge [deg]\n')
+            f.write(f'{north:12.3f} !! north edge [deg]\n')
+        self.write_bin('nextxy', nextx, nexty)
+        self.write_bin('basin',  basin)
+        self.write_bin('upgrid', upgrid)
+        self.write_bin('uparea', uparea)
+        self.write_bin('ctmare', ctmare)
+        self.write_bin('grdare', grdare)
+        self.write_bin('elevtn', elevtn)
+        self.write_bin('lonlat', outlon, outlat)
+
+        if self.hires:
+            self.make_hires(land)
+
+        self.land, self.uparea, self.grdare = land, uparea, grdare
+        self.outlon, self.outlat = outlon, outlat
+
+
+    def make_hires(self, land):
+        '''
+        1min catchment map: every hires pixel belongs to the coarse grid containing it
+        '''
+        nfine = int(round(self.gsize * 60))
+        mx, my = self.nx * nfine, self.ny * nfine
+        os.makedirs(os.path.join(self.mapdir, '1min'), exist_ok=True)
+        with open(os.path.join(self.mapdir, '1min', 'location.txt'), 'w') as f:
+            f.write('code  1\n')
+            f.write('   area     west     east    south    north       nx       ny      csize\n')
+            f.write(f'      1     1min  -180.000  180.000  -90.000   90.000 {mx:8d} {my:8d} {1/60:.9f}\n')
+        jx = np.arange(mx) // nfine
+        with open(os.path.join(self.mapdir, '1min', '1min.catmxy.bin'), 'wb') as f:
+            # written by rows of my to keep memory bounded at glb resolutions
+            for field in ('x', 'y'):
+                for jy in range(my):
+                    iy = jy // nfine
+                    val = (jx + 1) if field == 'x' else np.full(mx, iy + 1)
+                    val = np.where(land[jx, iy], val, -9999).astype(np.int16)
+                    val.tofile(f)
+
+
+    def make_grand(self):
+        '''
+        GRanD-like list: dams on land grids with large drainage area, a few sharing a grid
+        '''
+        cand  = np.argwhere(self.land & (self.uparea * 1e-6 > 1000.0))
+        pick  = cand[self.rng.choice(len(cand), size=min(self.ndams, len(cand)), replace=False)]
+        ndup  = max(1, len(pick) // 50)
+        pick  = np.vstack([pick, pick[:ndup]])
+        ndams = len(pick)
+        ix, iy = pick[:, 0], pick[:, 1]
+
+        jitter = (self.rng.random((ndams, 2)) - 0.5) * 0.4 * self.gsize
+        up     = self.uparea[ix, iy] * 1e-6 * (1.0 + (self.rng.random(ndams) - 0.5) * 0.1)
+        names  = np.array([f'Dam {i}' for i in range(1, ndams + 1)], dtype=object)
+        names[self.rng.random(ndams) < 0.05] = np.nan
+        df = pd.DataFrame({
+            'GRAND_ID' : np.arange(1, ndams + 1),
+            'RES_NAME' : names,
+            'DAM_NAME' : names,
+            'LONG_DD'  : np.round(self.outlon[ix, iy] + jitter[:, 0], 4),
+            'LAT_DD'   : np.round(self.outlat[ix, iy] + jitter[:, 1], 4),
+            'CAP_MCM'  : np.round(10 ** self.rng.uniform(0, 4, ndams), 1),
+            'CATCH_SKM': np.round(up, 1),
+            'MAIN_USE' : self.rng.choice(np.array(MAIN_USE, dtype=object), ndams),
+            'YEAR'     : self.rng.integers(1900, 2010, ndams),
+        })
+        df.loc[self.rng.random(ndams) < 0.01, 'CATCH_SKM'] = 0
+        df.to_csv(self.grand_if, index=False)
+        self.grand = df
+
+
+    def make_grsad_regeom(self):
+        '''
+        GRSAD monthly surface area and ReGeom area-storage-depth curve of each dam
+        '''
+        dates = pd.date_range('1984-03-01', '2018-12-01', freq='MS')
+        error = []
+        for gid, cap in zip(self.grand['GRAND_ID'].values, self.grand['CAP_MCM'].values):
+            amax = np.sqrt(cap) * 0.5
+            if self.rng.random() < 0.03:       # missing GRSAD data
+                continue
+            season = 0.5 + 0.3 * np.sin(2 * np.pi * dates.month.values / 12.0)
+            area = np.round(amax * np.clip(season + self.rng.normal(0, 0.1, len(dates)), 0.05, 1.0), 3)
+            area[self.rng.random(len(dates)) < 0.2] = area[0]   # repeated values removed by dam_storage
+            pd.DataFrame({'1water': area, '2water_ext': area, '3water_enh': area},
+                         index=pd.Index(dates, name='date')).to_csv(
+                             os.path.join(self.grsaddir, f'{gid}_intp'), sep='\t')
+
+            if self.rng.random() < 0.03:       # missing ReGeom data
+                continue
+            depth = np.linspace(0, 50, 26)
+            rarea = amax * (depth / depth[-1]) ** 0.7
+            sto   = np.concatenate([[0.0], np.cumsum(0.5 * (rarea[1:] + rarea[:-1]) * np.diff(depth))])
+            with open(os.path.join(self.regeomdir, f'{gid}.csv'), 'w') as f:
+                for i in range(7):
+                    f.write(f'# synthetic ReGeom header line {i + 1}\n')
+                f.write('Depth (m), Area (skm), Storage (mcm)\n')
+                for d, a, s in zip(depth, rarea, sto):
+                    f.write(f'{d:.2f},{a:.4f},{s:.4f}\n')
+            error.append((gid, cap, sto[-1]))
+        pd.DataFrame(error, columns=['GRAND_ID', 'V_GRanD_mcm', 'V_est_mcm']).to_csv(self.error_if, index=False)
+
+
+    def make_outflw(self):
+        '''
+        Daily outflw [m3/s] following the drainage area with a seasonal cycle and flood peaks
+        '''
+        base = np.where(self.land, self.uparea * 1e-6 * 0.01, 1e20).astype(np.float32).T   # (ny, nx)
+        for year in range(self.syear, self.eyear + 1):
+            ndays = 366 if (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)) else 365
+            fout  = os.path.join(self.simdir, f'o_outflw{year}.nc')
+            with nc.Dataset(fout, 'w') as cdf:
+                cdf.createDimension('time', None)
+                cdf.createDimension('lat', self.ny)
+                cdf.createDimension('lon', self.nx)
+                t = cdf.createVariable('time', 'f8', ('time',))
+                t.units = f'days since {year}-01-01 00:00:00'
+                cdf.createVariable('lat', 'f4', ('lat',))[:] = self.outlat[0, :]
+                cdf.createVariable('lon', 'f4', ('lon',))[:] = self.outlon[:, 0]
+                var = cdf.createVariable('outflw', 'f4', ('time', 'lat', 'lon'))
+                var.units = 'm3/s'
+                # written in monthly slabs to keep memory bounded at glb resolutions
+                for d0 in range(0, ndays, 31):
+                    days  = np.arange(d0, min(ndays, d0 + 31))
+                    cycle = 1.0 + 0.6 * np.sin(2 * np.pi * (days / ndays))
+                    peaks = self.rng.gamma(2.0, 0.3, (len(days), 1, 1)).astype(np.float32)
+                    slab  = base[None] * (cycle[:, None, None] * peaks).astype(np.float32)
+                    t[days]   = days
+                    var[days] = np.where(base[None] >= 1e20, 1e20, slab)
+
+
+    def write_namelist(self, ncores=4, para=False):
+        with open(self.nml_file, 'w') as f:
+            f.write('&General\n')
+            f.write(f'\tPara_Tag    = {para}\n')
+            f.write('\tDebug_Tag   = False\n')
+            f.write(f'\tNum_Cores   = {ncores}\n')
+            f.write(f'\tMap_Tag     = {self.size}\n')
+            f.write(f'\tMap_Dir     = {self.mapdir}\n')
+            f.write(f'\tSave_Dir    = {self.savedir}\n')
+            f.write('/\n\n')
+            f.write('&dam_basicInfo\n')
+            f.write('\tMin_Error   = 0.1\n')
+            f.write('\tMin_Uparea  = 1000.0\n')
+            f.write(f'\tGRanD_If    = {self.grand_if}\n')
+            f.write('/\n\n')
+            f.write('&dam_discharge\n')
+            f.write(f'\tStart_Year  = {self.syear}\n')
+            f.write(f'\tEnd_Year    = {self.eyear}\n')
+            f.write('\tPeriod_Year = 100\n')
+            f.write('\tMax_Days    = 1\n')
+            f.write('\tQf1         = 0.5\n')
+            f.write('\tQf2         = 1.5\n')
+            f.write(f'\tSim_Dir     = {self.simdir}\n')
+            f.write('/\n\n')
+            f.write('&dam_storage\n')
+            f.write('\tPc_Fld      = 75\n')
+            f.write('\tPc_Nor      = 30\n')
+            f.write('\tPc_Con      = 10\n')
+            f.write(f'\tGRSADdir         = {self.grsaddir}\n')
+            f.write(f'\tReGeomdir        = {self.regeomdir}\n')
+            f.write(f'\tReGeom_ErrorFile = {self.error_if}\n')
+            f.write('/\n')
+        return self.nml_file
+
+
+    def main_func(self, ncores=4, para=False):
+        print(f'--- Generate synthetic dam dataset: {self.size} ({self.nx} x {self.ny}) in {self.outdir} ---')
+        self.make_map()
+        self.make_grand()
+        self.make_grsad_regeom()
+        self.make_outflw()
+        nml_file = self.write_namelist(ncores, para)
+        print('--- Done ---', nml_file)
+        return nml_file
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='generate a synthetic CaMa map and dam dataset')
+    parser.add_argument('outdir', help='directory to write the dataset to')
+    parser.add_argument('--size', default='toy', choices=list(SIZES.keys()))
+    parser.add_argument('--years', type=int, default=3, help='number of natsim years')
+    parser.add_argument('--start-year', type=int, default=2000)
+    parser.add_argument('--hires', action='store_true', help='also write the 1min catmxy map')
+    parser.add_argument('--ncores', type=int, default=4, help='Num_Cores written to dam.nml')
+    parser.add_argument('--para', action='store_true', help='Para_Tag written to dam.nml')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    dam_synthetic_Class(args.outdir, args.size, args.years, args.start_year, args.hires,
+                        args.seed).main_func(args.ncores, args.para)
@@ -6,7 +6,7 @@ Apr 25, 2023, written by Shulei Zhang
 '''
 import glob
 import multiprocessing
-from multiprocessing import Pool, sharedctypes
+from multiprocessing import sharedctypes
 import sys
 import time
 import netCDF4 as nc
@@ -14,12 +14,28 @@ import numpy as np
 import pandas as pd
 from scipy.interpolate import interp1d
 import os
+from dam_context import CamaMap, DamPipelineContext
+from dam_logging import get_logger, start_progress, advance, stop_progress
+
+log = get_logger('dam_wuse')
+
+
+# instance used by the forked workers; passing self.cal_wuse_grid or self.cal_n_share to the
+# pool would pickle the whole object, including the shared context and its map arrays, for
+# every task
+_pool_self = None
+
+def _pool_cal_wuse_grid(dam):
+    return _pool_self.cal_wuse_grid(dam)
+
+def _pool_cal_n_share(dam):
+    return _pool_self.cal_n_share(dam)
 
 
 
 class dam_wuse_Class:
    
-    def __init__(self, namelist):
+    def __init__(self, namelist, context=None):
 
         self.name     = 'dam_wuse_Class'
         self.version  = '0.1'
@@ -44,8 +60,9 @@ class dam_wuse_Class:
         self.iy_file  = f'{self.wuse_dir}/iy_{self.mtag}.txt'
         self.share_file = f'{self.wuse_dir}/grid_share_{self.mtag}.txt'
 
-        #-- read dam data
-        self.dam_data = pd.read_csv(self.damlist,skiprows=[0])
+        #-- dam data shared with the other stages (damloc.csv if not in memory yet)
+        self.context  = context if context is not None else DamPipelineContext(namelist)
+        self.dam_data = self.context.dam_frame()
         self.dam_data = self.dam_data.sort_values('GRAND_ID')
         self.GRAND_ID= np.array(self.dam_data['GRAND_ID'   ])
         self.dam_name= np.array(self.dam_data['DAM_NAME'   ])
@@ -94,38 +111,21 @@ class dam_wuse_Class:
         '''
         function to read map data
         '''
-        print("Read Map Files: /params.bin") 
-        fparam = f'{map_dir}/params.txt'
-        with open(fparam, 'r') as f:
-            self.nx = int((f.readline()).split()[0])
-            self.ny = int((f.readline()).split()[0])
-            f.readline()
-            self.gsize = float((f.readline()).split()[0])
-            self.west = float((f.readline()).split()[0])
-            self.east = float((f.readline()).split()[0])
-            self.south = float((f.readline()).split()[0])
-            self.north = float((f.readline()).split()[0])
-
-        print("Read Map Files: /grdare.bin") 
-        finp = f"{map_dir}/grdare.bin"   # unit: m2
-        grdare = np.zeros((self.nx, self.ny), dtype=np.float32)
-        with open(finp, "rb") as f:
-            # read grdare
-            f.seek(0)
-            grdare_bytes = f.read(4 * self.nx * self.ny)
-            grdare = np.frombuffer(grdare_bytes, dtype=np.float32)
-            grdare = np.reshape(grdare, (self.nx, self.ny), order='F')
+        # the map is shared through the context, so elevtn is not read again after dam_basicInfo
+        cmap = self.context.cmap if map_dir == self.context.mapdir else CamaMap(map_dir)
+
+        log.debug('Read Map Files: /params.bin')
+        self.nx, self.ny = cmap.nx, cmap.ny
+        self.gsize = cmap.gsize
+        self.west, self.east = cmap.west, cmap.east
+        self.south, self.north = cmap.south, cmap.north
+
+        log.debug('Read Map Files: /grdare.bin')
+        grdare = cmap.read('grdare')      # unit: m2
         self.grdare = grdare * 10**(-6) # unit: m2 to km2
 
-        print("Read Map Files: /elevtn.bin") 
-        finp = f"{map_dir}/elevtn.bin"     # unit: m
-        elevtn = np.zeros((self.nx, self.ny), dtype=np.float32)
-        with open(finp, "rb") as f:
-            # read elevtn
-            f.seek(0)
-            elevtn_bytes = f.read(4 * self.nx * self.ny)
-            elevtn = np.frombuffer(elevtn_bytes, dtype=np.float32)
-            self.elevtn = np.reshape(elevtn, (self.nx, self.ny), order='F')
+        log.debug('Read Map Files: /elevtn.bin')
+        self.elevtn = cmap.read('elevtn')     # unit: m
 
 
     def cal_wuse_grid(self, dam_i):
@@ -243,6 +243,7 @@ class dam_wuse_Class:
 
         
         #-- save the number of grids
+        advance()
         return len_ixiy, ix_list, iy_list
     
 
@@ -257,7 +258,7 @@ class dam_wuse_Class:
 
         self.read_map_data(self.mapdir)
 
-        print('identify the wateruse_grids......')
+        log.info('identify the wateruse_grids of %d dams', self.ndam)
         len_ixiy = [] # to save the number of grids of each dam
 
         inputlist = np.arange(self.ndam)    ####### check #######
@@ -266,10 +267,14 @@ class dam_wuse_Class:
 
         if self.ptag :
             #---
-            print("Multi core operation......")
-            p = Pool(self.ncores) 
-            save_list = p.map(self.cal_wuse_grid, inputlist)
+            log.debug('Multi core operation: %d cores', self.ncores)
+            start_progress('dam_wuse', self.ndam, 'dams')
+            global _pool_self
+            _pool_self = self
+            p = multiprocessing.get_context('fork').Pool(self.ncores)
+            save_list = p.map(_pool_cal_wuse_grid, inputlist)
             p.close()
+            stop_progress(self.ndam)
 
             save_len_ixiy_temp = []
             ix_list_temp = []
@@ -302,7 +307,8 @@ class dam_wuse_Class:
             f.close()
 
         else:
-            print("Single core operation......")
+            log.debug('Single core operation')
+            start_progress('dam_wuse', self.ndam, 'dams')
             save_len_ixiy_temp = []
             ix_list_temp = []
             iy_list_temp = []
@@ -311,6 +317,7 @@ class dam_wuse_Class:
                 save_len_ixiy_temp.append(length)
                 ix_list_temp.append(ix)
                 iy_list_temp.append(iy)
+            stop_progress(self.ndam)
             
             max_column = max(save_len_ixiy_temp)
             first_line = '0. serial number // 1. dam id // 2. wateruse area estimated by vol~wuse_area relationship (km2) // 3. wateruse_grid area (km2) // 4. number of wateruse_grid // 5. grid-ix/iy\n'
@@ -334,7 +341,7 @@ class dam_wuse_Class:
                     f.write('\n')
             f.close()
 
-        print('--!!! p01_calc_dam_wuse_grids finished !!!--')
+        log.info('p01_calc_dam_wuse_grids finished')
 
 
        
@@ -343,7 +350,7 @@ class dam_wuse_Class:
 
 
     def read_grid_ix_iy_data(self):
-        print('Reading grid_ix and grid_iy data ...')
+        log.debug('Reading grid_ix and grid_iy data ...')
         head_row = 2 # skip the first and second lines
         with open(self.ix_file, 'r') as f:
             lines = f.readlines()
@@ -410,13 +417,14 @@ class dam_wuse_Class:
             for i in range(len(save_share)):  
                 share_line.append(save_share[i])
             
+            advance()
             return share_line
 
 
     def p02_identify_overlapping_grids(self):
         self.read_grid_ix_iy_data()
 
-        print('Searching overlapping grids ...')
+        log.info('Searching overlapping grids ...')
         self.ix_lim = np.zeros([self.ndam,2])
         self.iy_lim = np.zeros([self.ndam,2])
         for dam_i in range(self.ndam):
@@ -428,10 +436,14 @@ class dam_wuse_Class:
         open(self.share_file, 'w')
 
         if self.ptag :
-            print("Multi core operation......")
-            p = Pool(self.ncores)
-            share_list=p.map(self.cal_n_share, inputlist)
+            log.debug('Multi core operation: %d cores', self.ncores)
+            start_progress('dam_wuse', self.ndam, 'dams')
+            global _pool_self
+            _pool_self = self
+            p = multiprocessing.get_context('fork').Pool(self.ncores)
+            share_list=p.map(_pool_cal_n_share, inputlist)
             p.close()
+            stop_progress(self.ndam)
             
             first_line = '0. serial number // 1. dam id // 2. wateruse area estimated by vol~wuse_area relationship (km2) // 3. wateruse_grid area (km2) // 4. number of wateruse_grid // 5. grid proportion (0, 1]\n'
             with open(self.share_file, 'a+') as f:
@@ -444,10 +456,12 @@ class dam_wuse_Class:
                     f.write('\n')
 
         else:
-            print("Single core operation......")
+            log.debug('Single core operation')
+            start_progress('dam_wuse', self.ndam, 'dams')
             share_list = []
             for inpi in inputlist:
                 share_list.append(self.cal_n_share(inpi))
+            stop_progress(self.ndam)
 
             first_line = '0. serial number // 1. dam id // 2. wateruse area estimated by vol~wuse_area relationship (km2) // 3. wateruse_grid area (km2) // 4. number of wateruse_grid // 5. grid proportion (0, 1]\n'
             with open(self.share_file, 'a+') as f:
@@ -458,13 +472,17 @@ class dam_wuse_Class:
                     for i in range(5,len(sl)):   # write grid sl 
                         f.write('%8.4f' % sl[i])
                     f.write('\n')
-        print('--!!! p02_calc_overlapping_grids finished !!!--')
+        log.info('p02_calc_overlapping_grids finished')
 
 
 
 
     def main_function(self):
+        start_time = time.time()
+        log.info('--- Start Process Dam Water Use ---')
         self.p01_identify_wuse_grids()
         self.p02_identify_overlapping_grids()
+        log.info('--- Done: dam_wuse, %.1f s ---', time.time() - start_time)
+        return self.context
 
 
@@ -1,4 +1,3 @@
-
 import os
 import read_nml as nml
 import sys
@@ -9,10 +8,7 @@ import time
 #sys.path.append(r"./dam_discharge")
 #sys.path.append(r"./dam_storage")
 
-from dam_basicInfo_Class import dam_basicInfo_Class
-from dam_discharge_Class import dam_discharge_Class
-from dam_storage_Class import dam_storage_Class
-from dam_wuse_Class import dam_wuse_Class
+from dam_pipeline import dam_pipeline_Class
 
 
 # read namelist
@@ -20,49 +16,14 @@ namelist = nml.read_namelist('./dam.nml')
 
 
 
-# dam_basicInfo
-print("\n")
-print("Start dam_basicInfo...")
-start_time = time.time()
-mainf = dam_basicInfo_Class(namelist)
-mainf.main_func()
-print("End dam_basicInfo...")
-print("--- %s seconds ---" % (time.time() - start_time))
-
-
-
-# dam_discharge
-print("\n\n\n")
-print("Start dam_discharge...")
-start_time = time.time()
-mainf = dam_discharge_Class(namelist)
-mainf.main_func()
-print("End dam_discharge...")
-print("--- %s seconds ---" % (time.time() - start_time))
-
-
-
-# dam_storage
-print("\n\n\n")
-print("Start dam_storage...")
-start_time = time.time()
-mainf = dam_storage_Class(namelist)
-mainf.main_func()
-print("End dam_storage...")
-print("--- %s seconds ---" % (time.time() - start_time))
-# print start_time
-
-
-
-
-# dam_wuse
-print("\n\n\n")
-print("Start dam_wuse...")
+# dam_basicInfo -> dam_discharge / dam_storage / dam_wuse
+# stages whose inputs did not change since the last run are skipped (see dam_pipeline.py);
+# add force=['dam_storage', ...] to rerun stages unconditionally
+# progress is printed every few seconds; set Debug_Tag = True in dam.nml to get the
+# per-dam details in Save_Dir/logs/dam_pipeline_*.log
 start_time = time.time()
-mainf = dam_wuse_Class(namelist)
-p = mainf.main_function()
-print("End dam_wuse...")
+mainf = dam_pipeline_Class(namelist)
+state = mainf.main_func()
 print("--- %s seconds ---" % (time.time() - start_time))
-
-
-
+if any(s in ('failed', 'blocked') for s in state.values()):
+    sys.exit(1)
@@ -1,11 +1,12 @@
-import xarray as xr
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
 
-# 文件路径
-file1 = "/stu02/yuxr24/CoLM202X/output/MX-Escandon_sitedata/history/MX-Escandon_sitedata_hist_2012.nc"
-file2 = "/stu02/yuxr24/CoLM202X/output/MX-Escandon_GISA_hourly/history/MX-Escandon_GISA_hourly_hist_2012.nc"
+import isa_cube
+
+# 数据来源（isa_cube 中的站点/数据源）
+base_dir = "/stu02/yuxr24/CoLM202X/output"
+station = "MX-Escandon"
 
 # 输出路径
 output_dir = "/stu02/yuxr24/CoLM202X_ISA/pictures"
@@ -20,9 +21,10 @@ variables = [
 start_date = "2012-07-01"
 end_date = "2012-07-01"
 
-# 打开 NetCDF 文件
-ds1 = xr.open_dataset(file1)
-ds2 = xr.open_dataset(file2)
+# 从 isa_cube 读取（新增的 history 文件先被抽取）
+isa_cube.extract(base_dir)
+ds1 = isa_cube.open_case(station, "sitedata", variables, root=base_dir)
+ds2 = isa_cube.open_case(station, "GISA", variables, root=base_dir)
 
 # 选择时间段
 ds1_sel = ds1.sel(time=slice(start_date, end_date))
@@ -0,0 +1,255 @@
+'''
+Content-addressed cache of the ISA analysis results
+
+The analysis functions (diurnal statistics, monthly reductions, metrics, the sorted series
+of the exceedance analysis) are decorated with cached: the result of a call is stored in
+
+    output/isa_cache/{key}.npz
+
+where key is the sha256 of the function name and version, of all its parameters (thresholds,
+seasons, UTC offsets, ...; offset_hours='site' enters as the offset of every station in
+isa_reader.UTC_OFFSETS, so editing the table invalidates the results) and of the identity (path, size, mtime) of the store files
+(isa_cube) it reads.  A store file is rewritten only when one of its history files changed,
+so a rerun of a plotting script after a change of colors or fonts reads every statistic from
+the cache, and after new runs only the cases of these runs are recomputed (the per-case
+workers of isa_reduce and isa_metrics are cached one case at a time).
+
+Results are kept as plain arrays in an npz file (no pickle): numpy arrays, DataFrames (one
+array per column), and lists, tuples and dicts of these and of scalars / strings, the layout
+being stored as JSON next to the arrays.  Every hit touches its file; when the cache grows
+over MAX_MB (environment ISA_CACHE_MB) the least recently used files are removed.  ISA_CACHE=0
+turns the cache off.
+
+Oct 2026
+'''
+import functools
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+import pandas as pd
+
+import isa_cube
+import isa_derived
+import isa_reader
+
+
+CACHE_DIR = 'isa_cache'
+MAX_MB    = float(os.environ.get('ISA_CACHE_MB', 512))
+ENABLED   = os.environ.get('ISA_CACHE', '1') != '0'
+
+
+
+def cache_dir(root=None):
+    return os.path.join(root or isa_cube.default_root(), CACHE_DIR)
+
+
+def case_files(root, stations=None, sources=None):
+    '''
+    Store files of the given stations and sources (all cases for None)
+    '''
+    root = root or isa_cube.default_root()
+    return [isa_cube.cube_path(root, st, src) for st, src in isa_cube.cases(root)
+            if (stations is None or st in stations) and (sources is None or src in sources)]
+
+
+def file_identity(paths):
+    ident = []
+    for path in sorted(set(paths)):
+        try:
+            st = os.stat(path)
+            ident.append((path, st.st_size, st.st_mtime_ns))
+        except OSError:
+            ident.append((path, None, None))
+    return ident
+
+
+def fingerprint(obj, h):
+    '''
+    Feed a canonical form of obj (parameters of a call) to the hash h
+    '''
+    if isinstance(obj, np.ndarray):
+        h.update(f'array{obj.dtype.str}{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (pd.Series, pd.Index)):
+        fingerprint(obj.to_numpy(), h)
+    elif isinstance(obj, dict):
+        h.update(b'dict')
+        for k in sorted(obj, key=repr):
+            fingerprint(k, h)
+            fingerprint(obj[k], h)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        h.update(type(obj).__name__.encode())
+        for v in (sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj):
+            fingerprint(v, h)
+        h.update(b'end')
+    else:
+        if isinstance(obj, np.generic):
+            obj = obj.item()
+        h.update(f'{type(obj).__name__}:{obj!r};'.encode())
+
+
+def resolve_offsets(params):
+    '''
+    Parameters with offset_hours='site' replaced by the UTC offsets of the stations it stands for
+    '''
+    if not isinstance(params.get('offset_hours'), str) or params['offset_hours'] != 'site':
+        return params
+    stations = params.get('stations')
+    if stations is None:
+        offsets = dict(isa_reader.UTC_OFFSETS)
+    else:
+        stations = [stations] if isinstance(stations, str) else stations
+        offsets  = {st: isa_reader.UTC_OFFSETS.get(st) for st in stations}
+    return dict(params, offset_hours=offsets)
+
+
+def make_key(name, version, params, inputs):
+    h = hashlib.sha256()
+    # the definitions of the derived variables are part of every result that may use them
+    fingerprint((name, version, params, file_identity(inputs), isa_derived.DERIVED), h)
+    return h.hexdigest()
+
+
+def encode(obj, arrays):
+    '''
+    JSON layout of obj, its arrays appended to arrays; TypeError for what cannot be stored
+    '''
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return {'v': obj}
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            raise TypeError('object arrays are not cached')
+        arrays.append(obj)
+        return {'a': len(arrays) - 1}
+    if isinstance(obj, pd.DataFrame):
+        if not isinstance(obj.index, pd.RangeIndex) or not all(isinstance(c, str) for c in obj.columns):
+            raise TypeError('only DataFrames with a default index and named columns are cached')
+        cols, strs = [], []
+        for c in obj.columns:
+            vals = obj[c].to_numpy()
+            if vals.dtype == object:
+                if not all(isinstance(v, str) for v in vals):
+                    raise TypeError(f'column {c} holds other objects than strings')
+                vals = vals.astype(str)
+                strs.append(c)
+            cols.append([c, encode(vals, arrays)])
+        return {'df': cols, 'str': strs}
+    if isinstance(obj, dict):
+        return {'d': [[encode(k, arrays), encode(v, arrays)] for k, v in obj.items()]}
+    if isinstance(obj, (list, tuple)):
+        return {'l' if isinstance(obj, list) else 't': [encode(v, arrays) for v in obj]}
+    raise TypeError(f'{type(obj).__name__} is not cached')
+
+
+def decode(spec, arrays):
+    if 'v' in spec:
+        return spec['v']
+    if 'a' in spec:
+        return arrays[f'a{spec["a"]}']
+    if 'df' in spec:
+        frame = pd.DataFrame({c: decode(s, arrays) for c, s in spec['df']})
+        for c in spec['str']:
+            frame[c] = frame[c].astype(object)
+        return frame
+    if 'd' in spec:
+        return {decode(k, arrays): decode(v, arrays) for k, v in spec['d']}
+    if 'l' in spec:
+        return [decode(v, arrays) for v in spec['l']]
+    return tuple(decode(v, arrays) for v in spec['t'])
+
+
+def load(path):
+    '''
+    Cached result at path, None if there is none (or it cannot be read)
+    '''
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = {k: npz[k] for k in npz.files}
+        value = decode(json.loads(str(arrays.pop('__spec__'))), arrays)
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        os.utime(path)                    # least recently used goes first
+    except OSError:
+        pass
+    return value
+
+
+def store(path, value):
+    arrays = []
+    try:
+        spec = encode(value, arrays)
+    except TypeError:
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, __spec__=np.array(json.dumps(spec)),
+                 **{f'a{i}': a for i, a in enumerate(arrays)})
+    os.replace(tmp, path)
+    return True
+
+
+def evict(directory, max_mb=None):
+    '''
+    Remove the least recently used results until the cache holds at most max_mb
+    '''
+    max_mb = MAX_MB if max_mb is None else max_mb
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.npz'):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_mb * 2 ** 20:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def clear(root=None):
+    directory = cache_dir(root)
+    if os.path.isdir(directory):
+        evict(directory, 0)
+
+
+def cached(version, inputs=None, name=None, ignore=('nprocs', 'verbose')):
+    '''
+    Decorator caching the results of a function; inputs(params) -> (root, files read) gets
+    the bound arguments of a call, the parameters in ignore do not change the result
+    '''
+    def decorate(func):
+        signature = inspect.signature(func)
+        fname = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in bound.arguments.items() if k not in ignore}
+            root, files = inputs(params) if inputs is not None else (None, [])
+            directory = cache_dir(root)
+            key = make_key(fname, version, resolve_offsets(params), files)
+            path = os.path.join(directory, key + '.npz')
+            value = load(path) if os.path.exists(path) else None
+            if value is not None:
+                return value
+            value = func(*args, **kwargs)
+            if value is not None and store(path, value):
+                evict(directory)
+            return value
+        return wrapper
+    return decorate
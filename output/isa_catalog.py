@@ -0,0 +1,235 @@
+'''
+Catalog of the history files of the ISA comparison runs under output/
+
+Every case of run/ISA_compare writes its history to
+
+    output/{station}_{GAIA|GISA|GISD|WSF}_hourly/history/{case}_hist_{date}.nc
+    output/{station}_sitedata/history/{case}_hist_{date}.nc
+
+build_catalog walks output/ once and records one row per history file in a small csv index
+(output/isa_catalog.csv): station, ISA source, frequency, year, path (relative to output/),
+size, mtime (ns), number of time steps, first/last time and the list of time-varying variables.
+The index is updated incrementally: files whose size and mtime did not change keep their row,
+only new or rewritten files are opened, and rows of deleted files are dropped.  The frequency
+is inferred from the median time step rounded to the nearest of FREQS, so files with gaps in
+time are still recognized (files left without a frequency are opened again at the next update).
+
+The plotting scripts look files up with query / find_files instead of globbing the tree.
+
+Usage:
+    python isa_catalog.py [OUTPUT_DIR] [--rebuild]
+
+Oct 2026
+'''
+import argparse
+import os
+import re
+import numpy as np
+import pandas as pd
+
+
+CATALOG_FILE = 'isa_catalog.csv'
+
+SOURCES = ('GAIA', 'GISA', 'GISD', 'WSF', 'sitedata')
+
+COLUMNS = ['station', 'source', 'freq', 'year', 'case', 'path', 'size', 'mtime',
+           'ntime', 'time_start', 'time_end', 'variables']
+
+# {station}_{source}[_{freq}] (case directory) and {case}_hist[_cama]_{yyyy[-mm[-dd]]}.nc
+RE_CASE = re.compile(r'^(?P<station>[A-Za-z0-9\-]+)_(?P<source>GAIA|GISA|GISD|WSF|sitedata)'
+                     r'(?:_(?P<freq>[A-Za-z]+))?$')
+RE_HIST = re.compile(r'^(?P<case>.+?)_hist_(?:cama_)?(?P<year>\d{4})(?:-\d{2}){0,2}\.nc$')
+
+FREQS = {3600: 'hourly', 86400: 'daily'}
+FREQ_TOLERANCE = 0.05       # relative difference of the median step to a frequency of FREQS
+
+
+
+def default_root():
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_history_path(relpath):
+    '''
+    station, source, freq, year and case of a history file path relative to output/;
+    None if the path is not a history file of an ISA comparison case
+    '''
+    parts = relpath.replace(os.sep, '/').split('/')
+    if len(parts) != 3 or parts[1] != 'history':
+        return None
+    mcase = RE_CASE.match(parts[0])
+    mhist = RE_HIST.match(parts[2])
+    if mcase is None or mhist is None:
+        return None
+    freq = mcase.group('freq')
+    if freq is None:
+        # sitedata cases: {station}_hourly_hist_*.nc / {station}_sitedata_hist_*.nc
+        suffix = mhist.group('case')[len(mcase.group('station')) + 1:]
+        freq = suffix if suffix in ('hourly', 'daily', 'monthly') else ''
+    return {'station': mcase.group('station'), 'source': mcase.group('source'),
+            'freq': freq.lower(), 'year': int(mhist.group('year')), 'case': mhist.group('case')}
+
+
+def infer_freq(step):
+    '''
+    Frequency of FREQS nearest to a time step (seconds), '' if none is close
+    '''
+    if step is None or step <= 0:
+        return ''
+    nearest = min(FREQS, key=lambda s: abs(np.log(step / s)))
+    return FREQS[nearest] if abs(step / nearest - 1) <= FREQ_TOLERANCE else ''
+
+
+def read_history_header(path):
+    '''
+    Number of time steps, first/last time (ISO), median time step (seconds) and time-varying
+    variables of a history file
+    '''
+    import netCDF4 as nc
+    with nc.Dataset(path) as ds:
+        variables = [k for k, v in ds.variables.items() if 'time' in v.dimensions and k != 'time']
+        ntime = len(ds.dimensions['time']) if 'time' in ds.dimensions else 0
+        tstart = tend = ''
+        step = None
+        if ntime > 0:
+            tvar  = ds.variables['time']
+            times = np.asarray(tvar[:], dtype=np.float64)
+            calendar = getattr(tvar, 'calendar', 'standard')
+            dates = nc.num2date(times[[0, -1]], tvar.units, calendar,
+                                only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+            tstart, tend = dates[0].isoformat(), dates[-1].isoformat()
+            if ntime > 1:
+                # median step: gaps (missing records) do not change the frequency
+                dates = nc.num2date([times[0], times[0] + np.median(np.diff(times))], tvar.units, calendar,
+                                    only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+                step = (dates[1] - dates[0]).total_seconds()
+    return ntime, tstart, tend, step, variables
+
+
+def scan(root):
+    '''
+    Relative paths of the history files under root with their (size, mtime)
+    '''
+    found = {}
+    with os.scandir(root) as cases:
+        for case in cases:
+            if not case.is_dir() or RE_CASE.match(case.name) is None:
+                continue
+            hdir = os.path.join(case.path, 'history')
+            if not os.path.isdir(hdir):
+                continue
+            with os.scandir(hdir) as files:
+                for f in files:
+                    if f.is_file() and f.name.endswith('.nc'):
+                        st = f.stat()
+                        found[f'{case.name}/history/{f.name}'] = (st.st_size, st.st_mtime_ns)
+    return found
+
+
+def build_catalog(root=None, rebuild=False, verbose=False):
+    '''
+    Create or update root/isa_catalog.csv; returns the catalog as a DataFrame
+    '''
+    root  = root or default_root()
+    index = os.path.join(root, CATALOG_FILE)
+    old   = {}
+    if os.path.exists(index) and not rebuild:
+        for row in read_index(index).to_dict('records'):
+            old[row['path']] = row
+
+    rows, nnew = [], 0
+    for relpath, (size, mtime) in sorted(scan(root).items()):
+        meta = parse_history_path(relpath)
+        if meta is None:
+            continue
+        prev = old.get(relpath)
+        if prev is not None and prev['size'] == size and prev['mtime'] == mtime and prev['freq']:
+            rows.append(prev)
+            continue
+        try:
+            ntime, tstart, tend, step, variables = read_history_header(os.path.join(root, relpath))
+        except Exception as e:
+            print(f'  skip {relpath}: {e}')
+            continue
+        freq = infer_freq(step)
+        if freq:
+            meta['freq'] = freq
+        meta.update({'path': relpath, 'size': size, 'mtime': mtime, 'ntime': ntime,
+                     'time_start': tstart, 'time_end': tend, 'variables': ' '.join(variables)})
+        rows.append(meta)
+        nnew += 1
+        if verbose:
+            print(f'  + {relpath}')
+
+    catalog = pd.DataFrame(rows, columns=COLUMNS)
+    changed = nnew > 0 or len(rows) != len(old) or not os.path.exists(index)
+    if changed:
+        tmp = f'{index}.{os.getpid()}.tmp'
+        catalog.to_csv(tmp, index=False)
+        os.replace(tmp, index)
+    if verbose:
+        print(f'{len(catalog)} history files, {nnew} new or updated, '
+              f'{len(set(old) - set(catalog["path"]))} removed -> {index}')
+    return catalog
+
+
+def read_index(index):
+    return pd.read_csv(index, dtype={'freq': str, 'case': str, 'time_start': str,
+                                     'time_end': str, 'variables': str}, keep_default_na=False)
+
+
+def load_catalog(root=None, update=True):
+    '''
+    Catalog of root; with update=True new or changed history files are indexed first
+    '''
+    root = root or default_root()
+    if update:
+        catalog = build_catalog(root)
+    else:
+        catalog = read_index(os.path.join(root, CATALOG_FILE))
+    catalog.attrs['root'] = root
+    return catalog
+
+
+def query(catalog, station=None, source=None, year=None, freq=None, variable=None,
+          canonical=False):
+    '''
+    Rows of the catalog matching all given fields; station, source and year may be lists.
+    variable keeps the files containing it; canonical keeps only the files named after their
+    case directory (the sitedata cases also hold an older {station}_hourly_hist_* copy).
+    '''
+    sel = np.ones(len(catalog), dtype=bool)
+    for col, val in (('station', station), ('source', source), ('year', year), ('freq', freq)):
+        if val is None:
+            continue
+        vals = [val] if isinstance(val, (str, int, np.integer)) else list(val)
+        sel &= catalog[col].isin(vals).to_numpy()
+    if variable is not None:
+        sel &= catalog['variables'].map(lambda v: variable in v.split()).to_numpy(dtype=bool)
+    if canonical:
+        sel &= (catalog['path'].str.split('/').str[0] == catalog['case']).to_numpy()
+    return catalog[sel].sort_values(['station', 'source', 'year', 'path'])
+
+
+def find_files(catalog, station, source, year=None, canonical=False):
+    '''
+    Absolute paths of the history files of a station and source, sorted
+    '''
+    root = catalog.attrs.get('root', default_root())
+    rows = query(catalog, station=station, source=source, year=year, canonical=canonical)
+    return [os.path.join(root, p) for p in rows['path']]
+
+
+def stations(catalog):
+    return sorted(catalog['station'].unique())
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='index the history files of the ISA comparison runs')
+    parser.add_argument('root', nargs='?', default=None, help='output directory (default: this directory)')
+    parser.add_argument('--rebuild', action='store_true', help='ignore the existing index')
+    args = parser.parse_args()
+
+    catalog = build_catalog(args.root, rebuild=args.rebuild, verbose=True)
+    print(catalog.groupby(['source', 'freq']).size().to_string())
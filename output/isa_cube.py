@@ -0,0 +1,265 @@
+'''
+Site x product x variable store of the ISA comparison runs
+
+The history files of the site runs are written uncompressed with one patch and ~140 variables
+per time step, while the analysis scripts only need a few series at patch 0.  extract reads
+every history file of the catalog (isa_catalog) once, in parallel over the (station, source)
+cases, and writes one small NetCDF per case
+
+    output/isa_cube/{station}_{source}.nc
+
+with all years concatenated along time and the (time, patch) variables stored as rows of one
+float32 array data(variable, time) (-1e36 fill values converted to NaN), chunked one variable
+and one year at a time so that every series is contiguous in time; the variable names are in
+the variables_list attribute and the time in "minutes since 1900-1-1 0:0:0" as in the history
+files.  A single array keeps the files quick to open (one HDF5 dataset instead of ~140).
+A case is extracted again when one of its history files changed (the size/mtime of the
+sources are kept as an attribute) or when it was extracted with --vars and other variables
+are asked (the selection is kept next to the sources; a full store serves any selection).
+
+The scripts read the store with load (pandas, also the derived variables of isa_derived) or
+open_case (xarray); isa_reader reads the history files of a single case lazily, for what the
+store does not hold (other patches, layered variables, time ranges of a case not extracted).
+
+Usage:
+    python isa_cube.py [OUTPUT_DIR] [--nprocs N] [--force] [--vars f_rnof f_assim ...]
+
+Oct 2026
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import pandas as pd
+
+import isa_catalog
+import isa_derived
+
+
+CUBE_DIR   = 'isa_cube'
+TIME_UNITS = 'minutes since 1900-1-1 0:0:0'
+FILL       = -1.e36
+CHUNK      = 8784          # time steps per chunk: one leap year of hourly values
+
+
+
+def default_root():
+    return isa_catalog.default_root()
+
+
+def cube_path(root, station, source):
+    return os.path.join(root, CUBE_DIR, f'{station}_{source}.nc')
+
+
+def read_history(path, variables=None):
+    '''
+    Time (minutes since 1900) and {variable: float32 series at patch 0} of a history file
+    '''
+    import netCDF4 as nc
+    with nc.Dataset(path) as ds:
+        ds.set_auto_mask(False)
+        tvar  = ds.variables['time']
+        dates = nc.num2date(tvar[:], tvar.units, getattr(tvar, 'calendar', 'standard'))
+        minutes = np.asarray(nc.date2num(dates, TIME_UNITS, getattr(tvar, 'calendar', 'standard')),
+                             dtype=np.int64)
+        data = {}
+        for name, var in ds.variables.items():
+            if var.dimensions != ('time', 'patch'):
+                continue
+            if variables is not None and name not in variables:
+                continue
+            vals = np.asarray(var[:, 0], dtype=np.float64)
+            fill = getattr(var, 'missing_value', getattr(var, '_FillValue', FILL))
+            vals[(vals == fill) | (np.abs(vals) >= 1.e30)] = np.nan
+            data[name] = vals.astype(np.float32)
+    return minutes, data
+
+
+def write_case(dst, station, source, minutes, data, sources, selection=None):
+    import netCDF4 as nc
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    names = list(data.keys())
+    with nc.Dataset(tmp, 'w', format='NETCDF4') as ds:
+        ds.station   = station
+        ds.source    = source
+        ds.sources   = json.dumps(sources)
+        ds.selection = json.dumps(selection)
+        ds.variables_list = ' '.join(names)
+        ds.createDimension('variable', len(names))
+        ds.createDimension('time', len(minutes))
+        chunk = max(1, min(CHUNK, len(minutes)))
+        tvar = ds.createVariable('time', 'i8', ('time',), chunksizes=(chunk,))
+        tvar.units = TIME_UNITS
+        tvar[:] = minutes
+        # one variable per chunk row: every series is contiguous in time
+        dvar = ds.createVariable('data', 'f4', ('variable', 'time'), chunksizes=(1, chunk),
+                                 zlib=True, complevel=1, shuffle=True,
+                                 fill_value=np.float32(np.nan))
+        if names:
+            dvar[:] = np.stack([data[n] for n in names])
+    os.replace(tmp, dst)
+
+
+def extract_case(task):
+    '''
+    Read the history files of one (station, source) case once and write its store file
+    '''
+    root, station, source, rows, variables = task
+    t0 = time.time()
+    parts = [read_history(os.path.join(root, r['path']), variables) for r in rows]
+    names = [n for n in parts[0][1] if all(n in p[1] for p in parts)]
+    minutes = np.concatenate([p[0] for p in parts])
+    order   = np.argsort(minutes, kind='stable')
+    keep    = np.ones(len(order), dtype=bool)
+    keep[1:] = np.diff(minutes[order]) != 0       # overlapping restarts: first value wins
+    order   = order[keep]
+    data = {n: np.concatenate([p[1][n] for p in parts])[order] for n in names}
+    sources = [[r['path'], int(r['size']), int(r['mtime'])] for r in rows]
+    selection = sorted(variables) if variables is not None else None
+    write_case(cube_path(root, station, source), station, source, minutes[order], data, sources, selection)
+    return station, source, len(rows), len(order), time.time() - t0
+
+
+def stored_state(path):
+    '''
+    Sources and variable selection (None: all variables) of a store file, None if unreadable
+    '''
+    import netCDF4 as nc
+    try:
+        with nc.Dataset(path) as ds:
+            return json.loads(ds.sources), json.loads(getattr(ds, 'selection', 'null'))
+    except Exception:
+        return None
+
+
+def up_to_date(path, sources, variables=None):
+    state = stored_state(path)
+    if state is None or state[0] != sources:
+        return False
+    return state[1] is None or (variables is not None and set(variables) <= set(state[1]))
+
+
+def extract(root=None, variables=None, nprocs=4, force=False, verbose=False):
+    '''
+    Create or update the store of root; returns the list of (station, source) extracted
+    '''
+    root    = root or default_root()
+    catalog = isa_catalog.load_catalog(root)
+    catalog = isa_catalog.query(catalog, canonical=True)
+    os.makedirs(os.path.join(root, CUBE_DIR), exist_ok=True)
+
+    tasks = []
+    for (station, source), grp in catalog.groupby(['station', 'source']):
+        rows = grp.sort_values('year').to_dict('records')
+        sources = [[r['path'], int(r['size']), int(r['mtime'])] for r in rows]
+        dst = cube_path(root, station, source)
+        if not force and os.path.exists(dst) and up_to_date(dst, sources, variables):
+            continue
+        tasks.append((root, station, source, rows, variables))
+
+    done = []
+    if nprocs > 1 and len(tasks) > 1:
+        with multiprocessing.get_context('fork').Pool(min(nprocs, len(tasks))) as pool:
+            results = list(pool.imap_unordered(extract_case, tasks))
+    else:
+        results = [extract_case(t) for t in tasks]
+    for station, source, nfiles, ntime, sec in sorted(results):
+        done.append((station, source))
+        if verbose:
+            print(f'  {station} {source}: {nfiles} files, {ntime} steps, {sec:.1f} s')
+    if verbose:
+        print(f'{len(done)} cases extracted, {catalog.groupby(["station", "source"]).ngroups - len(done)} up to date')
+    return done
+
+
+def load(station, source, variables, root=None):
+    '''
+    DataFrame of the given variables (float32, NaN for missing) indexed by time (UTC);
+    the derived variables of isa_derived (fsen, rnof_mmh, ...) are computed from the stored ones
+    '''
+    import netCDF4 as nc
+    root = root or default_root()
+    variables = [variables] if isinstance(variables, str) else list(variables)
+    path = cube_path(root, station, source)
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    with nc.Dataset(path) as ds:
+        names   = ds.variables_list.split()
+        missing = [v for v in variables if v not in names and not isa_derived.available(v, names)]
+        if missing:
+            raise KeyError(f'{station} {source}: {", ".join(missing)} not in the store')
+        minutes = ds.variables['time'][:]
+        dvar    = ds.variables['data']
+
+        def read(components):
+            rows  = [names.index(c) for c in components]
+            order = np.argsort(rows)
+            block = np.asarray(dvar[np.asarray(rows)[order], :], dtype=np.float32)
+            return block[np.argsort(order)]
+
+        key = (path, st.st_size, st.st_mtime_ns)
+        frame = pd.DataFrame({v: np.asarray(dvar[names.index(v), :], dtype=np.float32) if v in names
+                                 else isa_derived.evaluate(v, names, read, key)
+                              for v in variables},
+                             index=pd.Timestamp('1900-01-01') + pd.to_timedelta(minutes, unit='min'))
+    frame.index.name = 'time'
+    return frame
+
+
+def case_variables(station, source, root=None):
+    '''
+    Variables stored for a case, empty if it was not extracted
+    '''
+    import netCDF4 as nc
+    path = cube_path(root or default_root(), station, source)
+    if not os.path.exists(path):
+        return []
+    with nc.Dataset(path) as ds:
+        return ds.variables_list.split()
+
+
+def open_case(station, source, variables=None, root=None):
+    '''
+    xarray Dataset of a case of the store (time decoded), None if it was not extracted
+    '''
+    import xarray as xr
+    path = cube_path(root or default_root(), station, source)
+    if not os.path.exists(path):
+        return None
+    with xr.open_dataset(path) as raw:
+        data = raw['data'].assign_coords(variable=raw.attrs['variables_list'].split())
+        if variables is not None:
+            data = data.sel(variable=list(variables))
+        ds = data.load().to_dataset('variable')
+    ds.attrs = {'station': station, 'source': source}
+    return ds
+
+
+def cases(root=None):
+    '''
+    (station, source) pairs available in the store
+    '''
+    cdir = os.path.join(root or default_root(), CUBE_DIR)
+    if not os.path.isdir(cdir):
+        return []
+    out = []
+    for f in sorted(os.listdir(cdir)):
+        if f.endswith('.nc'):
+            station, source = f[:-3].rsplit('_', 1)
+            out.append((station, source))
+    return out
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='extract the site series of the ISA comparison runs')
+    parser.add_argument('root', nargs='?', default=None, help='output directory (default: this directory)')
+    parser.add_argument('--nprocs', type=int, default=4)
+    parser.add_argument('--force', action='store_true', help='extract all cases again')
+    parser.add_argument('--vars', nargs='+', default=None, help='variables to keep (default: all)')
+    args = parser.parse_args()
+
+    extract(args.root, args.vars, args.nprocs, args.force, verbose=True)
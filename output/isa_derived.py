@@ -0,0 +1,107 @@
+'''
+Derived variables of the CoLM urban history output
+
+DERIVED defines, once for all scripts, the variables that are linear combinations of the history
+variables, e.g. the total sensible heat of the urban patch as the sum of its roof, wall,
+ground and tree parts.  isa_cube.load accepts their names next to the stored ones: the
+components are read as the float32 rows of data(variable, time) and summed in place into the
+first row, so a derived series costs one fused sum and no intermediate arrays.  Results are
+memoized per store file (path, size, mtime) in the process.
+
+A definition lists the components added (plus) and subtracted (minus) and a scale applied to
+the result; with optional=True the components missing in a case are left out (the urban
+parts differ between model versions), otherwise all are required; with skipna=True missing
+values count as 0 (as xarray sum with skipna), otherwise they propagate.
+
+Oct 2026
+'''
+import collections
+import numpy as np
+
+
+DERIVED = {
+    'fsen': {
+        'plus': ['f_fsengimp', 'f_fsengper', 'f_fsenurbl', 'f_fsenroof', 'f_fsenwsun', 'f_fsenwsha'],
+        'optional': True, 'skipna': True,
+        'units': 'W/m2', 'long_name': 'sensible heat from the urban patch',
+    },
+    'lfevp': {
+        'plus': ['f_lfevproof', 'f_lfevpgimp', 'f_lfevpgper', 'f_lfevpurbl'],
+        'optional': True, 'skipna': True,
+        'units': 'W/m2', 'long_name': 'latent heat from the urban patch',
+    },
+    'rnof_mmh': {
+        'plus': ['f_rnof'], 'scale': 3600.0,
+        'units': 'mm/h', 'long_name': 'total runoff',
+    },
+    'rnet': {
+        'plus': ['f_xy_solarin', 'f_xy_frl'], 'minus': ['f_sr', 'f_olrg'],
+        'units': 'W/m2', 'long_name': 'net radiation from the incoming and outgoing fluxes',
+    },
+    'ebal_residual': {
+        'plus': ['f_rnet'], 'minus': ['f_fsena', 'f_lfevpa', 'f_fgrnd'],
+        'units': 'W/m2', 'long_name': 'energy balance residual (Rnet - H - LE - G)',
+    },
+}
+
+MEMO_SIZE = 64
+
+_memo = collections.OrderedDict()
+
+
+
+def components(name, stored):
+    '''
+    (plus, minus) components of a derived variable present in the stored names
+    '''
+    spec = DERIVED[name]
+    plus, minus = spec.get('plus', []), spec.get('minus', [])
+    if spec.get('optional', False):
+        return [c for c in plus if c in stored], [c for c in minus if c in stored]
+    return list(plus), list(minus)
+
+
+def available(name, stored):
+    '''
+    True if name is a derived variable that can be evaluated from the stored names
+    '''
+    if name not in DERIVED:
+        return False
+    plus, minus = components(name, stored)
+    return bool(plus or minus) and all(c in stored for c in plus + minus)
+
+
+def evaluate(name, stored, read, key=None):
+    '''
+    Derived variable from read(components) -> float32 array (component, time) of fresh rows;
+    key identifies the store file for the memo
+    '''
+    if key is not None and (key, name) in _memo:
+        _memo.move_to_end((key, name))
+        return _memo[(key, name)]
+    spec = DERIVED[name]
+    plus, minus = components(name, stored)
+    missing = [c for c in plus + minus if c not in stored]
+    if missing or not (plus or minus):
+        raise KeyError(f'{name}: {", ".join(missing) or "no component"} not in the store')
+
+    rows = read(plus + minus)
+    if spec.get('skipna', False):
+        np.nan_to_num(rows, copy=False, nan=0.0)
+    out = rows[0]
+    if not plus:
+        np.negative(out, out=out)
+    for k in range(1, len(rows)):
+        if k < len(plus):
+            np.add(out, rows[k], out=out)
+        else:
+            np.subtract(out, rows[k], out=out)
+    if spec.get('scale', 1.0) != 1.0:
+        np.multiply(out, np.float32(spec['scale']), out=out)
+
+    if key is not None:
+        out.setflags(write=False)
+        _memo[(key, name)] = out
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return out
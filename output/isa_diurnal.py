@@ -0,0 +1,212 @@
+'''
+Diurnal climatology of the ISA comparison runs
+
+The hourly series of all requested (station, source, variable) are read from the store
+(isa_cube), shifted to local time and laid out on one array of shape (series, day, 24) over the
+union of the days.  Mean, count and all percentiles of every hour of day are then computed in
+one pass per season (a day mask): a NaN-aware mean and one sort of the day axis for all the
+percentiles (same values as np.nanpercentile, which loops over every slice holding a NaN).  The result is a tidy table
+
+    station, source, variable, season, hour, count, mean, p05, p95, ...
+
+that the plotting scripts only have to render.  max_deviation finds, for each station,
+variable and season, the product and hour whose mean departs most from the reference
+(sitedata) with one argmax over the stacked means.  diurnal_stats is cached (isa_cache) until
+one of the store files it reads changes.
+
+A variable is a stored or derived (isa_derived, e.g. fsen) variable, or the sum of several
+of them, e.g. {'tsum': ['f_tref', 'f_t_grnd']}: components missing in a case are left out,
+missing values count as 0 (as xarray sum with skipna).
+
+Oct 2026
+'''
+import numpy as np
+import pandas as pd
+
+import isa_cache
+import isa_cube
+import isa_derived
+import isa_reader
+
+
+SEASONS = {
+    'DJF': (12, 1, 2),
+    'MAM': (3, 4, 5),
+    'JJA': (6, 7, 8),
+    'SON': (9, 10, 11),
+}
+
+
+
+def percentile_name(p):
+    return f'p{p:02g}' if p < 10 else f'p{p:g}'
+
+
+def nanpercentile(a, q, axis):
+    '''
+    np.nanpercentile (linear method) along axis with one sort instead of a loop over the
+    slices containing NaN; result of shape (len(q),) + shape of a without axis
+    '''
+    a = np.sort(np.moveaxis(np.asarray(a, dtype=np.float64), axis, -1), axis=-1)   # NaN last
+    n = np.sum(~np.isnan(a), axis=-1)
+    out = np.full((len(q),) + n.shape, np.nan)
+    if a.shape[-1] == 0:
+        return out
+    for k, p in enumerate(q):
+        pos  = (n - 1) * (p / 100.0)
+        lo   = np.floor(pos).astype(np.int64).clip(0)
+        hi   = np.minimum(lo + 1, np.maximum(n - 1, 0))
+        frac = pos - lo
+        vlo  = np.take_along_axis(a, lo[..., None], axis=-1)[..., 0]
+        vhi  = np.take_along_axis(a, hi[..., None], axis=-1)[..., 0]
+        val  = vlo + (vhi - vlo) * frac
+        # numpy's lerp: exact at the upper end when frac >= 0.5
+        val  = np.where(frac >= 0.5, vhi - (vhi - vlo) * (1 - frac), val)
+        out[k] = np.where(n > 0, val, np.nan)
+    return out
+
+
+def load_series(stations, sources, variables, offset_hours=0, root=None):
+    '''
+    {(station, source, variable): hourly pandas Series in local time} read from the store;
+    variables is a list of names (stored or derived) or {name: [components]} for sums of them,
+    offset_hours hours, {station: hours} or 'site' (isa_reader.utc_offset)
+    '''
+    if not isinstance(variables, dict):
+        variables = {v: [v] for v in ([variables] if isinstance(variables, str) else variables)}
+    series = {}
+    for station in stations:
+        offset = isa_reader.utc_offset(station, offset_hours)
+        for source in sources:
+            stored = set(isa_cube.case_variables(station, source, root))
+            if not stored:
+                continue
+            comps  = {name: [c for c in cs if c in stored or isa_derived.available(c, stored)]
+                      for name, cs in variables.items()}
+            needed = sorted({c for cs in comps.values() for c in cs})
+            if not needed:
+                continue
+            frame = isa_cube.load(station, source, needed, root)
+            frame.index = frame.index + pd.Timedelta(hours=offset)
+            for name, cs in comps.items():
+                if not cs:
+                    continue
+                if len(cs) == 1:
+                    series[(station, source, name)] = frame[cs[0]]
+                else:
+                    series[(station, source, name)] = frame[cs].sum(axis=1, skipna=True, min_count=0)
+    return series
+
+
+def day_hour_cube(series):
+    '''
+    Stack hourly series on the union of their days: (keys, days, cube[series, day, hour])
+    '''
+    keys = list(series.keys())
+    if not keys:
+        return keys, pd.DatetimeIndex([]), np.empty((0, 0, 24), dtype=np.float32)
+    # only the days present in some series: the sites cover different years
+    days = pd.DatetimeIndex(np.unique(np.concatenate(
+        [s.index.floor('D').to_numpy() for s in series.values()])))
+    cube = np.full((len(keys), len(days), 24), np.nan, dtype=np.float32)
+    for i, key in enumerate(keys):
+        idx = series[key].index
+        iday  = days.get_indexer(idx.floor('D'))
+        ihour = idx.hour.to_numpy()
+        cube[i, iday, ihour] = series[key].to_numpy(dtype=np.float32)
+    return keys, days, cube
+
+
+def season_masks(days, seasons=None, period=None):
+    '''
+    {season: boolean mask of days}; seasons maps names to months (None: all days),
+    period = (start, end) restricts every season to the dates between start and end
+    '''
+    seasons = seasons if seasons is not None else {'all': None}
+    if isinstance(seasons, (list, tuple)):
+        seasons = {s: SEASONS[s] for s in seasons}
+    base = np.ones(len(days), dtype=bool)
+    if period is not None:
+        start, end = pd.Timestamp(period[0]), pd.Timestamp(period[1])
+        base &= (days >= start.floor('D')) & (days <= end.floor('D'))
+    masks = {}
+    for name, months in seasons.items():
+        mask = base.copy()
+        if months is not None:
+            mask &= np.isin(days.month, months)
+        masks[name] = mask
+    return masks
+
+
+@isa_cache.cached(1, inputs=lambda p: (p['root'], isa_cache.case_files(p['root'], p['stations'], p['sources'])))
+def diurnal_stats(stations, sources, variables, percentiles=(5, 95), seasons=None,
+                  period=None, offset_hours=0, root=None):
+    '''
+    Tidy table of the hour-of-day count, mean and percentiles of every series and season
+    '''
+    series = load_series(stations, sources, variables, offset_hours, root)
+    keys, days, cube = day_hour_cube(series)
+    pnames = [percentile_name(p) for p in percentiles]
+
+    tables = []
+    for season, mask in season_masks(days, seasons, period).items():
+        sub   = cube[:, mask, :]
+        count = np.sum(~np.isnan(sub), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(sub, axis=1, dtype=np.float64) / count
+        pct   = nanpercentile(sub, percentiles, axis=1)
+
+        nser = len(keys)
+        table = pd.DataFrame({
+            'station' : np.repeat([k[0] for k in keys], 24),
+            'source'  : np.repeat([k[1] for k in keys], 24),
+            'variable': np.repeat([k[2] for k in keys], 24),
+            'season'  : season,
+            'hour'    : np.tile(np.arange(24), nser),
+            'count'   : count.ravel(),
+            'mean'    : mean.ravel(),
+        })
+        for name, vals in zip(pnames, pct):
+            table[name] = vals.ravel()
+        tables.append(table)
+
+    if not tables:
+        return pd.DataFrame(columns=['station', 'source', 'variable', 'season', 'hour', 'count',
+                                     'mean'] + pnames)
+    return pd.concat(tables, ignore_index=True)
+
+
+def max_deviation(stats, reference='sitedata', column='mean'):
+    '''
+    For each station, variable and season: product and hour of the largest |stat - reference|
+    '''
+    ref = stats[stats['source'] == reference]
+    oth = stats[stats['source'] != reference]
+    if ref.empty or oth.empty:
+        return pd.DataFrame(columns=['station', 'variable', 'season', 'source', 'hour',
+                                     'value', 'reference', 'diff'])
+
+    # (group, source, hour) array of the differences, filled with NaN where a source is missing
+    wide = oth.pivot_table(index=['station', 'variable', 'season'], columns=['source', 'hour'],
+                           values=column, dropna=False)
+    refw = ref.pivot_table(index=['station', 'variable', 'season'], columns='hour',
+                           values=column, dropna=False).reindex(wide.index)
+    srcs = wide.columns.get_level_values(0).unique()
+    vals = wide.reindex(columns=pd.MultiIndex.from_product([srcs, range(24)])).to_numpy()
+    vals = vals.reshape(len(wide), len(srcs), 24)
+    refv = refw.reindex(columns=range(24)).to_numpy()[:, None, :]
+    diff = vals - refv
+
+    # hour-major order: on ties the earliest hour, then the first source wins
+    absd = np.where(np.isnan(diff), -np.inf, np.abs(diff)).transpose(0, 2, 1).reshape(len(wide), -1)
+    best = np.argmax(absd, axis=1)
+    valid = np.isfinite(absd[np.arange(len(wide)), best])
+    ihour, isrc = np.divmod(best, len(srcs))
+    rows = np.arange(len(wide))
+    out = wide.index.to_frame(index=False)
+    out['source']    = np.asarray(srcs)[isrc]
+    out['hour']      = ihour
+    out['value']     = vals[rows, isrc, ihour]
+    out['reference'] = refv[rows, 0, ihour]
+    out['diff']      = diff[rows, isrc, ihour]
+    return out[valid].reset_index(drop=True)
@@ -0,0 +1,119 @@
+'''
+Exceedance analysis of the ISA comparison runs for any list of thresholds
+
+prepare reads the series of a variable (runoff in mm/h by default, see isa_derived) of every
+station and source from the store once, keeps the common period of the sources of each
+station and sorts the valid values.  Everything else is a searchsorted on these sorted
+arrays, so changing or adding thresholds does not read the data again:
+
+    exceedances     values above a threshold (the KDE samples of the ridge plots)
+    counts          tidy table station, source, threshold, steps, count, frequency,
+                    mean_excess, max for a list of thresholds (threshold sensitivity)
+    return_levels   tidy table station, source, period, level: the value exceeded on
+                    average once every period years, from the empirical distribution
+                    (NaN for periods longer than the record)
+
+The sorted arrays are cached (isa_cache) until one of the store files changes.
+
+Oct 2026
+'''
+import numpy as np
+import pandas as pd
+
+import isa_cache
+import isa_diurnal
+
+
+YEAR_HOURS = 365.25 * 24
+
+
+
+@isa_cache.cached(1, inputs=lambda p: (p['root'], isa_cache.case_files(p['root'], p['stations'], p['sources'])))
+def prepare(stations, sources, variable='rnof_mmh', offset_hours=0, common_period=True, root=None):
+    '''
+    {station: {source: {'values': sorted valid values, 'years': length of the period}}} over
+    the common period of the sources of each station (stations without one are left out)
+    '''
+    series = isa_diurnal.load_series(stations, sources, [variable], offset_hours, root)
+    out = {}
+    for station in stations:
+        found = {src: series[(station, src, variable)] for src in sources
+                 if (station, src, variable) in series}
+        if not found:
+            continue
+        start = max(s.index.min() for s in found.values()) if common_period else None
+        end   = min(s.index.max() for s in found.values()) if common_period else None
+        if common_period and start >= end:
+            continue
+        entries = {}
+        for src, s in found.items():
+            s = s.loc[start:end]
+            vals = s.to_numpy(dtype=np.float64)
+            vals = np.sort(vals[np.isfinite(vals)])
+            span = (s.index.max() - s.index.min()) / pd.Timedelta(hours=1) + 1 if len(s) else 0
+            entries[src] = {'values': vals, 'years': span / YEAR_HOURS}
+        out[station] = entries
+    return out
+
+
+def exceedances(entry, threshold):
+    '''
+    Values of a prepared entry strictly above threshold (sorted)
+    '''
+    vals = entry['values']
+    return vals[np.searchsorted(vals, threshold, side='right'):]
+
+
+def counts(prepared, thresholds):
+    '''
+    Tidy table of the number, frequency, mean excess and maximum of the exceedances of
+    every station and source for every threshold
+    '''
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+    tables = []
+    for station, entries in prepared.items():
+        for src, entry in entries.items():
+            vals = entry['values']
+            n = len(vals)
+            k = n - np.searchsorted(vals, thresholds, side='right')
+            # sums of the k largest values for every k
+            top = np.concatenate([[0.0], np.cumsum(vals[::-1])])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                tables.append(pd.DataFrame({
+                    'station'    : station,
+                    'source'     : src,
+                    'threshold'  : thresholds,
+                    'steps'      : n,
+                    'count'      : k,
+                    'frequency'  : k / n if n else np.nan,
+                    'mean_excess': np.where(k > 0, top[k] / k - thresholds, np.nan),
+                    'max'        : vals[-1] if n else np.nan,
+                }))
+    if not tables:
+        return pd.DataFrame(columns=['station', 'source', 'threshold', 'steps', 'count',
+                                     'frequency', 'mean_excess', 'max'])
+    return pd.concat(tables, ignore_index=True)
+
+
+def return_levels(prepared, periods=(1, 2, 5, 10)):
+    '''
+    Tidy table of the empirical return levels of every station and source
+    '''
+    periods = np.atleast_1d(np.asarray(periods, dtype=np.float64))
+    tables = []
+    for station, entries in prepared.items():
+        for src, entry in entries.items():
+            vals, years = entry['values'], entry['years']
+            n = len(vals)
+            level = np.full(len(periods), np.nan)
+            if n > 1 and years > 0:
+                # non-exceedance probability of a value reached once per period
+                p = 1.0 - 1.0 / (periods * n / years)
+                # the record of a full calendar year counts as one year
+                ok = (periods <= max(np.round(years), years)) & (p >= 0)
+                level[ok] = np.interp(p[ok] * (n - 1), np.arange(n), vals)
+            tables.append(pd.DataFrame({'station': station, 'source': src,
+                                        'period': periods, 'level': level}))
+    if not tables:
+        return pd.DataFrame(columns=['station', 'source', 'period', 'level'])
+    return pd.concat(tables, ignore_index=True)
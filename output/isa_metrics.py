@@ -0,0 +1,317 @@
+'''
+Evaluation metrics of the ISA products against the SiteData baseline
+
+For every station the reference case (sitedata) and the product cases (GAIA, GISA, GISD, WSF)
+of the store (isa_cube) are aligned on their common time steps and streamed in blocks of CHUNK
+steps: each block of data(variable, time) is read once for all variables, and running
+accumulators are updated for every (product, variable) pair
+
+    count, means and co-moments         merged block by block (Chan et al.), so the bias,
+                                        correlation and totals come out of one pass
+    sum |x - y|, sum (x - y)^2          MAE and RMSE
+    tails of x and y                    the largest (smallest) values needed for the upper
+                                        (lower) percentiles, kept with np.partition; the
+                                        percentiles are exact (same as np.nanpercentile)
+
+Only the steps where both the product and the reference are valid count.  The result is one
+tidy table, one row per (station, source, variable)
+
+    station, source, variable, reference, count, mean, ref_mean, bias, mae, rmse, corr,
+    rel_total_error, p01_diff, p05_diff, p95_diff, p99_diff
+
+with bias = mean - ref_mean, rel_total_error = 100 (sum x - sum y) / sum y (%), and
+pXX_diff the difference of the XX-th percentiles.  Stations run in parallel over a fork pool
+and the table of every station is cached (isa_cache) until one of its store files changes.
+
+Usage:
+    python isa_metrics.py [OUTPUT_DIR] [--vars f_rnof f_assim ...] [--nprocs N] [--out FILE]
+
+Oct 2026
+'''
+import argparse
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+import isa_cache
+import isa_cube
+import isa_diurnal
+
+
+METRICS_FILE = 'isa_metrics.csv'
+PERCENTILES  = (1, 5, 95, 99)
+CHUNK        = isa_cube.CHUNK
+
+
+
+def tail_size(n, percentiles):
+    '''
+    Values to keep in the lower and upper tails of n values for the given percentiles
+    '''
+    lower = [int(np.floor((n - 1) * p / 100.0)) + 2 for p in percentiles if p < 50]
+    upper = [int(np.floor((n - 1) * (1 - p / 100.0))) + 2 for p in percentiles if p >= 50]
+    return min(n, max(lower, default=0)), min(n, max(upper, default=0))
+
+
+def keep_tail(tail, block, k, largest):
+    '''
+    The k largest (or smallest) values of every row of tail and block; missing values
+    are stored as -inf (+inf) so that they never enter a tail
+    '''
+    if k == 0:
+        return tail
+    both = np.concatenate([tail, block], axis=1)
+    if both.shape[1] <= k:
+        return both
+    if largest:
+        return -np.partition(-both, k - 1, axis=1)[:, :k]
+    return np.partition(both, k - 1, axis=1)[:, :k]
+
+
+def tail_percentile(tail, n, p, largest):
+    '''
+    p-th percentile of n values (linear method) from the kept tail of one variable
+    '''
+    if n == 0:
+        return np.nan
+    vals = np.sort(tail[np.isfinite(tail)])
+    pos  = (n - 1) * (p / 100.0)
+    lo   = int(np.floor(pos))
+    hi   = min(lo + 1, n - 1)
+    frac = pos - lo
+    # index in the sorted tail: the upper tail holds the last values of the full sort
+    first = n - len(vals) if largest else 0
+    vlo, vhi = vals[lo - first], vals[hi - first]
+    # numpy's lerp, as in isa_diurnal.nanpercentile
+    return vhi - (vhi - vlo) * (1 - frac) if frac >= 0.5 else vlo + (vhi - vlo) * frac
+
+
+class Accumulator:
+    '''
+    Running statistics of one product against the reference for a set of variables
+    '''
+
+    def __init__(self, nvar, nsteps, percentiles):
+        self.n   = np.zeros(nvar)
+        self.mx  = np.zeros(nvar)
+        self.my  = np.zeros(nvar)
+        self.sxx = np.zeros(nvar)
+        self.syy = np.zeros(nvar)
+        self.sxy = np.zeros(nvar)
+        self.sad = np.zeros(nvar)
+        self.ssd = np.zeros(nvar)
+        self.percentiles = percentiles
+        self.klow, self.kup = tail_size(nsteps, percentiles)
+        self.tails = {key: np.empty((nvar, 0)) for key in ('xlow', 'xup', 'ylow', 'yup')}
+
+    def update(self, x, y):
+        valid = ~(np.isnan(x) | np.isnan(y))
+        nb = valid.sum(axis=1).astype(np.float64)
+        if not nb.any():
+            return
+        x0 = np.where(valid, x, 0.0)
+        y0 = np.where(valid, y, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bx = np.where(nb > 0, x0.sum(axis=1) / nb, 0.0)
+            by = np.where(nb > 0, y0.sum(axis=1) / nb, 0.0)
+        dx = np.where(valid, x - bx[:, None], 0.0)
+        dy = np.where(valid, y - by[:, None], 0.0)
+
+        # merge the block moments into the running ones
+        n  = self.n + nb
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(n > 0, self.n * nb / n, 0.0)
+            ex, ey = bx - self.mx, by - self.my
+            self.sxx += (dx * dx).sum(axis=1) + ex * ex * w
+            self.syy += (dy * dy).sum(axis=1) + ey * ey * w
+            self.sxy += (dx * dy).sum(axis=1) + ex * ey * w
+            self.mx  += np.where(n > 0, ex * nb / n, 0.0)
+            self.my  += np.where(n > 0, ey * nb / n, 0.0)
+        self.n = n
+        d = x0 - y0
+        self.sad += np.abs(d).sum(axis=1)
+        self.ssd += (d * d).sum(axis=1)
+
+        t = self.tails
+        t['xlow'] = keep_tail(t['xlow'], np.where(valid, x, np.inf), self.klow, False)
+        t['ylow'] = keep_tail(t['ylow'], np.where(valid, y, np.inf), self.klow, False)
+        t['xup']  = keep_tail(t['xup'], np.where(valid, x, -np.inf), self.kup, True)
+        t['yup']  = keep_tail(t['yup'], np.where(valid, y, -np.inf), self.kup, True)
+
+    def result(self):
+        n = self.n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = {
+                'count'   : n.astype(np.int64),
+                'mean'    : np.where(n > 0, self.mx, np.nan),
+                'ref_mean': np.where(n > 0, self.my, np.nan),
+                'bias'    : np.where(n > 0, self.mx - self.my, np.nan),
+                'mae'     : np.where(n > 0, self.sad / n, np.nan),
+                'rmse'    : np.where(n > 0, np.sqrt(self.ssd / n), np.nan),
+                'corr'    : self.sxy / np.sqrt(self.sxx * self.syy),
+                'rel_total_error': np.where(n > 0, 100.0 * (self.mx - self.my) / self.my, np.nan),
+            }
+        for p in self.percentiles:
+            side = 'up' if p >= 50 else 'low'
+            diff = [tail_percentile(self.tails['x' + side][i], int(n[i]), p, side == 'up') -
+                    tail_percentile(self.tails['y' + side][i], int(n[i]), p, side == 'up')
+                    for i in range(len(n))]
+            out[f'{isa_diurnal.percentile_name(p)}_diff'] = np.asarray(diff, dtype=np.float64)
+        return out
+
+
+def read_block(dvar, rows, start, stop):
+    '''
+    Rows of data(variable, time) between two time steps as float64, in the order of rows
+    '''
+    if rows is None:
+        return np.asarray(dvar[:, start:stop], dtype=np.float64)
+    order = np.argsort(rows)
+    block = np.asarray(dvar[np.asarray(rows)[order], start:stop], dtype=np.float64)
+    return block[np.argsort(order)]
+
+
+def station_inputs(params):
+    root, station, sources, reference = params['task'][:4]
+    return root, [isa_cube.cube_path(root, station, src) for src in [reference] + list(sources)]
+
+
+@isa_cache.cached(1, inputs=station_inputs)
+def station_metrics(task):
+    '''
+    Tidy metrics table of the products of one station against the reference, station and
+    number of aligned steps
+    '''
+    root, station, sources, reference, variables, percentiles, period, chunk = task
+    import netCDF4 as nc
+    ref_path = isa_cube.cube_path(root, station, reference)
+    if not os.path.exists(ref_path):
+        return None, station, 0
+
+    ref = nc.Dataset(ref_path)
+    products = {}
+    try:
+        ref_names = ref.variables_list.split()
+        ref_time  = np.asarray(ref.variables['time'][:], dtype=np.int64)
+        keep = np.ones(len(ref_time), dtype=bool)
+        if period is not None:
+            lo, hi = (int((pd.Timestamp(t) - pd.Timestamp('1900-01-01')) / pd.Timedelta(minutes=1))
+                      for t in period)
+            keep &= (ref_time >= lo) & (ref_time <= hi)
+
+        for source in sources:
+            path = isa_cube.cube_path(root, station, source)
+            if source == reference or not os.path.exists(path):
+                continue
+            ds = nc.Dataset(path)
+            names = ds.variables_list.split()
+            common = [v for v in (variables or ref_names) if v in names and v in ref_names]
+            ptime = np.asarray(ds.variables['time'][:], dtype=np.int64)
+            if not common or not len(ptime):
+                ds.close()
+                continue
+            # position of every reference step in the product, -1 where it has no such step
+            pos = np.searchsorted(ptime, ref_time).clip(0, len(ptime) - 1)
+            pos = np.where(keep & (ptime[pos] == ref_time), pos, -1)
+            if not (pos >= 0).any():
+                ds.close()
+                continue
+            products[source] = {
+                'ds': ds, 'names': common, 'pos': pos,
+                'rows': [names.index(v) for v in common],
+                'ref_rows': [ref_names.index(v) for v in common],
+                'acc': Accumulator(len(common), int((pos >= 0).sum()), percentiles),
+            }
+        if not products:
+            return None, station, 0
+
+        # reference rows needed by any product, read once per block
+        needed = sorted({r for p in products.values() for r in p['ref_rows']})
+        where  = {r: i for i, r in enumerate(needed)}
+        aligned = np.flatnonzero(np.any([p['pos'] >= 0 for p in products.values()], axis=0))
+        rvar = ref.variables['data']
+        for b0 in range(0, len(aligned), chunk):
+            steps = aligned[b0:b0 + chunk]
+            start, stop = steps[0], steps[-1] + 1
+            rblock = read_block(rvar, needed, start, stop)
+            for p in products.values():
+                ppos = p['pos'][start:stop]
+                sel  = ppos >= 0
+                if not sel.any():
+                    continue
+                pstart, pstop = ppos[sel].min(), ppos[sel].max() + 1
+                pblock = read_block(p['ds'].variables['data'], p['rows'], pstart, pstop)
+                x = pblock[:, ppos[sel] - pstart]
+                y = rblock[[where[r] for r in p['ref_rows']]][:, sel]
+                p['acc'].update(x, y)
+    finally:
+        ref.close()
+        for p in products.values():
+            p['ds'].close()
+
+    tables = []
+    for source, p in products.items():
+        table = pd.DataFrame({'station': station, 'source': source, 'variable': p['names'],
+                              'reference': reference})
+        for name, vals in p['acc'].result().items():
+            table[name] = vals
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True), station, len(aligned)
+
+
+def metrics(variables=None, stations=None, sources=None, reference='sitedata',
+            percentiles=PERCENTILES, period=None, chunk=CHUNK, nprocs=4, root=None,
+            verbose=False):
+    '''
+    Metrics of every product of the store against the reference, as one DataFrame;
+    variables=None takes all the variables a product shares with its reference
+    '''
+    root = root or isa_cube.default_root()
+    if isinstance(variables, str):
+        variables = [variables]
+    percentiles = tuple(percentiles)
+    cases = isa_cube.cases(root)
+    if stations is None:
+        stations = sorted({st for st, _ in cases})
+    if sources is None:
+        sources = sorted({src for _, src in cases if src != reference})
+
+    tasks = [(root, st, list(sources), reference, variables, percentiles, period, chunk)
+             for st in stations]
+    if nprocs > 1 and len(tasks) > 1:
+        with multiprocessing.get_context('fork').Pool(min(nprocs, len(tasks))) as pool:
+            results = pool.map(station_metrics, tasks)
+    else:
+        results = [station_metrics(t) for t in tasks]
+
+    parts = []
+    for table, station, nsteps in results:
+        if verbose:
+            print(f'  {station}: {nsteps} steps')
+        if table is not None:
+            parts.append(table)
+    if not parts:
+        return pd.DataFrame(columns=['station', 'source', 'variable', 'reference', 'count',
+                                     'mean', 'ref_mean', 'bias', 'mae', 'rmse', 'corr',
+                                     'rel_total_error'] +
+                                    [f'{isa_diurnal.percentile_name(p)}_diff' for p in percentiles])
+    return pd.concat(parts, ignore_index=True)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='metrics of the ISA products against SiteData')
+    parser.add_argument('root', nargs='?', default=None, help='output directory (default: this directory)')
+    parser.add_argument('--vars', nargs='+', default=None, help='variables (default: all)')
+    parser.add_argument('--reference', default='sitedata')
+    parser.add_argument('--nprocs', type=int, default=4)
+    parser.add_argument('--out', default=None, help=f'metrics table (default: OUTPUT_DIR/{METRICS_FILE})')
+    args = parser.parse_args()
+
+    root = args.root or isa_cube.default_root()
+    isa_cube.extract(root, nprocs=args.nprocs, verbose=True)
+    table = metrics(args.vars, reference=args.reference, nprocs=args.nprocs, root=root, verbose=True)
+    out = args.out or os.path.join(root, METRICS_FILE)
+    table.to_csv(out, index=False)
+    print(f'{len(table)} rows written to {out}')
@@ -0,0 +1,310 @@
+'''
+Lazy reader of the history files of one case across years
+
+open_case(case_dir) indexes the history files of a case (case_dir/history/*.nc, one per year
+with DEF_HIST_groupby = 'YEAR') once: only their time axes and variable headers are read, and
+the time steps of all years are laid end to end in one sorted index (steps repeated by
+overlapping files: the first file wins, as in isa_cube).  The variables are then exposed
+without reading them
+
+    case = isa_reader.open_case('output/AU-Preston_GAIA_hourly', offset_hours='site')
+    case['f_rnof']['2004-06-01':'2004-08-31']           # Series at patch 0
+    case['f_rnof'].sel('2004-06', '2004-08', patch=None)  # DataFrame, one column per patch
+    case.read(['f_fsena', 'f_lfevpa'], '2004-01-01', '2004-12-31')
+
+and a read opens only the files holding the requested steps and reads only these steps of
+the requested variables (one slice per file).  A time label is found in O(1) on the regular
+hourly axis (position = (t - t0) / step; a binary search if the axis has gaps), so a
+slice costs the same on a 1 or 20 year case.  At the read layer
+
+    patch       the patch dimension is selected (patch=0 by default, None for all)
+    fills       -1e36 (missing_value / _FillValue) become NaN
+    time        decoded to pandas Timestamps, in UTC (offset_hours=0) or shifted by a fixed
+                offset, a {station: hours} table or 'site': UTC_OFFSETS (standard time of the
+                station, the case directory being {station}_{source}[_{freq}])
+
+The index of a case is kept per process until one of its files changes.
+
+Oct 2026
+'''
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+import isa_catalog
+import isa_cube
+
+
+# standard time (hours from UTC) of the ISA comparison stations
+UTC_OFFSETS = {
+    'AU-Preston'     : 10,
+    'AU-SurreyHills' : 10,
+    'CA-Sunset'      : -8,
+    'FR-Capitole'    : 1,
+    'GR-HECKOR'      : 2,
+    'KR-Jungnang'    : 9,
+    'KR-Ochang'      : 9,
+    'MX-Escandon'    : -6,
+    'NL-Amsterdam'   : 1,
+    'PL-Lipowa'      : 1,
+    'PL-Narutowicza' : 1,
+    'SG-TelokKurau06': 8,
+    'UK-KingsCollege': 0,
+    'UK-Swindon'     : 0,
+    'US-Baltimore'   : -5,
+    'US-WestPhoenix' : -7,
+}
+EPOCH = pd.Timestamp('1900-01-01')
+
+_indexes = {}
+
+
+
+def case_meta(case_dir):
+    '''
+    station and source of a case directory, None if it is not named {station}_{source}[_{freq}]
+    '''
+    m = isa_catalog.RE_CASE.match(os.path.basename(os.path.normpath(case_dir)))
+    return (m.group('station'), m.group('source')) if m else (None, None)
+
+
+def utc_offset(station, offset_hours=0):
+    '''
+    Hours added to UTC for a station: a number, a {station: hours} table or 'site' (UTC_OFFSETS)
+    '''
+    if offset_hours == 'site':
+        offset_hours = UTC_OFFSETS
+    if isinstance(offset_hours, dict):
+        if station not in offset_hours:
+            raise KeyError(f'no UTC offset for station {station}')
+        return offset_hours[station]
+    return offset_hours or 0
+
+
+def history_files(case_dir, subdir='history'):
+    '''
+    History files of a case, sorted; only the ones named after the case directory if there
+    are (the sitedata cases also hold an older {station}_hourly_hist_* copy)
+    '''
+    files = sorted(glob.glob(os.path.join(case_dir, subdir, '*.nc')))
+    case = os.path.basename(os.path.normpath(case_dir))
+    canonical = [f for f in files if os.path.basename(f).startswith(case + '_hist_')]
+    return canonical or files
+
+
+def read_header(path):
+    '''
+    Time (minutes since 1900) and {variable: (dimensions, shape, fill, units, long_name)}
+    of the time-varying variables of a history file
+    '''
+    import netCDF4 as nc
+    with nc.Dataset(path) as ds:
+        ds.set_auto_mask(False)
+        tvar = ds.variables['time']
+        cal  = getattr(tvar, 'calendar', 'standard')
+        dates   = nc.num2date(tvar[:], tvar.units, cal)
+        minutes = np.asarray(np.round(nc.date2num(dates, isa_cube.TIME_UNITS, cal)), dtype=np.int64)
+        header = {}
+        for name, var in ds.variables.items():
+            if name == 'time' or not var.dimensions or var.dimensions[0] != 'time':
+                continue
+            fill = getattr(var, 'missing_value', getattr(var, '_FillValue', isa_cube.FILL))
+            header[name] = (var.dimensions, var.shape[1:], float(np.asarray(fill).ravel()[0]),
+                            getattr(var, 'units', ''), getattr(var, 'long_name', ''))
+    return minutes, header
+
+
+def build_index(files):
+    '''
+    minutes, file number and step in the file of every time step of the files, sorted and
+    without repeated steps; {variable: header} over the files
+    '''
+    parts, headers = [], {}
+    for k, path in enumerate(files):
+        minutes, header = read_header(path)
+        parts.append((minutes, np.full(len(minutes), k, dtype=np.int32),
+                      np.arange(len(minutes), dtype=np.int64)))
+        for name, h in header.items():
+            headers.setdefault(name, h)
+    if not parts:
+        return np.empty(0, np.int64), np.empty(0, np.int32), np.empty(0, np.int64), headers
+    minutes = np.concatenate([p[0] for p in parts])
+    order   = np.argsort(minutes, kind='stable')
+    keep    = np.ones(len(order), dtype=bool)
+    keep[1:] = np.diff(minutes[order]) != 0       # overlapping restarts: first value wins
+    order   = order[keep]
+    return (minutes[order], np.concatenate([p[1] for p in parts])[order],
+            np.concatenate([p[2] for p in parts])[order], headers)
+
+
+class Variable:
+    '''
+    Lazy view of one variable of a case: nothing is read before a time selection
+    '''
+
+    def __init__(self, case, name):
+        self.case = case
+        self.name = name
+        self.dimensions, self.shape, self.fill, self.units, self.long_name = case.headers[name]
+
+    def __repr__(self):
+        return (f'<{self.name} {self.dimensions} x {len(self.case.minutes)} steps '
+                f'[{self.units}] {self.long_name}>')
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('select times with a slice, e.g. case[name]["2004-06":"2004-08"]')
+        if all(isinstance(k, (int, np.integer)) or k is None for k in (key.start, key.stop)):
+            return self.isel(key.start or 0, len(self.case.minutes) if key.stop is None else key.stop)
+        return self.sel(key.start, key.stop)
+
+    def sel(self, start=None, end=None, patch=0):
+        '''
+        Values between two times (local labels, both included)
+        '''
+        i0, i1 = self.case.locate(start, end)
+        return self.isel(i0, i1, patch)
+
+    def isel(self, i0, i1, patch=0):
+        '''
+        Values of the steps i0 to i1 (excluded): a Series for one patch of a (time, patch)
+        variable, a DataFrame for all patches, an array (time, ...) for other dimensions
+        '''
+        values = self.case.read_steps(self.name, i0, i1, patch)
+        index = self.case.time[i0:i1]
+        if values.ndim == 1:
+            return pd.Series(values, index=index, name=self.name)
+        if values.ndim == 2:
+            return pd.DataFrame(values, index=index)
+        return values
+
+
+class Case:
+    '''
+    Index of the history files of one case (see open_case)
+    '''
+
+    def __init__(self, case_dir, offset_hours=0, subdir='history', dtype=np.float32):
+        self.case_dir = os.path.abspath(case_dir)
+        self.station, self.source = case_meta(case_dir)
+        self.files = history_files(self.case_dir, subdir)
+        ident = tuple((f, os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in self.files)
+        if _indexes.get(self.case_dir, (None,))[0] != ident:
+            _indexes[self.case_dir] = (ident, build_index(self.files))
+        self.minutes, self.file_of, self.step_of, self.headers = _indexes[self.case_dir][1]
+        self.offset = utc_offset(self.station, offset_hours)
+        self.dtype = dtype
+        self.time = pd.DatetimeIndex(EPOCH + pd.to_timedelta(self.minutes + int(round(self.offset * 60)),
+                                                             unit='m'), name='time')
+        steps = np.diff(self.minutes)
+        self.step = int(steps[0]) if len(steps) and (steps == steps[0]).all() else None
+        self._handles = {}
+
+    def __repr__(self):
+        span = f'{self.time[0]} to {self.time[-1]}' if len(self.time) else 'empty'
+        return (f'<Case {os.path.basename(self.case_dir)}: {len(self.files)} files, '
+                f'{len(self.minutes)} steps ({span}, UTC{self.offset:+g}), {len(self.headers)} variables>')
+
+    def __contains__(self, name):
+        return name in self.headers
+
+    def __getitem__(self, name):
+        if name not in self.headers:
+            raise KeyError(f'{name} not in the history of {os.path.basename(self.case_dir)}')
+        return Variable(self, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def variables(self):
+        return list(self.headers)
+
+    def close(self):
+        for ds in self._handles.values():
+            ds.close()
+        self._handles = {}
+
+    def dataset(self, k):
+        import netCDF4 as nc
+        if k not in self._handles:
+            ds = nc.Dataset(self.files[k])
+            ds.set_auto_mask(False)
+            self._handles[k] = ds
+        return self._handles[k]
+
+    def position(self, minutes, side):
+        '''
+        First step at or after (side 'left') / after (side 'right') a time in minutes since 1900 (UTC)
+        '''
+        n = len(self.minutes)
+        if n == 0 or self.step is None:
+            return int(np.searchsorted(self.minutes, minutes, side=side))
+        q, r = divmod(int(minutes) - int(self.minutes[0]), self.step)
+        return min(max(q + (1 if r or side == 'right' else 0), 0), n)
+
+    def locate(self, start=None, end=None):
+        '''
+        Steps (i0, i1) between two local times, both included; a partial date ('2004-06')
+        stands for its whole period
+        '''
+        offset = int(round(self.offset * 60))
+        i0, i1 = 0, len(self.minutes)
+        if start is not None:
+            t = pd.Timestamp(start)
+            i0 = self.position((t - EPOCH) // pd.Timedelta(minutes=1) - offset, 'left')
+        if end is not None:
+            period = pd.Period(end) if isinstance(end, str) else None
+            t = period.end_time if period is not None else pd.Timestamp(end)
+            i1 = self.position((t - EPOCH) // pd.Timedelta(minutes=1) - offset, 'right')
+        return i0, max(i0, i1)
+
+    def read_steps(self, name, i0, i1, patch=0):
+        '''
+        Values of a variable for the steps i0 to i1 (excluded), time first, NaN for the fills
+        and for the files without the variable
+        '''
+        dims, shape, fill, _, _ = self.headers[name]
+        if patch is not None and 'patch' in dims:
+            shape = tuple(s for d, s in zip(dims[1:], shape) if d != 'patch')
+        out = np.full((max(i1 - i0, 0),) + tuple(shape), np.nan, dtype=self.dtype)
+        if i1 <= i0:
+            return out
+        files = self.file_of[i0:i1]
+        steps = self.step_of[i0:i1]
+        bounds = np.flatnonzero(np.diff(files)) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(files)]):
+            ds = self.dataset(int(files[lo]))
+            if name not in ds.variables:
+                continue
+            var = ds.variables[name]
+            first, last = int(steps[lo]), int(steps[hi - 1])
+            key = [slice(first, last + 1)] + [patch if d == 'patch' and patch is not None else slice(None)
+                                              for d in var.dimensions[1:]]
+            block = np.asarray(var[tuple(key)], dtype=np.float64)
+            block = block[steps[lo:hi] - first]
+            block[(block == fill) | (np.abs(block) >= 1.e30)] = np.nan
+            out[lo:hi] = block
+        return out
+
+    def read(self, variables, start=None, end=None, patch=0):
+        '''
+        DataFrame of (time, patch) variables at one patch between two local times
+        '''
+        variables = [variables] if isinstance(variables, str) else list(variables)
+        i0, i1 = self.locate(start, end)
+        frame = pd.DataFrame({v: self.read_steps(v, i0, i1, patch) for v in variables},
+                             index=self.time[i0:i1])
+        return frame
+
+
+def open_case(case_dir, offset_hours=0, subdir='history', dtype=np.float32):
+    '''
+    Lazy reader of the history files of a case directory (see the module documentation);
+    subdir 'history_rechunked' reads the files converted by postprocess/hist_rechunk.py
+    '''
+    return Case(case_dir, offset_hours, subdir, dtype)
@@ -0,0 +1,157 @@
+'''
+Monthly / annual reductions of the ISA comparison runs
+
+reduce fans the (station, source) cases of the store (isa_cube) out over a fork pool.  Each
+worker reads only the rows of the requested variables from data(variable, time), and computes
+every reduction with index arithmetic on the time axis: the time steps are numbered by
+calendar month (or year) and one np.add.reduceat over the sorted bins gives the sums and
+valid counts of all variables at once, without building pandas resamplers.  The derived
+variables of isa_derived (fsen, rnof_mmh, rnet, ...) are computed from their stored components
+as in isa_cube.load; a case without a variable (or its components) is left out for that
+variable, and a variable found in no case raises KeyError.
+
+Reductions:
+    monthly_sum, monthly_mean       one row per (year, month)
+    annual_sum,  annual_mean        one row per year (month = 0)
+
+The reductions of every case are cached (isa_cache) until its store file changes.
+
+Missing values are skipped; a bin without any valid value sums to 0 and has a NaN mean (as
+pandas / xarray sum and mean with skipna).  scale multiplies the values before reducing, e.g.
+{'f_assim': 3600.0} turns a flux per second into the amount of an hourly step.
+
+The result is one tidy DataFrame
+
+    station, source, variable, reduction, year, month, value, count
+
+Oct 2026
+'''
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+import isa_cache
+import isa_cube
+import isa_derived
+
+
+REDUCTIONS = ('monthly_sum', 'monthly_mean', 'annual_sum', 'annual_mean')
+EPOCH = np.datetime64('1900-01-01T00:00', 'm')
+
+
+
+def time_bins(minutes, offset_hours=0):
+    '''
+    Year and month (1-12) of every step given in minutes since 1900-01-01
+    '''
+    t = EPOCH + (np.asarray(minutes, dtype=np.int64) + int(offset_hours * 60)).astype('timedelta64[m]')
+    months = t.astype('datetime64[M]').astype(np.int64)           # months since 1970-01
+    return months // 12 + 1970, months % 12 + 1
+
+
+def reduce_sorted(values, keys):
+    '''
+    Sums and valid counts of values (variables, time) over runs of equal, sorted keys
+    '''
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    valid  = ~np.isnan(values)
+    sums   = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=1)
+    counts = np.add.reduceat(valid.astype(np.int64), starts, axis=1)
+    return keys[starts], sums, counts
+
+
+@isa_cache.cached(2, inputs=lambda p: (p['task'][0], [isa_cube.cube_path(*p['task'][:3])]))
+def reduce_case(task):
+    '''
+    Tidy table of the reductions of one (station, source) case
+    '''
+    root, station, source, variables, reductions, scale, offset_hours = task
+    stored = isa_cube.case_variables(station, source, root)
+    names  = [v for v in variables if v in stored or isa_derived.available(v, stored)]
+    if not names:
+        return None
+    import netCDF4 as nc
+    path = isa_cube.cube_path(root, station, source)
+    st   = os.stat(path)
+    with nc.Dataset(path) as ds:
+        minutes = ds.variables['time'][:]
+        dvar    = ds.variables['data']
+
+        def read(components):
+            rows  = [stored.index(c) for c in components]
+            order = np.argsort(rows)
+            block = np.asarray(dvar[np.asarray(rows)[order], :], dtype=np.float32)
+            return block[np.argsort(order)]                   # back to the order of components
+
+        key    = (path, st.st_size, st.st_mtime_ns)
+        direct = [v for v in names if v in stored]
+        block  = read(direct) if direct else None
+        values = np.empty((len(names), len(minutes)), dtype=np.float64)
+        for i, v in enumerate(names):
+            values[i] = block[direct.index(v)] if v in stored else isa_derived.evaluate(v, stored, read, key)
+    for i, v in enumerate(names):
+        values[i] *= scale.get(v, 1.0) if isinstance(scale, dict) else scale
+
+    order = np.argsort(minutes, kind='stable')
+    years, months = time_bins(minutes[order], offset_hours)
+    values = values[:, order]
+
+    tables = []
+    for period in ('monthly', 'annual'):
+        wanted = [r for r in reductions if r.startswith(period)]
+        if not wanted:
+            continue
+        keys = years * 12 + months - 1 if period == 'monthly' else years
+        bins, sums, counts = reduce_sorted(values, keys)
+        byear  = bins // 12 if period == 'monthly' else bins
+        bmonth = bins % 12 + 1 if period == 'monthly' else np.zeros_like(bins)
+        for red in wanted:
+            if red.endswith('_sum'):
+                vals = sums
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    vals = sums / counts
+            tables.append(pd.DataFrame({
+                'station'  : station,
+                'source'   : source,
+                'variable' : np.repeat(names, len(bins)),
+                'reduction': red,
+                'year'     : np.tile(byear, len(names)),
+                'month'    : np.tile(bmonth, len(names)),
+                'value'    : vals.ravel(),
+                'count'    : counts.ravel(),
+            }))
+    return pd.concat(tables, ignore_index=True) if tables else None
+
+
+def reduce(variables, reductions=('monthly_sum',), stations=None, sources=None, scale=1.0,
+           offset_hours=0, nprocs=4, root=None):
+    '''
+    Reductions of the variables of every selected case of the store, as one DataFrame
+    '''
+    root = root or isa_cube.default_root()
+    variables = [variables] if isinstance(variables, str) else list(variables)
+    reductions = [reductions] if isinstance(reductions, str) else list(reductions)
+    bad = [r for r in reductions if r not in REDUCTIONS]
+    if bad:
+        raise ValueError(f'unknown reductions {bad}, expected some of {REDUCTIONS}')
+
+    tasks = [(root, st, src, variables, reductions, scale, offset_hours)
+             for st, src in isa_cube.cases(root)
+             if (stations is None or st in stations) and (sources is None or src in sources)]
+    if nprocs > 1 and len(tasks) > 1:
+        with multiprocessing.get_context('fork').Pool(min(nprocs, len(tasks))) as pool:
+            parts = pool.map(reduce_case, tasks)
+    else:
+        parts = [reduce_case(t) for t in tasks]
+
+    parts = [p for p in parts if p is not None]
+    found = set().union(*(p['variable'].unique() for p in parts))
+    missing = [v for v in variables if v not in found]
+    if tasks and missing:
+        raise KeyError(f'{", ".join(missing)} neither stored nor derived in any selected case')
+    if not parts:
+        return pd.DataFrame(columns=['station', 'source', 'variable', 'reduction', 'year',
+                                     'month', 'value', 'count'])
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,126 @@
+'''
+Parallel rendering of the per-station figures of the ISA comparison
+
+The plotting scripts first reduce the store (isa_cube) to small per-figure statistics, then
+hand a list of figure jobs to render.  Each job is a plain dict (station, variable, products
+and the arrays to draw) and is drawn by a module-level function draw(job) -> path in a fork
+pool of workers that
+
+    - select the Agg backend before pyplot is imported and apply the script's rcParams once,
+    - get a memory budget (RLIMIT_AS set to what the worker maps after the fork plus the
+      budget), so one runaway figure fails with a MemoryError instead of exhausting the node,
+    - close all figures and collect garbage after every job.
+
+The number of workers follows the cores and the memory available for the budget.  Failed
+jobs are reported and do not stop the others.
+
+Oct 2026
+'''
+import gc
+import multiprocessing
+import os
+import time
+import traceback
+
+
+_draw = None
+
+
+
+def available_memory_mb():
+    # MemAvailable counts the reclaimable page cache, the free pages alone do not
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def virtual_memory():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def worker_count(njobs, nprocs=None, memory_mb=None):
+    '''
+    Workers for njobs: the cores (or nprocs), bounded by the memory budget
+    '''
+    n = nprocs or os.cpu_count() or 1
+    avail = available_memory_mb()
+    if memory_mb and avail:
+        n = min(n, max(1, int(avail // memory_mb)))
+    return max(1, min(n, njobs))
+
+
+def init_worker(draw, style, memory_mb):
+    global _draw
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    if style:
+        plt.rcParams.update(style)
+    if memory_mb:
+        # budget on top of what the forked worker already maps (libraries, BLAS arenas)
+        import resource
+        limit = virtual_memory() + int(memory_mb * 2 ** 20)
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    _draw = draw
+
+
+def run_job(job):
+    import matplotlib.pyplot as plt
+    t0 = time.time()
+    try:
+        path = _draw(job)
+        err  = None
+    except MemoryError:
+        path, err = None, 'memory budget exceeded'
+    except Exception:
+        path, err = None, traceback.format_exc(limit=3)
+    finally:
+        plt.close('all')
+        gc.collect()
+    return job.get('station'), job.get('variable'), path, err, time.time() - t0
+
+
+def render(jobs, draw, style=None, nprocs=None, memory_mb=None, verbose=True):
+    '''
+    Draw every job with draw(job) -> path; returns the list of paths written
+    '''
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    nwork = worker_count(len(jobs), nprocs, memory_mb)
+    t0 = time.time()
+    if nwork == 1:
+        init_worker(draw, style, None)
+        results = [run_job(job) for job in jobs]
+    else:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(nwork, initializer=init_worker, initargs=(draw, style, memory_mb)) as pool:
+            results = list(pool.imap_unordered(run_job, jobs))
+
+    paths = []
+    for station, variable, path, err, sec in results:
+        label = ' '.join(str(x) for x in (station, variable) if x is not None)
+        if err is not None:
+            print(f'  ✗ {label}: {err}')
+            continue
+        paths.append(path)
+        if verbose:
+            print(f'  {label}: {os.path.basename(path)} ({sec:.1f} s)')
+    if verbose:
+        print(f'{len(paths)}/{len(jobs)} figures in {time.time() - t0:.1f} s with {nwork} workers')
+    return paths
@@ -1,11 +1,17 @@
-import xarray as xr
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from matplotlib.ticker import ScalarFormatter
 import numpy as np
 import os
 
-# === 绘图风格 ===
-plt.rcParams.update({
+import isa_cube
+import isa_diurnal
+import isa_reader
+import isa_render
+
+# === 绘图风格（绘图进程中同样使用） ===
+style = {
     'font.family': 'DejaVu Sans',
     'font.size': 13,
     'axes.labelsize': 16,
@@ -20,24 +26,28 @@ plt.rcParams.update({
     'axes.facecolor': 'white',
     'figure.facecolor': 'white',
     'legend.frameon': False,
-})
+}
+plt.rcParams.update(style)
 
-# === 文件路径 ===
-file_gaia = "/stu02/yuxr24/CoLM202X_ISA/output/NL-Amsterdam_GAIA_hourly/history/NL-Amsterdam_GAIA_hourly_hist_2019.nc"
-file_gisa = "/stu02/yuxr24/CoLM202X_ISA/output/NL-Amsterdam_GISA_hourly/history/NL-Amsterdam_GISA_hourly_hist_2019.nc"
-file_gisd = "/stu02/yuxr24/CoLM202X_ISA/output/NL-Amsterdam_GISD_hourly/history/NL-Amsterdam_GISD_hourly_hist_2019.nc"
-file_wsf  = "/stu02/yuxr24/CoLM202X_ISA/output/NL-Amsterdam_WSF_hourly/history/NL-Amsterdam_WSF_hourly_hist_2019.nc"
-file_orig = "/stu02/yuxr24/CoLM202X_ISA/output/NL-Amsterdam_sitedata/history/NL-Amsterdam_sitedata_hist_2019.nc"
+# 绘图进程数（None: 按 CPU 核数）与每个进程的内存上限（MB）
+nprocs = None
+memory_mb = 2048
 
-output_dir = "/stu02/yuxr24/CoLM202X_ISA/pictures/NL-Amsterdam_compare"
-os.makedirs(output_dir, exist_ok=True)
+# === 数据来源（isa_cube 中的站点/数据源） ===
+base_dir = "/stu02/yuxr24/CoLM202X_ISA/output"
+pictures_dir = "/stu02/yuxr24/CoLM202X_ISA/pictures"
+
+# 站点 -> 夏季所在年份（每个站点每个变量一张图，输出到 pictures/{station}_compare）
+station_years = {
+    "NL-Amsterdam": 2019,
+}
 
 datasets = {
-    "GAIA": file_gaia,
-    "GISA": file_gisa,
-    "GISD": file_gisd,
-    "WSF": file_wsf,
-    "SiteData": file_orig
+    "GAIA": "GAIA",
+    "GISA": "GISA",
+    "GISD": "GISD",
+    "WSF": "WSF",
+    "SiteData": "sitedata"
 }
 
 colors = {
@@ -48,117 +58,73 @@ colors = {
     "SiteData": "#6BB48F"
 }
 
-# === 读取数据（安全加载，自动跳过不存在文件）===
-ds = {}
-for name, path in datasets.items():
-    if not os.path.exists(path):
-        print(f"[跳过] 文件不存在: {path}")
-        continue
-    try:
-        ds[name] = xr.open_dataset(path, engine='netcdf4')
-        print(f"[加载成功] {name}")
-    except Exception as e:
-        print(f"[错误] {name} 打开失败 -> {e}")
+# 夏令时：True 时横轴为当地夏令时（标准时间 isa_reader.UTC_OFFSETS + 1 h，与早期图一致，
+# 如 NL-Amsterdam 为 UTC+2）；False 时为当地标准时间（NL-Amsterdam 为 UTC+1，各小时提前 1 h）
+summer_time = True
+
+# === 目标变量（fsen 为 isa_derived 中定义的城市感热各分量之和，缺失的分量跳过） ===
+target_vars = ["f_tref", "fsen"]
+
+# === 逐小时统计（isa_diurnal：各站点当地时间，见 summer_time；夏季，所有数据源与变量一次计算） ===
+isa_cube.extract(base_dir)
+offsets = {st: isa_reader.UTC_OFFSETS[st] + (1 if summer_time else 0) for st in station_years}
+source_name = {src: name for name, src in datasets.items()}
+
+jobs = []
+for station, year in station_years.items():
+    stats = isa_diurnal.diurnal_stats(
+        [station], list(datasets.values()), target_vars,
+        percentiles=(5, 95), seasons={"JJA": None},
+        period=(f"{year}-06-01", f"{year}-08-31"), offset_hours=offsets, root=base_dir,
+    )
+    stats = stats[stats["count"] > 0].copy()
+    stats["name"] = stats["source"].map(source_name)
+
+    if stats.empty:
+        print(f"[跳过] {station}: 没有找到任何输入数据")
         continue
 
-if len(ds) == 0:
-    raise SystemExit("[❌] 没有找到任何输入文件")
+    # === 找最大差异（按小时，相对 SiteData） ===
+    max_dev = isa_diurnal.max_deviation(stats, reference="sitedata")
 
-# === 时间修正（UTC+2） ===
-for name, d in ds.items():
-    if "time" in d.variables:
-        ds[name]["time"] = xr.decode_cf(d[["time"]]).time + np.timedelta64(2, "h")
+    output_dir = os.path.join(pictures_dir, f"{station}_compare")
+    os.makedirs(output_dir, exist_ok=True)
 
-# === 夏季时间段 ===
-for name in ds:
-    ds[name] = ds[name].sel(time=slice("2019-06-01", "2019-08-31"))
+    for var in target_vars:
+        sub = stats[stats["variable"] == var]
+        names = list(dict.fromkeys(sub["name"]))
 
-# === 目标变量 ===
-target_vars = ["f_tref", "fsen"]
+        if "SiteData" not in names:
+            print(f"[跳过] {station} {var}: 缺少 SiteData（观测或参考数据）")
+            continue
 
-for var in target_vars:
-    data_all = {}
-
-    for name, d in ds.items():
-        try:
-            if var == "fsen":
-                comps = [
-                    "f_fsengimp",
-                    "f_fsengper",
-                    "f_fsenurbl",
-                    "f_fsenroof",
-                    "f_fsenwsun",
-                    "f_fsenwsha",
-                ]
-                existing = [v for v in comps if v in d.variables]
-                if not existing:
-                    print(f"[WARN] {name}: 没有任何有效 fsen 分量，已跳过")
-                    continue
-
-                comp_data = [d[v].where(d[v] != -1.e36) for v in existing]
-                data = xr.concat(comp_data, dim="component").sum(dim="component", skipna=True)
-
-            else:
-                if var not in d.variables:
-                    print(f"[WARN] {name}: 不包含变量 {var}，已跳过")
-                    continue
-                data = d[var].where(d[var] != -1.e36)
-
-            if "patch" in data.dims:
-                data = data.isel(patch=0)
-
-            data_all[name] = data
-
-        except Exception as e:
-            print(f"[ERROR] {name}: 读取 {var} 失败 -> {e}")
+        if len(names) < 2:
+            print(f"[跳过] {station} {var}: 有效数据集不足（{names}）")
             continue
 
-    if "SiteData" not in data_all:
-        print(f"[跳过] {var}: 缺少 SiteData（观测或参考数据）")
-        continue
+        # 绘图任务只带 24 小时的统计量
+        hourly_stats = {
+            name: {col: g.set_index("hour")[col].reindex(range(24)).to_numpy()
+                   for col in ("mean", "p05", "p95")}
+            for name, g in sub.groupby("name")
+        }
 
-    if len(data_all) < 2:
-        print(f"[跳过] {var}: 有效数据集不足（{list(data_all.keys())}）")
-        continue
+        dev = max_dev[max_dev["variable"] == var]
+        job = {"station": station, "variable": var, "year": year, "output_dir": output_dir,
+               "hourly_stats": hourly_stats, "max_dataset": None}
+        if not dev.empty:
+            row = dev.iloc[0]
+            job.update(max_dataset=source_name[row["source"]], max_hour=int(row["hour"]),
+                       max_diff=row["diff"], isa_value=row["value"], site_value=row["reference"])
+            print(f"[{station} {var}] 最大差异: {job['max_dataset']} vs SiteData | "
+                  f"{job['max_hour']:02d}:00 | Δ = {job['max_diff']:.2f}")
+        else:
+            print(f"[{station} {var}] 没有找到有效的最大差异数据")
+        jobs.append(job)
 
-    # === 逐小时统计 ===
-    hourly_stats = {}
-    for name, data in data_all.items():
-        g = data.groupby(data.time.dt.hour)
-        hourly_stats[name] = {
-            "mean": g.mean(),
-            "p05": g.quantile(0.05),
-            "p95": g.quantile(0.95),
-        }
 
-    # === 找最大差异（按小时） ===
-    site_mean = hourly_stats["SiteData"]["mean"].values
-    max_diff = None
-    max_hour = None
-    max_dataset = None
-    isa_value = None
-    site_value = None
-
-    for h in range(24):
-        site_val = site_mean[h]
-        for name, stats in hourly_stats.items():
-            if name == "SiteData":
-                continue
-            isa_val = stats["mean"].values[h]
-            if np.isnan(isa_val) or np.isnan(site_val):
-                continue
-            diff = isa_val - site_val
-            if max_diff is None or abs(diff) > abs(max_diff):
-                max_diff = diff
-                max_hour = h
-                max_dataset = name
-                isa_value = isa_val
-                site_value = site_val
-
-    if max_dataset is not None and max_hour is not None:
-        print(f"[{var}] 最大差异: {max_dataset} vs SiteData | {max_hour:02d}:00 | Δ = {max_diff:.2f}")
-    else:
-        print(f"[{var}] 没有找到有效的最大差异数据")
+def draw_diurnal(job):
+    station, var, hourly_stats = job["station"], job["variable"], job["hourly_stats"]
 
     # === 绘图 ===
     hours = np.arange(24)
@@ -167,17 +133,17 @@ for var in target_vars:
     for name in ["GAIA", "GISA", "GISD", "WSF", "SiteData"]:
         if name not in hourly_stats:
             continue
-        mean = hourly_stats[name]["mean"].values
-        p05  = hourly_stats[name]["p05"].values
-        p95  = hourly_stats[name]["p95"].values
+        mean = hourly_stats[name]["mean"]
+        p05  = hourly_stats[name]["p05"]
+        p95  = hourly_stats[name]["p95"]
         ax.fill_between(hours, p05, p95, color=colors[name], alpha=0.1, linewidth=0)
         ax.plot(hours, mean, color=colors[name], linewidth=1.3, label=name)
 
-    if max_dataset is not None:
-        x = max_hour
+    if job["max_dataset"] is not None:
+        x = job["max_hour"]
         y_offset = -1
-        y_start = site_value + y_offset
-        y_end   = isa_value - y_offset
+        y_start = job["site_value"] + y_offset
+        y_end   = job["isa_value"] - y_offset
         ax.annotate(
             "",
             xy=(x, y_end),
@@ -185,7 +151,7 @@ for var in target_vars:
             arrowprops=dict(arrowstyle="<->", lw=1.0, color='red')
         )
         y_text = max(y_start, y_end) + 0.02 * (ax.get_ylim()[1] - ax.get_ylim()[0])
-        ax.text(x, y_text, f"Δmax = {max_diff:.1f}", color='black', fontsize=16, ha="center", va="bottom")
+        ax.text(x, y_text, f"Δmax = {job['max_diff']:.1f}", color='black', fontsize=16, ha="center", va="bottom")
 
     if var == "f_tref":
         ax.set_ylabel("2-m Air Temperature")
@@ -196,7 +162,7 @@ for var in target_vars:
     ax.text(-0.01, 1.01, unit, transform=ax.transAxes, ha="left", va="bottom", fontsize=14)
     ax.set_xlabel("Hour of Day")
     ax.set_xticks(np.arange(0, 24, 2))
-    ax.set_title("NL-Amsterdam")
+    ax.set_title(station)
 
     y_min, y_max = ax.get_ylim()
     if abs(y_max) > 999:
@@ -205,8 +171,14 @@ for var in target_vars:
 
     ax.legend(loc="upper left")
     fig.tight_layout()
-    plt.savefig(os.path.join(output_dir, f"{var}_diurnalavg_2019_hourly.png"), bbox_inches="tight")
-    plt.close()
+    path = os.path.join(job["output_dir"], f"{var}_diurnalavg_{job['year']}_hourly.png")
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+    return path
+
+
+# === 每个站点每个变量一张图，由 isa_render 在进程池中并行绘制 ===
+isa_render.render(jobs, draw_diurnal, style=style, nprocs=nprocs, memory_mb=memory_mb)
 
 print("\n✅ 所有变量绘制完成")
-print(f"📁 输出目录：{output_dir}")
+print(f"📁 输出目录：{pictures_dir}")
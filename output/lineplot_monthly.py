@@ -1,13 +1,14 @@
 import os
-import re
-import glob
-import xarray as xr
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.pyplot as plt
 from scipy.stats import gaussian_kde
 
+import isa_cube
+import isa_metrics
+import isa_reduce
+
 
 plt.rcParams.update({
     "font.size": 18,
@@ -25,12 +26,13 @@ base_dir = "/stu02/yuxr24/CoLM202X_ISA/output"
 output_dir = "/stu02/yuxr24/CoLM202X_ISA/pictures"
 os.makedirs(output_dir, exist_ok=True)
 
+# 数据集 -> isa_cube 中的 source
 datasets = {
-    "GAIA": f"{base_dir}/*_GAIA_hourly/history/*.nc",
-    "GISA": f"{base_dir}/*_GISA_hourly/history/*.nc",
-    "GISD": f"{base_dir}/*_GISD_hourly/history/*.nc",
-    "WSF":  f"{base_dir}/*_WSF_hourly/history/*.nc",
-    "SiteData": f"{base_dir}/*_sitedata/history/*.nc",
+    "GAIA": "GAIA",
+    "GISA": "GISA",
+    "GISD": "GISD",
+    "WSF":  "WSF",
+    "SiteData": "sitedata",
 }
 
 stations = [
@@ -49,74 +51,28 @@ colors = {
 }
 
 # ================================
-# 函数定义
-# ================================
-def compute_mean_monthly_value(filepath):
-    """
-    计算单个文件中 f_assim 的平均月总量（mm/month）
-    - 原单位: mm/s
-    - 先换算为 mm/hour，然后对每月累计
-    - 最后对所有月取平均
-    """
-    try:
-        ds = xr.open_dataset(filepath)
-        if "f_assim" not in ds:
-            print(f"⚠️ 跳过: 无变量 f_assim -> {os.path.basename(filepath)}")
-            ds.close()
-            return None
-
-        da = ds["f_assim"]
-        if "time" not in da.dims:
-            print(f"⚠️ 跳过: 无 time 维度 -> {os.path.basename(filepath)}")
-            ds.close()
-            return None
-
-        # === 单位换算: mm/s → mm/hour ===
-        da_hourly = da * 3600.0
-
-        # === 按月累积求总量 ===
-        da_monthly_sum = da_hourly.resample(time="1ME").sum(skipna=True)
-
-        # === 对所有月取平均值 ===
-        mean_month_val = da_monthly_sum.mean().item()
-
-        ds.close()
-        return mean_month_val
-
-    except Exception as e:
-        print(f"❌ 文件读取出错 {filepath}: {e}")
-        return None
-
-
-def extract_station_name(filepath):
-    """从路径中提取站点名"""
-    match = re.search(r"/([A-Z]{2}-[A-Za-z0-9]+)_", filepath)
-    return match.group(1) if match else "Unknown"
-
-# ================================
-# 主计算流程
+# 主计算流程（isa_reduce：只读取 f_assim，按月索引累计，各站点/数据源并行）
+# - 原单位: mm/s，先换算为 mm/hour（× 3600），然后对每月累计
+# - 每个年份先对所有月取平均，再对年份取平均（与逐年文件的结果一致）
 # ================================
-records = []
+isa_cube.extract(base_dir)
+monthly = isa_reduce.reduce(
+    ["f_assim"], "monthly_sum", stations=stations, sources=list(datasets.values()),
+    scale={"f_assim": 3600.0}, root=base_dir,
+)
 
-for dataset_name, pattern in datasets.items():
-    files = sorted(glob.glob(pattern))
-    if not files:
+for dataset_name, source in datasets.items():
+    if not (monthly["source"] == source).any():
         print(f"⚠️ 未找到文件: {dataset_name}")
-        continue
 
-    for f in files:
-        station = extract_station_name(f)
-        if station not in stations:
-            continue
-        mean_val = compute_mean_monthly_value(f)
-        if mean_val is not None:
-            records.append({
-                "Station": station,
-                "Dataset": dataset_name,
-                "Value": mean_val
-            })
-
-df = pd.DataFrame(records)
+source_name = {source: name for name, source in datasets.items()}
+means = (monthly.groupby(["station", "source", "year"])["value"].mean()
+                .groupby(level=["station", "source"]).mean().reset_index())
+df = pd.DataFrame({
+    "Station": means["station"],
+    "Dataset": means["source"].map(source_name),
+    "Value": means["value"],
+})
 if df.empty:
     raise ValueError("❌ 没有可用数据，请检查路径和变量名。")
 
@@ -148,46 +104,29 @@ for dataset, total in dataset_sums.items():
 site_total = dataset_sums.get("SiteData", np.nan)
 print("\n📊 各数据集总量相对于SiteData总量的相对误差 (%):")
 
-dataset_total_rel_error = {}
-for dataset, total in dataset_sums.items():
-    if dataset == "SiteData":
-        continue
-    if np.isnan(site_total) or site_total == 0:
-        rel_error = np.nan
-    else:
-        rel_error = abs(total - site_total) / site_total * 100
-    dataset_total_rel_error[dataset] = rel_error
+if np.isnan(site_total) or site_total == 0:
+    site_total = np.nan
+dataset_total_rel_error = (dataset_sums.drop("SiteData", errors="ignore") - site_total).abs() / site_total * 100
+for dataset, rel_error in dataset_total_rel_error.items():
     print(f"  {dataset}: {rel_error:.2f}%")
 
 
 # ================================
-# 计算最大相对误差
+# 计算最大相对误差（isa_metrics：逐时次与 SiteData 对齐后的总量相对误差，一次读取）
 # ================================
 print("\n📊 每个站点与SiteData相比的最大相对误差 (%):")
-max_rel_errors = {}
+scores = isa_metrics.metrics(
+    ["f_assim"], stations=stations, sources=[s for s in datasets.values() if s != "sitedata"],
+    reference="sitedata", root=base_dir,
+)
+scores = scores[(scores["count"] > 0) & (scores["ref_mean"] != 0)]
+max_rel_errors = scores.groupby("station")["rel_total_error"].apply(lambda e: e.abs().max())
 
 for station in stations:
-    subset = df_mean[df_mean["Station"] == station]
-    site_val = subset[subset["Dataset"] == "SiteData"]["Value"]
-    if site_val.empty or site_val.values[0] == 0:
+    if station not in max_rel_errors:
         print(f"  {station}: NA (SiteData缺失或为0)")
         continue
-    site_val = site_val.values[0]
-
-    # 对除SiteData以外的数据集计算相对误差
-    rel_errors = []
-    for dataset in datasets.keys():
-        if dataset == "SiteData":
-            continue
-        val = subset[subset["Dataset"] == dataset]["Value"]
-        if val.empty:
-            continue
-        error = abs(val.values[0] - site_val) / site_val * 100
-        rel_errors.append(error)
-
-    max_error = max(rel_errors) if rel_errors else np.nan
-    max_rel_errors[station] = max_error
-    print(f"  {station}: {max_error:.2f}%")
+    print(f"  {station}: {max_rel_errors[station]:.2f}%")
 
 
 # ================================
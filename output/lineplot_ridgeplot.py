@@ -1,47 +1,55 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-批量绘制各站点 runoff 极端值 KDE（固定阈值 >15 mm/h）
-- 同一站点同一数据源下可能有多个年份文件 -> 自动按 time 拼接
+批量绘制各站点 runoff 极端值 KDE（固定阈值 >fixed_threshold mm/h）
+- 同一站点同一数据源下可能有多个年份文件 -> isa_cube 中已按 time 拼接
 - 支持数据源：GAIA, GISA, GISD, WSF, ORIG（ORIG 作为 SiteData）
 - 对每个站点：
-    1) 读取并拼接每个数据源的所有文件
-    2) 对存在的 data source 求时间交集
-    3) 在交集时间段内提取 f_rnof, 转换为 mm/h
-    4) 只保留 f_rnof > fixed_threshold
-    5) 即使为空，也保留 Y 轴（不绘制 KDE）
+    1) isa_exceed 读取每个数据源的 runoff（isa_derived 中的 rnof_mmh，单位 mm/h）
+    2) 对存在的 data source 求时间交集，交集内的有效值排序一次
+    3) 用 searchsorted 取 > fixed_threshold 的样本
+    4) 即使为空，也保留 Y 轴（不绘制 KDE）
+- 同一组排序数组还给出多阈值敏感性表与重现水平（CSV，保存在输出目录）
 """
 
 import os
-import glob
-import re
-import xarray as xr
-import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-from scipy.stats import gaussian_kde
 
+import isa_cube
+import isa_exceed
+import isa_kde
+import isa_render
 
-plt.rcParams.update({
+
+style = {
     'font.size': 13,
     'axes.labelsize': 16,
     'axes.titlesize': 18,
     'xtick.labelsize': 13,
     'ytick.labelsize': 13,
     'legend.fontsize': 12
-})
+}
+plt.rcParams.update(style)
+
+# 绘图进程数（None: 按 CPU 核数）与每个进程的内存上限（MB）
+nprocs = None
+memory_mb = 2048
 
 
 base_dir = "/stu02/yuxr24/CoLM202X_ISA/output/"
 output_dir = "/stu02/yuxr24/CoLM202X_ISA/pictures/runoff_KDE_allstations"
 os.makedirs(output_dir, exist_ok=True)
 
-datasets_pattern = {
-    "ORIG": "*_sitedata/history/*.nc",
-    "GAIA": "*_GAIA_hourly/history/*.nc",
-    "GISA": "*_GISA_hourly/history/*.nc",
-    "GISD": "*_GISD_hourly/history/*.nc",
-    "WSF":  "*_WSF_hourly/history/*.nc",
+# 数据源 -> isa_catalog / isa_cube 中的 source
+datasets_source = {
+    "ORIG": "sitedata",
+    "GAIA": "GAIA",
+    "GISA": "GISA",
+    "GISD": "GISD",
+    "WSF":  "WSF",
 }
 
 colors = {
@@ -53,150 +61,100 @@ colors = {
 }
 
 
-target_var = "f_rnof"
+target_var = "rnof_mmh"     # isa_derived: f_rnof × 3600，单位 mm/h
 
 fixed_threshold = 10.0
 
 
 
-def extract_station_name(filepath):
-    m = re.search(r"/([A-Za-z0-9\-]+)_(?:hourly|GAIA|GISA|GISD|WSF)", filepath)
-    if m:
-        return m.group(1)
-    fname = os.path.basename(filepath)
-    m2 = re.match(r"([A-Za-z0-9\-]+)_", fname)
-    return m2.group(1) if m2 else "Unknown"
-
-
-def find_files_for_station(base_dir, station, src_key):
-    pattern = datasets_pattern[src_key]
-    fullpat = os.path.join(base_dir, pattern)
-    all_matches = glob.glob(fullpat)
-    station_files = [f for f in all_matches if station in f]
-    station_files.sort()
-    return station_files
-
-
-def open_and_concat(paths):
-    if not paths:
-        return None
-    try:
-        return xr.open_mfdataset(paths, combine='by_coords', parallel=False)
-    except Exception:
-        try:
-            ds_list = [xr.open_dataset(p) for p in paths]
-            return xr.concat(ds_list, dim="time",
-                             data_vars="minimal",
-                             coords="minimal")
-        except Exception as e:
-            print(f"    ⚠ open/concat 失败：{e}")
-            return None
-
-
-def adjust_timecoords(ds_obj, offset_hours=0):
-    try:
-        time = xr.decode_cf(ds_obj).time
-    except Exception:
-        time = ds_obj["time"]
-    time_pd = pd.to_datetime(time.values) + pd.Timedelta(hours=offset_hours)
-    return ds_obj.assign_coords(time=time_pd)
+# 阈值敏感性分析的阈值 (mm/h) 与重现期 (年)
+sensitivity_thresholds = [5.0, 10.0, 15.0, 20.0, 30.0]
+return_periods = [1, 2, 5, 10]
 
 
 # ========== 主流程 ==========
-all_files = []
-for key, pat in datasets_pattern.items():
-    all_files.extend(glob.glob(os.path.join(base_dir, pat)))
-
-if not all_files:
-    raise SystemExit("未找到任何数据文件，请检查 base_dir 与通配符模式。")
-
-station_files = {}
-for f in all_files:
-    st = extract_station_name(f)
-    station_files.setdefault(st, []).append(f)
-
-print(f"🔍 发现站点数量：{len(station_files)}")
-
-
-for station in station_files.keys():
-    print("\n===================================")
-    print(f"▶ 正在处理站点：{station}")
-    print("===================================")
-
-    ds_sources = {}
-    for src in datasets_pattern.keys():
-        paths = find_files_for_station(base_dir, station, src)
-        if not paths:
-            continue
-
-        ds = open_and_concat(paths)
-        if ds is None:
-            continue
-
-        ds = adjust_timecoords(ds, offset_hours=2)
-
-        if target_var not in ds.variables:
-            print(f"    ⚠ {src}: 不含 {target_var}")
-            continue
-
-        key = "SiteData" if src == "ORIG" else src
-        ds_sources[key] = ds
-        print(f"  - {key}: {len(paths)} files loaded")
-
-    if not ds_sources:
-        print("⚠ 无有效数据源，跳过")
-        continue
-
-    # ===== 时间交集 =====
-    starts = [pd.to_datetime(ds_sources[k].time.values).min()
-              for k in ds_sources]
-    ends = [pd.to_datetime(ds_sources[k].time.values).max()
-            for k in ds_sources]
-
-    t_start, t_end = max(starts), min(ends)
-    if t_start >= t_end:
-        print("⚠ 时间无交集，跳过")
+# 抽取新增/改动的 history 文件到 isa_cube（每个文件只读一次，已是最新则跳过）
+isa_cube.extract(base_dir)
+
+cases = [c for c in isa_cube.cases(base_dir) if c[1] in datasets_source.values()]
+if not cases:
+    raise SystemExit("未找到任何数据文件，请检查 base_dir。")
+
+station_list = sorted({st for st, _ in cases})
+print(f"🔍 发现站点数量：{len(station_list)}")
+
+# ===== 每个站点、数据源的 runoff 在共同时间段内只排序一次（isa_exceed，已缓存） =====
+# 任意阈值的超阈值样本、计数与重现水平都由排好序的数组 searchsorted 得到，改阈值无需重新读取
+names = {src: ("SiteData" if key == "ORIG" else key) for key, src in datasets_source.items()}
+prepared = isa_exceed.prepare(station_list, list(datasets_source.values()), target_var,
+                              offset_hours='site', root=base_dir)
+
+for station in station_list:
+    print(f"\n▶ 站点：{station}")
+    if station not in prepared:
+        print("  ⚠ 无有效数据源或时间无交集，跳过")
         continue
-
-    print(f"  · 共同时间段：{t_start.date()} ~ {t_end.date()}")
-
-    available = list(ds_sources.keys())
-
-    # ===== 提取 runoff =====
-    data_all = {}
-    for name, ds0 in ds_sources.items():
-        ds_slice = ds0.sel(time=slice(t_start, t_end))
-        var = ds_slice[target_var].where(ds_slice[target_var] != -1.e36) * 3600.0
-
-        if "patch" in var.dims:
-            var = var.isel(patch=0)
-
-        try:
-            df = var.to_dataframe().reset_index().set_index("time").sort_index()
-        except Exception:
-            data_all[name] = None
+    for src, entry in prepared[station].items():
+        n_exc = len(isa_exceed.exceedances(entry, fixed_threshold))
+        if n_exc == 0:
+            print(f"    ⚠ {names[src]}: 无 {target_var} > {fixed_threshold}（仅保留Y轴）")
+        else:
+            print(f"    · {names[src]}: 有效点数 {n_exc} / {len(entry['values'])}")
+
+# ===== 阈值敏感性与重现水平（同一组排序数组） =====
+sensitivity = isa_exceed.counts(prepared, sensitivity_thresholds)
+sensitivity["source"] = sensitivity["source"].map(names)
+sensitivity.to_csv(os.path.join(output_dir, f"{target_var}_threshold_sensitivity.csv"), index=False)
+
+levels = isa_exceed.return_levels(prepared, return_periods)
+levels["source"] = levels["source"].map(names)
+levels.to_csv(os.path.join(output_dir, f"{target_var}_return_levels.csv"), index=False)
+
+print("\n📊 各阈值的超阈值点数：")
+print(sensitivity.pivot_table(index=["station", "source"], columns="threshold",
+                              values="count", aggfunc="sum", sort=False).to_string())
+
+
+# ===== 所有站点、数据源的 KDE 一次批量计算（isa_kde：分箱 + FFT，带宽同 gaussian_kde） =====
+curve_keys, samples, points = [], [], []
+for station, entries in prepared.items():
+    for src, entry in entries.items():
+        vals = isa_exceed.exceedances(entry, fixed_threshold)
+        if len(vals) < 2:
             continue
+        xs_max = max(vals.max(), fixed_threshold * 1.2)
+        curve_keys.append((station, names[src]))
+        samples.append(vals)
+        points.append(np.linspace(fixed_threshold, xs_max * 1.25, 300))
 
-        df = df[df[target_var] > fixed_threshold]
+curves = {key: (xs, ys) for key, xs, ys in
+          zip(curve_keys, points, isa_kde.kde_curves(samples, points)) if ys is not None}
 
-        if df.empty:
-            print(f"    ⚠ {name}: 无 f_rnof > {fixed_threshold}（仅保留Y轴）")
-            data_all[name] = None
-            continue
+# 每个站点一个绘图任务：只带 KDE 曲线
+jobs = []
+for station, entries in prepared.items():
+    available = [names[src] for src in entries]
+    jobs.append({
+        "station": station,
+        "available": available,
+        "curves": {name: curves[(station, name)] for name in available if (station, name) in curves},
+    })
+del samples
 
-        data_all[name] = df
-        print(f"    · {name}: 有效点数 {len(df)}")
+
+def draw_station(job):
+    station, available, curves = job["station"], job["available"], job["curves"]
 
     # ===== 绘图 =====
     y_base = np.arange(len(available))
     fig, ax = plt.subplots(figsize=(4.5, 3))
 
     for i, name in enumerate(available):
-        df = data_all.get(name)
         color = colors.get(name, "#999999")
+        xs, ys = curves.get(name, (None, None))
 
-        # ===== 情况 1：存在数据源，但 >threshold 为空 → 画“占位脊线” =====
-        if df is None or len(df) < 2:
+        # ===== 情况 1：存在数据源，但 >threshold 为空（或无法拟合 KDE）→ 画“占位脊线” =====
+        if ys is None:
             # 在阈值右侧画一条很短、很浅的水平线作为占位
             x0 = fixed_threshold * 1.05
             x1 = fixed_threshold * 1.25
@@ -209,33 +167,12 @@ for station in station_files.keys():
             )
             continue
 
-        # ===== 情况 2：有 >threshold 数据 → 正常画 KDE =====
-        vals = df[target_var].values
-        kde = gaussian_kde(vals)
-
-        xs_max = max(vals.max(), fixed_threshold * 1.2)
-        xs = np.linspace(fixed_threshold, xs_max * 1.25, 300)
-
-        ys = kde(xs)
-        ys = ys / ys.max() * 0.8
-
-        ax.fill_between(xs, y_base[i], y_base[i] + ys,
-                        color=color, alpha=0.5)
-        ax.plot(xs, y_base[i] + ys, color=color, lw=0.9)
-
-
-        vals = df[target_var].values
-        kde = gaussian_kde(vals)
-
-        xs_max = max(vals.max(), fixed_threshold * 1.2)
-        xs = np.linspace(fixed_threshold, xs_max * 1.25, 300)
-
-        ys = kde(xs)
+        # ===== 情况 2：有 >threshold 数据 → 画 KDE（同一条曲线用于填充与轮廓） =====
         ys = ys / ys.max() * 0.8
 
-        color = colors.get(name, "#999999")
+        # 原先 alpha=0.5 与 alpha=0.25 两次叠加填充，合成不透明度为 1 - 0.5 * 0.75
         ax.fill_between(xs, y_base[i], y_base[i] + ys,
-                        color=color, alpha=0.25)
+                        color=color, alpha=0.625)
         ax.plot(xs, y_base[i] + ys, color=color, lw=0.9)
 
     ax.set_yticks(y_base + 0.4)
@@ -251,12 +188,13 @@ for station in station_files.keys():
     ax.spines["bottom"].set_linewidth(0.8)
 
     fig.tight_layout()
-    fig.savefig(
-        os.path.join(output_dir, f"{station}_KDE_extreme_fixed{int(fixed_threshold)}.png"),
-        dpi=600, bbox_inches="tight"
-    )
-    plt.close()
+    path = os.path.join(output_dir, f"{station}_KDE_extreme_fixed{int(fixed_threshold)}.png")
+    fig.savefig(path, dpi=600, bbox_inches="tight")
+    plt.close(fig)
+    return path
+
 
-    print("  图像已保存")
+# ===== 每个站点一张图，由 isa_render 在进程池中并行绘制 =====
+isa_render.render(jobs, draw_station, style=style, nprocs=nprocs, memory_mb=memory_mb)
 
 print("\n🎉 全部站点处理完成")
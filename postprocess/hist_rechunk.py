@@ -0,0 +1,247 @@
+'''
+Parallel re-chunking and compression of the history files of finished runs
+
+The site runs write their history with DEF_HIST_CompressLevel = 0, one file per year
+(DEF_HIST_groupby = 'YEAR'), so every file holds ~140 uncompressed (time, patch) variables
+and a script reading one series reads them in full.  convert rewrites the history files
+over a pool of processes with
+
+    chunks      one chunk per series: the whole time axis of one patch and one layer (at most
+                CHUNK steps), so one variable is read as one contiguous block
+    codec       shuffle + deflate (zlib, --level) by default, or zstd (faster to read and
+                write, without shuffle: netCDF4 applies it with deflate only) when the netCDF
+                library has it, or none
+    --drop / --keep     variables left out / the only ones kept (coordinates always kept)
+    --float32   float64 data variables stored as float32
+
+Every file is written next to its target and checked against the source before it replaces
+anything: all values must round-trip (exactly, or as float32 with --float32).  The result
+goes to a sibling directory (history -> history_rechunked, or --out DIR) or, with --inplace,
+replaces the source file.  A converted file carries a hist_rechunk attribute and is not
+converted again; files changed in the last --min-age minutes are left alone (the history
+of a running case).
+
+Usage:
+    python hist_rechunk.py OUTPUT_DIR|FILE ... [--inplace | --out DIR] [--nprocs N]
+                           [--codec zlib|zstd|none] [--level N] [--float32] [--drop VAR ...]
+
+Oct 2026
+'''
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+
+
+CHUNK    = 8784          # time steps per chunk: one leap year of hourly values
+COORDS   = ('time', 'lat', 'lon', 'lat_cama', 'lon_cama')
+SIBLING  = 'history_rechunked'
+MIN_AGE  = 10            # minutes
+
+
+
+def history_files(paths):
+    '''
+    History files of the given files and run output directories ({case}/history/*.nc)
+    '''
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+        else:
+            files += glob.glob(os.path.join(path, '*', 'history', '*_hist_*.nc'))
+            files += glob.glob(os.path.join(path, 'history', '*_hist_*.nc'))
+            files += glob.glob(os.path.join(path, '*_hist_*.nc'))
+    return sorted(set(os.path.abspath(f) for f in files))
+
+
+def target_path(src, inplace=False, out=None):
+    if inplace:
+        return src
+    if out:
+        return os.path.join(out, os.path.basename(src))
+    hdir = os.path.dirname(src)
+    return os.path.join(os.path.dirname(hdir), SIBLING, os.path.basename(src))
+
+
+def settings(options):
+    return json.dumps({k: options[k] for k in ('codec', 'level', 'float32', 'drop', 'keep')}, sort_keys=True)
+
+
+def converted(path, options):
+    import netCDF4 as nc
+    try:
+        with nc.Dataset(path) as ds:
+            return getattr(ds, 'hist_rechunk', None) == settings(options)
+    except OSError:
+        return False
+
+
+def selected(name, var, options):
+    if name in COORDS or 'time' not in var.dimensions:
+        return True
+    if options['keep'] and name not in options['keep']:
+        return False
+    return name not in options['drop']
+
+
+def chunking(var, ntime):
+    '''
+    One chunk per series: the whole time axis (at most CHUNK), one of every other dimension
+    but the last (patch / grid), kept whole
+    '''
+    shape = var.shape
+    chunks = []
+    for k, dim in enumerate(var.dimensions):
+        if dim == 'time':
+            chunks.append(max(1, min(CHUNK, ntime)))
+        elif k == len(shape) - 1:
+            chunks.append(max(1, shape[k]))
+        else:
+            chunks.append(1)
+    return chunks
+
+
+def codec_args(options):
+    if options['codec'] == 'none':
+        return {}
+    if options['codec'] == 'zstd':
+        return {'compression': 'zstd', 'complevel': options['level']}
+    return {'compression': 'zlib', 'complevel': options['level'], 'shuffle': True}
+
+
+def write_file(src, tmp, options):
+    import netCDF4 as nc
+    with nc.Dataset(src) as a, nc.Dataset(tmp, 'w', format='NETCDF4') as b:
+        a.set_auto_maskandscale(False)
+        b.set_auto_maskandscale(False)
+        b.setncatts({k: a.getncattr(k) for k in a.ncattrs()})
+        ntime = len(a.dimensions['time']) if 'time' in a.dimensions else 0
+        for name, dim in a.dimensions.items():
+            b.createDimension(name, None if dim.isunlimited() else len(dim))
+        for name, var in a.variables.items():
+            if not selected(name, var, options):
+                continue
+            dtype = var.dtype
+            if options['float32'] and dtype == np.float64 and name not in COORDS and 'time' in var.dimensions:
+                dtype = np.float32
+            attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+            fill = attrs.pop('_FillValue', None)
+            if fill is not None:
+                fill = np.array(fill).astype(dtype)
+            kwargs = {}
+            if var.ndim and dtype != str:
+                kwargs = dict(codec_args(options), chunksizes=chunking(var, ntime)) if 'time' in var.dimensions \
+                    else codec_args(options)
+            v = b.createVariable(name, dtype, var.dimensions, fill_value=fill, **kwargs)
+            v.setncatts({k: np.array(x).astype(dtype) if k == 'missing_value' and dtype != var.dtype else x
+                         for k, x in attrs.items()})
+            if var.ndim == 0:
+                v.assignValue(var.getValue())
+            elif var.size:
+                v[:] = var[:].astype(dtype, copy=False)
+        b.hist_rechunk = settings(options)
+
+
+def verify(src, dst, options):
+    '''
+    Name of the first variable of dst whose values differ from src, None if all round-trip
+    '''
+    import netCDF4 as nc
+    with nc.Dataset(src) as a, nc.Dataset(dst) as b:
+        a.set_auto_maskandscale(False)
+        b.set_auto_maskandscale(False)
+        for name, var in a.variables.items():
+            if not selected(name, var, options):
+                continue
+            if name not in b.variables:
+                return name
+            x, y = var[:], b.variables[name][:]
+            if b.variables[name].dtype != var.dtype:
+                x = np.asarray(x).astype(b.variables[name].dtype)
+            if not np.array_equal(np.asarray(x), np.asarray(y), equal_nan=x.dtype.kind == 'f'):
+                return name
+    return None
+
+
+def convert_file(task):
+    '''
+    Rewrite one history file; returns (src, status, size before, size after, seconds)
+    '''
+    src, dst, options = task
+    t0 = time.time()
+    before = os.path.getsize(src)
+    if time.time() - os.path.getmtime(src) < options['min_age'] * 60:
+        return src, 'recent', before, before, 0.0
+    if converted(dst, options) and (dst == src or os.path.getmtime(dst) >= os.path.getmtime(src)):
+        return src, 'done', before, os.path.getsize(dst), 0.0
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    try:
+        write_file(src, tmp, options)
+        bad = verify(src, tmp, options)
+        if bad is not None:
+            os.remove(tmp)
+            return src, f'mismatch in {bad}', before, before, time.time() - t0
+        os.replace(tmp, dst)
+    except Exception as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return src, f'error: {e}', before, before, time.time() - t0
+    return src, 'ok', before, os.path.getsize(dst), time.time() - t0
+
+
+def convert(paths, inplace=False, out=None, codec='zlib', level=4, float32=False, drop=(), keep=(),
+            nprocs=4, min_age=MIN_AGE, verbose=False):
+    '''
+    Convert the history files of paths; returns the list of convert_file results
+    '''
+    import netCDF4 as nc
+    if codec == 'zstd' and not getattr(nc, '__has_zstandard_support__', False):
+        print('zstd is not available in this netCDF library, zlib is used')
+        codec = 'zlib'
+    options = {'codec': codec, 'level': level, 'float32': float32, 'drop': sorted(drop), 'keep': sorted(keep),
+               'min_age': min_age}
+    tasks = [(f, target_path(f, inplace, out), options) for f in history_files(paths)]
+    results = []
+    if tasks:
+        with multiprocessing.get_context('fork').Pool(max(1, min(nprocs, len(tasks)))) as pool:
+            for res in pool.imap_unordered(convert_file, tasks):
+                results.append(res)
+                if verbose:
+                    src, status, before, after, secs = res
+                    print(f'  {os.path.basename(src)}: {status} {before / 2**20:.1f} -> {after / 2**20:.1f} MB '
+                          f'({secs:.1f} s)')
+    return results
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='re-chunk and compress history files')
+    parser.add_argument('paths', nargs='+', help='history files or run output directories')
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--inplace', action='store_true', help='replace the source files')
+    where.add_argument('--out', default=None, help=f'output directory (default: {SIBLING} next to history)')
+    parser.add_argument('--codec', default='zlib', choices=['zlib', 'zstd', 'none'])
+    parser.add_argument('--level', type=int, default=4, help='compression level')
+    parser.add_argument('--float32', action='store_true', help='store float64 data variables as float32')
+    parser.add_argument('--drop', nargs='+', default=[], help='variables left out')
+    parser.add_argument('--keep', nargs='+', default=[], help='the only variables kept')
+    parser.add_argument('--nprocs', type=int, default=4)
+    parser.add_argument('--min-age', type=float, default=MIN_AGE, help='minutes since the last change of a file')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    results = convert(args.paths, args.inplace, args.out, args.codec, args.level, args.float32,
+                      args.drop, args.keep, args.nprocs, args.min_age, verbose=True)
+    ok = [r for r in results if r[1] in ('ok', 'done')]
+    before, after = sum(r[2] for r in ok), sum(r[3] for r in ok)
+    print(f'{len(ok)}/{len(results)} files converted, {before / 2**20:.1f} -> {after / 2**20:.1f} MB '
+          f'({after / before:.0%} of the size) in {time.time() - t0:.0f} s' if before else
+          f'{len(ok)}/{len(results)} files converted')
+    for src, status, *_ in results:
+        if status not in ('ok', 'done', 'recent'):
+            print(f'  ✗ {src}: {status}')
@@ -1,22 +1,35 @@
 # -*- coding: utf-8 -*-
 """
-A libray with Python functions for merging GLDAS data / need to be updated
-****
+Merge the GLDAS 3-hourly files (GLDAS_NOAH025_3H.A*.nc4, one per step) into the monthly
+files of every variable read by colm.x (GDAS_GPCP/GLDAS_GDAS_3H_{var}.{yyyy}{mm}.nc4, as in
+run/forcing/GDAS.nml), with ../merge_forcing.py: this replaces step2_Merge_Data.sh (settaxis,
+mergetime, selname) and step3_Reduce_Dimension.sh.
+
+    python step2_Merge_Data.py [INPUT_DIR] [--out DIR] [--nprocs N] [--codec zlib|zstd|none]
 """
 __author__ = "Zhongwang Wei / zhongwang007@gmail.com"
-__version__ = "0.1"
-__release__ = "0.1"
-__date__ = "Oct 2020"
+__version__ = "0.2"
+__release__ = "0.2"
+__date__ = "Oct 2026"
+
+import argparse
+import os
+import sys
 
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+import merge_forcing
 
-import xarray as xr
-from pylab import *
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='merge the GLDAS 3-hourly files into monthly files')
+    parser.add_argument('input_dir', nargs='?', default='.', help='directory of GLDAS_NOAH025_3H.A*.nc4')
+    parser.add_argument('--out', default='GDAS_GPCP', help='output directory (DEF_dir_forcing)')
+    parser.add_argument('--codec', default='zlib', choices=['zlib', 'zstd', 'none'])
+    parser.add_argument('--level', type=int, default=4, help='compression level')
+    parser.add_argument('--nprocs', type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
 
-combined=xr.open_mfdataset('GLDAS_*.nc4', combine='nested',concat_dim="time",chunks={'time': 365})#.chunk(chunks='auto', token=None, lock=False)
-#combined.to_netcdf('test.nc',engine='netcdf4',encoding={'time':{'units':'days since 2000-01-01 00:00:00'}})
-comp = dict(zlib=True, complevel=6, _FillValue= -9999) #,chunksizes=(1,150,360)
-encoding = {var: comp for var in combined.data_vars}
-#combined.to_netcdf('test.nc',engine='netcdf4',encoding=encoding)
-combined.to_netcdf('test.nc',engine='netcdf4',encoding=encoding) #scipy
-#combined.to_netcdf('test.nc',engine='netcdf4')
\ No newline at end of file
+    merge_forcing.merge(os.path.join(here, '../../../run/forcing/GDAS.nml'),
+                        [os.path.join(args.input_dir, 'GLDAS_NOAH025_3H.A*.nc4')], args.out,
+                        codec=args.codec, level=args.level, nprocs=args.nprocs)
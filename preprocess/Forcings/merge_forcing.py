@@ -0,0 +1,453 @@
+'''
+Chunked, parallel merge of downloaded forcing files into the files read by colm.x
+
+The products come as many small files (GLDAS: one file per 3-hour step, MSWX: one per step
+and variable, TPMFD: one per day, CMIP6 / JRA55: a few years or months per file) that the
+step2 scripts merged with cdo mergetime / selname / --reduce_dim, one variable and month at
+a time.  merge does the same from the forcing namelist of the product
+(run/forcing/{GDAS,MSWX,TPMFD,WFDE5,CMIP6,...}.nml):
+
+    index       the time axis and variables of every input file are read once, over a pool
+                of processes; the records of every variable are put in time order (a record
+                repeated by overlapping files: the first file in time wins)
+    outputs     one file per fprefix and year / month (DEF_forcing%groupby) named as
+                metfilename names it (GDAS: {fprefix}{yyyy}{mm}.nc4, MSWX:
+                {fprefix}_{yyyy}_{mm}.nc, CMIP6: {fprefix}_{yyyy}.nc, ...; or --name),
+                holding the variables vname of this fprefix on (time, lat, lon): singleton
+                dimensions (height, level) are dropped, packed values (scale_factor,
+                add_offset) unpacked and the missing values set to FILL (missing_value)
+    streaming   an output is filled BLOCK records at a time, read from the input files
+                holding them (one slice per file), so the memory used does not depend on
+                the size of the inputs or of the period
+    parallel    the output files are written and compressed over --nprocs processes (the
+                files reading the same inputs, the variables of a month of GLDAS, by one of
+                them, which opens every input once), with --codec zlib (+ shuffle, --level) /
+                zstd / none and chunks of --steps records x the whole grid: colm.x reads one
+                time slab of a variable at a time
+    --source    input variables of a vname: a renamed one (Tair_f_inst=Tair) or the sum of
+                several (WFDE5: precipitation=Rainf+Snowf)
+
+A month or year is written only when all its records are there (its length / dtime, without
+Feb 29 for a no-leap product) on a regular axis, since colm.x dates the records from the
+start of the file; outputs already there are kept (--overwrite to rewrite them).  Every file
+is written next to its target and renamed when complete.  The GRIB products (JRA55, CRA40) are
+converted to netCDF first (cdo -f nc copy / ncl_convert2nc, as in their step2 scripts).
+
+Usage:
+    python merge_forcing.py FORCING_NML INPUT ... --out DIR [--years Y0 Y1] [--vars VNAME ...]
+                            [--source VNAME=SRC[+SRC]] [--name TEMPLATE] [--codec zlib|zstd|none]
+                            [--level N] [--steps N] [--float64] [--flip-lat] [--nprocs N]
+
+Oct 2026
+'''
+import argparse
+import calendar
+import datetime
+import glob
+import multiprocessing
+import os
+import time
+import numpy as np
+
+import point_extract
+
+
+# file name of a variable by dataset (metfilename in main/MOD_UserSpecifiedForcing.F90)
+NAMES = {
+    'PRINCETON': '{prefix}{year}-{year}.nc',
+    'GSWP3'    : '{prefix}{year}-{month}.nc',
+    'QIAN'     : '{prefix}{year}-{month}.nc',
+    'CRUNCEPV4': '{prefix}{year}-{month}.nc',
+    'CRUNCEPV7': '{prefix}{year}-{month}.nc',
+    'ERA5LAND' : '{prefix}_{year}_{month}{suffix}',
+    'ERA5'     : '{prefix}_{year}_{month}{suffix}',
+    'MSWX'     : '{prefix}_{year}_{month}.nc',
+    'WFDE5'    : '{prefix}{year}{month}_v2.1.nc',
+    'CRUJRA'   : '{prefix}{year}.365d.noc.nc',
+    'WFDEI'    : '{prefix}{year}-{month}.nc',
+    'JRA3Q'    : '{prefix}_{year}_{month}.nc',
+    'JRA55'    : '{prefix}{year}{month}.nc',
+    'GDAS'     : '{prefix}{year}{month}.nc4',
+    'CLDAS'    : '{prefix}-{year}{month}.nc',
+    'CMFD'     : '{prefix}{year}{month}.nc4',
+    'CMFDv2'   : '{prefix}{year}{month}.nc',
+    'CMIP6'    : '{prefix}_{year}.nc',
+    'CRA40'    : '{prefix}_{year}.nc',
+    'TPMFD'    : '{prefix}{year}{month}.nc',
+    'IsoGSM'   : '{prefix}_{year}.nc',
+}
+SUFFIXES = {
+    'ERA5LAND': ['_2m_temperature.nc', '_specific_humidity.nc', '_surface_pressure.nc',
+                 '_total_precipitation_m_hr.nc', '_10m_u_component_of_wind.nc',
+                 '_10m_v_component_of_wind.nc', '_surface_solar_radiation_downwards_w_m2.nc',
+                 '_surface_thermal_radiation_downwards_w_m2.nc'],
+    'ERA5'    : ['_2m_temperature.nc4', '_q.nc4', '_surface_pressure.nc4', '_mean_total_precipitation_rate.nc4',
+                 '_10m_u_component_of_wind.nc4', '_10m_v_component_of_wind.nc4',
+                 '_mean_surface_downward_short_wave_radiation_flux.nc4',
+                 '_mean_surface_downward_long_wave_radiation_flux.nc4'],
+}
+PACKING = ('scale_factor', 'add_offset', '_FillValue', 'missing_value', 'valid_min', 'valid_max',
+           'valid_range', 'actual_range')
+FILL  = -9999.
+BLOCK = 248              # records read at once: a month of 3-hourly values
+EPOCH = np.datetime64('1900-01-01T00:00:00', 's')
+
+
+
+def output_name(cfg, i, year, month, template=None):
+    '''
+    File name of variable i for a year / month, relative to DEF_dir_forcing
+    '''
+    dataset = cfg['dataset']
+    template = template or NAMES.get(dataset)
+    if template is None:
+        raise SystemExit(f'no file name known for the dataset {dataset}: give one with --name')
+    suffix = SUFFIXES[dataset][i] if dataset in SUFFIXES and i < len(SUFFIXES[dataset]) else ''
+    return template.format(prefix=cfg['fprefix'][i], year=f'{year:04d}', month=f'{month:02d}', suffix=suffix)
+
+
+def parse_sources(cfg, sources=()):
+    '''
+    {variable number: input variables summed into it}, vname itself by default
+    '''
+    given = {}
+    for s in sources:
+        name, _, parts = s.partition('=')
+        given[name.strip()] = [p.strip() for p in parts.split('+') if p.strip()]
+    return {i: given.get(name, [name]) for i, name in enumerate(cfg['vname'])
+            if name != 'NULL' and cfg['fprefix'][i] != 'NULL'}
+
+
+
+def time_dim(dims):
+    return next((d for d in dims if d.lower() in ('time', 'valid_time', 't')), None)
+
+
+def read_index(path):
+    '''
+    (seconds since 1900 of the records, names of the time-varying variables) of an input file
+    '''
+    import netCDF4 as nc
+    with nc.Dataset(path) as ds:
+        tname = time_dim(ds.dimensions)
+        if tname is None or tname not in ds.variables:
+            raise ValueError(f'{path}: no time variable')
+        tvar = ds.variables[tname]
+        dates = nc.num2date(tvar[:], tvar.units, getattr(tvar, 'calendar', 'standard'))
+        # dates of a no-leap calendar are dates of the standard one
+        seconds = (np.array([np.datetime64(d.strftime('%Y-%m-%dT%H:%M:%S'), 's') for d in np.ravel(dates)])
+                   - EPOCH).astype(np.int64)
+        names = [n for n, v in ds.variables.items() if n != tname and tname in v.dimensions]
+    return seconds, names
+
+
+def group_bounds(key, groupby):
+    '''
+    First and last + 1 second (since 1900) of a (year, month) group
+    '''
+    year, month = key
+    if groupby == 'year':
+        start, end = datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+    else:
+        start = datetime.datetime(year, month, 1)
+        end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    base = datetime.datetime(1900, 1, 1)
+    return int((start - base).total_seconds()), int((end - base).total_seconds())
+
+
+def expected_records(key, groupby, dtime, leapyear=True):
+    '''
+    Records of a year / month group colm.x reads from its file
+    '''
+    start, end = group_bounds(key, groupby)
+    seconds = end - start
+    if not leapyear and calendar.isleap(key[0]) and (groupby == 'year' or key[1] == 2):
+        seconds -= 86400
+    return seconds // dtime
+
+
+def source_records(index, name):
+    '''
+    Seconds, file number and step in the file of the records of an input variable, sorted and
+    without repeated records; None if no file holds it
+    '''
+    parts = [(t, np.full(len(t), f, np.int32), np.arange(len(t), dtype=np.int64))
+             for f, (t, names) in enumerate(index) if name in names]
+    if not parts:
+        return None
+    seconds = np.concatenate([p[0] for p in parts])
+    order = np.argsort(seconds, kind='stable')
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = np.diff(seconds[order]) != 0          # overlapping files: first one wins
+    order = order[keep]
+    return (seconds[order], np.concatenate([p[1] for p in parts])[order],
+            np.concatenate([p[2] for p in parts])[order])
+
+
+def plan(files, index, cfg, sources, years=None, template=None, variables=None):
+    '''
+    One task per output file: name, (year, month) key, dtime, times (seconds since 1900),
+    the input files it reads and variables [(vname, [(input variable, file numbers in these,
+    steps)])] aligned on the times; and the vnames no input holds
+    '''
+    records = {s: source_records(index, s) for srcs in sources.values() for s in srcs}
+    tasks, missing = {}, []
+    for i, srcs in sources.items():
+        vname = cfg['vname'][i]
+        if variables and vname not in variables:
+            continue
+        if any(records[s] is None for s in srcs):
+            missing.append(vname)
+            continue
+        seconds = records[srcs[0]][0]
+        for s in srcs[1:]:
+            seconds = np.intersect1d(seconds, records[s][0])
+        dates = EPOCH + seconds.astype('timedelta64[s]')
+        keys = (dates.astype('datetime64[Y]').astype(int) + 1970) * 100
+        if cfg['groupby'] != 'year':
+            keys += dates.astype('datetime64[M]').astype(int) % 12 + 1
+        for key in np.unique(keys):
+            year, month = divmod(int(key), 100)
+            if years and not years[0] <= year <= years[1]:
+                continue
+            times = seconds[keys == key]
+            name = output_name(cfg, i, year, month or 1, template)
+            task = tasks.setdefault(name, {'name': name, 'key': (year, month or 1), 'dtime': cfg['dtime'][i],
+                                           'times': times, 'variables': []})
+            task['times'] = np.intersect1d(task['times'], times)
+            task['variables'].append((vname, [(s, records[s]) for s in srcs]))
+
+    # variables of one file (CRA40) on the records they all have
+    for task in tasks.values():
+        aligned = []
+        for vname, inputs in task['variables']:
+            pos = [np.searchsorted(t, task['times']) for _, (t, _, _) in inputs]
+            aligned.append((vname, [(s, f[p], k[p]) for (s, (_, f, k)), p in zip(inputs, pos)]))
+        used = np.unique(np.concatenate([f for _, srcs in aligned for _, f, _ in srcs]))
+        task['files'] = [files[f] for f in used]
+        task['variables'] = [(vname, [(s, np.searchsorted(used, f).astype(np.int32), k) for s, f, k in srcs])
+                             for vname, srcs in aligned]
+    return sorted(tasks.values(), key=lambda t: (t['key'], t['name'])), missing
+
+
+def check_axis(task, cfg):
+    '''
+    None if the records of a task fill its year / month on a regular axis, else the reason
+    '''
+    n, dtime = len(task['times']), task['dtime']
+    if dtime <= 0:
+        return None
+    expected = expected_records(task['key'], cfg['groupby'], dtime, cfg['leapyear'])
+    steps = np.diff(task['times'])
+    if not cfg['leapyear']:
+        steps = steps[steps != dtime + 86400]        # Feb 29 left out of a no-leap product
+    if n != expected or (steps != dtime).any():
+        return f'incomplete: {n} of {expected} records'
+    return None
+
+
+def codec_args(options):
+    if options['codec'] == 'none':
+        return {}
+    if options['codec'] == 'zstd':
+        return {'compression': 'zstd', 'complevel': options['level']}
+    return {'compression': 'zlib', 'complevel': options['level'], 'shuffle': True}
+
+
+def read_block(dataset, inputs, p0, p1):
+    '''
+    Records p0 to p1 (excluded) of an output variable, the sum of its inputs, time first,
+    singleton dimensions dropped, NaN for the missing values
+    '''
+    total = None
+    for name, files, steps in inputs:
+        f, k = files[p0:p1], steps[p0:p1]
+        block = None
+        bounds = np.flatnonzero(np.diff(f)) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(f)]):
+            var = dataset(int(f[lo])).variables[name]
+            t = var.dimensions.index(time_dim(var.dimensions))
+            first, last = int(k[lo:hi].min()), int(k[lo:hi].max())
+            key = [slice(None)] * var.ndim
+            key[t] = slice(first, last + 1)
+            values = np.ma.filled(np.ma.asarray(var[tuple(key)], dtype=np.float64), np.nan)
+            values = np.moveaxis(values, t, 0)[k[lo:hi] - first]
+            values = values.reshape((hi - lo,) + tuple(s for s in values.shape[1:] if s != 1))
+            if block is None:
+                block = np.empty((len(f),) + values.shape[1:])
+            block[lo:hi] = values
+        total = block if total is None else total + block
+    return total
+
+
+def write_task(task, dataset, cfg, options, tmp):
+    '''
+    Write the file of a task to tmp, BLOCK records at a time, reading its inputs with
+    dataset(file number); returns the values written
+    '''
+    import netCDF4 as nc
+    times, n, written = task['times'], len(task['times']), 0
+    dtype = np.float64 if options['float64'] else np.float32
+    with nc.Dataset(tmp, 'w', format='NETCDF4') as out:
+        for vname, inputs in task['variables']:
+            src = dataset(int(inputs[0][1][0]))
+            var = src.variables[inputs[0][0]]
+            dims = [d for d, s in zip(var.dimensions, var.shape) if d != time_dim(var.dimensions) and s != 1]
+            flip = options['flip_lat'] and cfg['latname'] in dims
+            if not out.dimensions:
+                out.setncatts({k: src.getncattr(k) for k in src.ncattrs() if k != 'history'})
+                out.history = f'{time.ctime()}: merge_forcing.py {task["name"]}'
+                out.createDimension('time', n)
+                t = out.createVariable('time', np.float64, ('time',))
+                t.setncatts({'long_name': 'time', 'units': 'hours since 1900-01-01 00:00:00',
+                             'calendar': 'standard'})
+                t[:] = times / 3600.
+            for d in dims:
+                if d in out.dimensions:
+                    continue
+                out.createDimension(d, len(src.dimensions[d]))
+                if d in src.variables:
+                    c = src.variables[d]
+                    v = out.createVariable(d, c.dtype, (d,))
+                    v.setncatts({a: c.getncattr(a) for a in c.ncattrs() if a not in PACKING})
+                    v[:] = c[:][::-1] if flip and d == cfg['latname'] else c[:]
+            chunks = [max(1, min(options['steps'], n))] + [len(src.dimensions[d]) for d in dims]
+            v = out.createVariable(vname, dtype, ['time'] + dims, fill_value=dtype(FILL), chunksizes=chunks,
+                                   **codec_args(options))
+            v.setncatts({a: var.getncattr(a) for a in var.ncattrs() if a not in PACKING})
+            v.missing_value = dtype(FILL)
+            lat = dims.index(cfg['latname']) + 1 if flip else None
+            for p0 in range(0, n, BLOCK):
+                p1 = min(n, p0 + BLOCK)
+                block = read_block(dataset, inputs, p0, p1)
+                if lat is not None:
+                    block = np.flip(block, axis=lat)
+                v[p0:p1] = np.where(np.isnan(block), FILL, block).astype(dtype)
+                written += block.size
+    return written
+
+
+def merge_task(task, dataset, cfg, options):
+    '''
+    Write one output file; returns (name, status, records, values, bytes written, seconds)
+    '''
+    t0 = time.time()
+    dst = os.path.join(options['out'], task['name'])
+    n = len(task['times'])
+    if os.path.exists(dst) and not options['overwrite']:
+        return task['name'], 'exists', n, 0, os.path.getsize(dst), 0.0
+    bad = None if options['allow_gaps'] else check_axis(task, cfg)
+    if bad:
+        return task['name'], bad, n, 0, 0, 0.0
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    try:
+        values = write_task(task, dataset, cfg, options, tmp)
+        os.replace(tmp, dst)
+    except Exception as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return task['name'], f'error: {e}', n, 0, 0, time.time() - t0
+    return task['name'], 'ok', n, values, os.path.getsize(dst), time.time() - t0
+
+
+def merge_job(job):
+    '''
+    Write the output files of a job, the tasks reading the same input files (the variables
+    of a month of GLDAS), each input file being opened once
+    '''
+    import netCDF4 as nc
+    tasks, cfg, options = job
+    handles = {}
+
+    def dataset(f):
+        if f not in handles:
+            handles[f] = nc.Dataset(tasks[0]['files'][f])
+        return handles[f]
+
+    try:
+        return [merge_task(task, dataset, cfg, options) for task in tasks]
+    finally:
+        for ds in handles.values():
+            ds.close()
+
+
+def merge(nml, inputs, out, years=None, variables=None, sources=(), template=None, codec='zlib', level=4,
+          steps=1, float64=False, flip_lat=False, overwrite=False, allow_gaps=False, nprocs=4, verbose=True):
+    '''
+    Merge the input files (paths or glob patterns) into the files of the forcing namelist of
+    their product under out; returns the list of merge_task results
+    '''
+    import netCDF4 as nc
+    cfg = point_extract.read_forcing_nml(nml)
+    if codec == 'zstd' and not getattr(nc, '__has_zstandard_support__', False):
+        print('zstd is not available in this netCDF library, zlib is used')
+        codec = 'zlib'
+    files = sorted(set(f for p in inputs for f in (glob.glob(p) if glob.has_magic(p) else [p])))
+    if not files:
+        raise SystemExit('no input file')
+    options = {'out': out, 'codec': codec, 'level': level, 'steps': steps, 'float64': float64,
+               'flip_lat': flip_lat, 'overwrite': overwrite, 'allow_gaps': allow_gaps}
+
+    t0 = time.time()
+    nbytes = sum(os.path.getsize(f) for f in files)
+    with multiprocessing.get_context('fork').Pool(max(1, min(nprocs, len(files)))) as pool:
+        index = pool.map(read_index, files, chunksize=max(1, len(files) // (4 * nprocs)))
+    # files in time order, so that the first file of overlapping ones is the earliest
+    order = sorted(range(len(files)), key=lambda f: (index[f][0].min() if len(index[f][0]) else 0, files[f]))
+    files, index = [files[f] for f in order], [index[f] for f in order]
+    tasks, missing = plan(files, index, cfg, parse_sources(cfg, sources), years, template, variables)
+    if verbose:
+        print(f'{len(files)} input files ({nbytes / 2**30:.2f} GB) indexed in {time.time() - t0:.0f} s, '
+              f'{len(tasks)} output files')
+        if missing:
+            print(f'  not in the inputs: {", ".join(missing)}')
+
+    jobs = {}
+    for task in tasks:
+        jobs.setdefault((task['key'], tuple(task['files'])), []).append(task)
+    results = []
+    if jobs:
+        with multiprocessing.get_context('fork').Pool(max(1, min(nprocs, len(jobs)))) as pool:
+            for res in pool.imap_unordered(merge_job, [(j, cfg, options) for j in jobs.values()]):
+                results += res
+                for name, status, n, values, size, secs in res if verbose else ():
+                    print(f'  {name}: {status}, {n} records' +
+                          (f', {size / 2**20:.1f} MB ({secs:.1f} s)' if status == 'ok' else ''))
+    if verbose:
+        ok = [r for r in results if r[1] == 'ok']
+        sec = time.time() - t0
+        values, size = sum(r[3] for r in ok), sum(r[4] for r in ok)
+        raw = values * (8 if float64 else 4)
+        print(f'{len(ok)}/{len(results)} files written in {sec:.0f} s: {sum(r[2] for r in ok)} records, '
+              f'{raw / 2**20:.0f} MB of values -> {size / 2**20:.0f} MB '
+              f'({raw / 2**20 / max(sec, 1e-9):.0f} MB/s, {nbytes / 2**20 / max(sec, 1e-9):.0f} MB/s of input)')
+        for name, status, *_ in results:
+            if status not in ('ok', 'exists'):
+                print(f'  ✗ {name}: {status}')
+    return results
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='merge downloaded forcing files into the files read by colm.x')
+    parser.add_argument('nml', help='forcing namelist of the product (run/forcing/*.nml)')
+    parser.add_argument('inputs', nargs='+', help='input files or glob patterns')
+    parser.add_argument('--out', required=True, help='output directory (DEF_dir_forcing)')
+    parser.add_argument('--years', type=int, nargs=2, default=None, metavar=('Y0', 'Y1'))
+    parser.add_argument('--vars', nargs='+', default=None, help='vnames merged (default: all found)')
+    parser.add_argument('--source', nargs='+', default=[], metavar='VNAME=SRC[+SRC]',
+                        help='input variables of a vname (renamed or summed)')
+    parser.add_argument('--name', default=None, help='file name template: {prefix} {year} {month} {suffix}')
+    parser.add_argument('--codec', default='zlib', choices=['zlib', 'zstd', 'none'])
+    parser.add_argument('--level', type=int, default=4, help='compression level')
+    parser.add_argument('--steps', type=int, default=1, help='records per chunk')
+    parser.add_argument('--float64', action='store_true', help='write float64 values (default: float32)')
+    parser.add_argument('--flip-lat', action='store_true', help='reverse the latitude axis (cdo invertlat)')
+    parser.add_argument('--overwrite', action='store_true', help='rewrite the outputs already there')
+    parser.add_argument('--allow-gaps', action='store_true', help='write incomplete years / months')
+    parser.add_argument('--nprocs', type=int, default=4)
+    args = parser.parse_args()
+
+    merge(args.nml, args.inputs, args.out, args.years, args.vars, args.source, args.name, args.codec,
+          args.level, args.steps, args.float64, args.flip_lat, args.overwrite, args.allow_gaps, args.nprocs)
@@ -0,0 +1,460 @@
+'''
+Point forcing of sites extracted from a gridded forcing product in one sweep
+
+The urban sites run with DEF_forcing%dataset = 'POINT': one file per site holding the whole
+period on one time axis.  extract makes these files for any number of sites from a gridded
+product described by its forcing namelist (run/forcing/{ERA5,ERA5LAND,CRUJRA,MSWX,...}.nml):
+
+    files       every file of every variable (DEF_dir_forcing/fprefix*, of the years asked)
+                is opened once, over a pool of processes, and the cells around all the sites
+                are read at once (one orthogonal read of the rows x columns used)
+    weights     nearest cell or bilinear weights of every site, computed once per grid;
+                missing cells (coasts) are left out and the other weights rescaled
+    time        the records are dated as colm.x dates them (groupby, dtime, offset, leapyear:
+                Feb 29 of a no-leap product is Feb 28 again) and put on one axis of step
+                --dt (default: the smallest dtime), records at multiples of dt (+ --offset):
+                instant variables are interpolated linearly, forward / backward ones
+                (averages over the record) are averaged conservatively over the new steps
+    units       the conversions of colm.x for the dataset (metpreprocess: precipitation to
+                kg/m2/s, MSWX temperature to K, ...); wind speed from the u and v components
+
+and writes for every site, with the variable names, units and timelog of run/forcing/POINT.nml
+
+    OUT/{site}_{dataset}_{y0}-{y1}_Met.nc       Tair Qair Psurf Precip Wind SWdown LWdown
+                                                (+ Rainf / Snowf for the urban model)
+    OUT/{site}_{dataset}.nml                    POINT.nml for this file, with the reference
+                                                heights of the product
+
+The sites are a csv table with the columns site, lat, lon.
+
+Usage:
+    python point_extract.py FORCING_NML SITES_CSV --years Y0 Y1 [--dir DIR] [--out DIR]
+                            [--method nearest|bilinear] [--dt SEC] [--nprocs N]
+
+Oct 2026
+'''
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import re
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../run'))
+import site_namelist
+
+
+POINT_NML = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../run/forcing/POINT.nml')
+UNITS = {
+    'Tair'  : ('K', 'Near surface air temperature'),
+    'Qair'  : ('kg/kg', 'Near surface specific humidity'),
+    'Psurf' : ('Pa', 'Surface air pressure'),
+    'Precip': ('kg/m2/s', 'Precipitation rate'),
+    'Rainf' : ('kg/m2/s', 'Rainfall rate'),
+    'Snowf' : ('kg/m2/s', 'Snowfall rate'),
+    'Wind'  : ('m/s', 'Near surface wind speed'),
+    'SWdown': ('W/m2', 'Downward shortwave radiation'),
+    'LWdown': ('W/m2', 'Downward longwave radiation'),
+}
+# unit conversions of colm.x (metpreprocess): dataset: {variable number: (scale, add)}
+CONVERT = {
+    'ERA5LAND': {4: (1000. / 3600., 0.)},
+    'MSWX'    : {1: (1., 273.15), 4: (1. / 10800., 0.)},
+    'CLDAS'   : {4: (1. / 3600., 0.)},
+    'CMFD'    : {4: (1. / 3600., 0.)},
+    'TPMFD'   : {3: (100., 0.), 4: (1. / 3600., 0.)},
+    'CRUJRA'  : {4: (1. / 21600., 0.), 7: (1. / 21600., 0.)},
+    'JRA55'   : {4: (1. / 86400., 0.)},
+}
+NONNEGATIVE = (4, 7)                    # precipitation, shortwave
+STEFNC = 5.67e-8
+EPOCH  = np.datetime64('1900-01-01T00:00:00', 's')
+YEAR_IN_NAME = re.compile(r'(?<!\d)(1[89]\d\d|2[01]\d\d)(?!\d)')
+
+_weights = {}
+
+
+
+def read_forcing_nml(path):
+    '''
+    Settings of a forcing namelist, lists of the variables 1 to NVAR
+    '''
+    v = site_namelist.lower_keys(site_namelist.read_namelist(path))
+    f = 'def_forcing%'
+    nvar = int(v.get(f + 'nvar', 8))
+
+    def listed(key, default):
+        value = v.get(f + key, default)
+        value = value if isinstance(value, list) else [value] * nvar
+        return (value + [default] * nvar)[:nvar]
+
+    return {
+        'dataset': str(v.get(f + 'dataset', '')).strip(), 'dir': str(v.get('def_dir_forcing', '')),
+        'nvar': nvar, 'dtime': [int(x) for x in listed('dtime', 3600)],
+        'offset': [int(x) for x in listed('offset', 0)],
+        'leapyear': v.get(f + 'leapyear', True), 'groupby': str(v.get(f + 'groupby', 'month')).lower(),
+        'data2d': v.get(f + 'data2d', True), 'dim2d': v.get(f + 'dim2d', False),
+        'latname': v.get(f + 'latname', 'lat'), 'lonname': v.get(f + 'lonname', 'lon'),
+        'missing': v.get(f + 'missing_value_name', 'missing_value') if v.get(f + 'has_missing_value') else None,
+        'fprefix': [str(v.get(f'{f}fprefix({i + 1})', 'NULL')) for i in range(nvar)],
+        'vname': [str(x) for x in listed('vname', 'NULL')],
+        'timelog': [str(x).lower() for x in listed('timelog', 'instant')],
+        'heights': {k: v[f + k] for k in ('height_v', 'height_t', 'height_q', 'height_mode') if f + k in v},
+    }
+
+
+def read_sites(path):
+    '''
+    [(site, lat, lon)] of a csv table with the columns site, lat, lon
+    '''
+    with open(path, newline='') as f:
+        rows = [{k.strip().lower(): x.strip() for k, x in row.items()} for row in csv.DictReader(f)]
+    return [(r.get('site') or r.get('name'), float(r.get('lat', r.get('latitude'))),
+             float(r.get('lon', r.get('longitude')))) for r in rows]
+
+
+def forcing_files(cfg, years, root=None):
+    '''
+    {variable number: paths} of the files of the variables, restricted to the years when
+    their names hold one
+    '''
+    root = root or cfg['dir']
+    files = {}
+    for i, (prefix, name) in enumerate(zip(cfg['fprefix'], cfg['vname'])):
+        if name == 'NULL' or prefix == 'NULL':
+            continue
+        paths = []
+        for path in sorted(glob.glob(os.path.join(root, prefix + '*'))):
+            found = YEAR_IN_NAME.findall(os.path.basename(path))
+            if not path.endswith(('.nc', '.nc4')) or (found and not years[0] <= int(found[0]) <= years[1]):
+                continue
+            paths.append(path)
+        files[i] = paths
+    return files
+
+
+def grid_weights(lat, lon, sites, method='nearest'):
+    '''
+    Rows, columns and weights (site, corner) of the sites on a grid of 1-D lat / lon
+    '''
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    glob_lon = lon.max() - lon.min() + abs(np.diff(lon).mean() if len(lon) > 1 else 0) >= 359.
+    ys = np.array([s[1] for s in sites])
+    xs = np.array([s[2] for s in sites])
+    xs = xs % 360. if lon.max() > 180. else (xs + 180.) % 360. - 180.     # longitudes of the grid
+    if method == 'nearest':
+        iy = np.abs(lat[None, :] - ys[:, None]).argmin(axis=1)
+        dx = np.abs(lon[None, :] - xs[:, None])
+        ix = np.minimum(dx, 360. - dx).argmin(axis=1) if glob_lon else dx.argmin(axis=1)
+        return iy[:, None], ix[:, None], np.ones((len(sites), 1))
+
+    ay = np.argsort(lat)
+    la = lat[ay]
+    j  = np.clip(np.searchsorted(la, ys) - 1, 0, len(la) - 2)
+    fy = np.clip((ys - la[j]) / (la[j + 1] - la[j]), 0., 1.)
+    ax = np.argsort(lon)
+    lo = lon[ax]
+    if glob_lon:                          # periodic: the first column again after the last
+        lo, ax = np.r_[lo, lo[0] + 360.], np.r_[ax, ax[0]]
+        xs = np.where(xs < lo[0], xs + 360., xs)
+    i  = np.clip(np.searchsorted(lo, xs) - 1, 0, len(lo) - 2)
+    fx = np.clip((xs - lo[i]) / (lo[i + 1] - lo[i]), 0., 1.)
+    iy = np.stack([ay[j], ay[j], ay[j + 1], ay[j + 1]], axis=1)
+    ix = np.stack([ax[i], ax[i + 1], ax[i], ax[i + 1]], axis=1)
+    w  = np.stack([(1 - fy) * (1 - fx), (1 - fy) * fx, fy * (1 - fx), fy * fx], axis=1)
+    return iy, ix, w
+
+
+def weights_of(ds, cfg, sites, method):
+    lat, lon = ds.variables[cfg['latname']][:], ds.variables[cfg['lonname']][:]
+    if np.ndim(lat) != 1 or np.ndim(lon) != 1:
+        raise ValueError('2-D lat / lon (dim2d) grids are not supported')
+    key = (len(lat), len(lon), float(lat[0]), float(lat[-1]), float(lon[0]), float(lon[-1]))
+    if key not in _weights:
+        _weights[key] = grid_weights(lat, lon, sites, method)
+    return _weights[key]
+
+
+def record_times(ds, tname, nrec, cfg, ivar):
+    '''
+    Dates (seconds since 1900) of the records of a file as colm.x dates them: group start
+    (first day of the month / year of the first time) + offset + k dtime
+    '''
+    import netCDF4 as nc
+    tvar  = ds.variables[tname if tname in ds.variables else 'time']
+    first = nc.num2date(tvar[0], tvar.units, getattr(tvar, 'calendar', 'standard'))
+    month = 1 if cfg['groupby'] == 'year' else first.month
+    start = np.datetime64(f'{first.year:04d}-{month:02d}-01T00:00:00', 's')
+    sec   = cfg['offset'][ivar] + np.arange(nrec, dtype=np.int64) * cfg['dtime'][ivar]
+    index = np.arange(nrec)
+    leap  = first.year % 4 == 0 and (first.year % 100 != 0 or first.year % 400 == 0)
+    if not cfg['leapyear'] and leap and (cfg['groupby'] == 'year' or month == 2):
+        # no Feb 29 in the product: colm.x uses Feb 28 again
+        feb28 = (58 if month == 1 else 27) * 86400
+        dup   = np.flatnonzero((sec >= feb28) & (sec < feb28 + 86400))
+        sec   = np.where(sec >= feb28 + 86400, sec + 86400, sec)
+        sec, index = np.r_[sec, sec[dup] + 86400], np.r_[index, dup]
+    order = np.argsort(sec, kind='stable')
+    return (start - EPOCH).astype(np.int64) + sec[order], index[order]
+
+
+def read_file(task):
+    '''
+    (variable number, record dates, values (site, record)) of one file, None without the variable
+    '''
+    import netCDF4 as nc
+    ivar, path, cfg, sites, method = task
+    name = cfg['vname'][ivar]
+    with nc.Dataset(path) as ds:
+        if name not in ds.variables:
+            return None
+        var = ds.variables[name]
+        var.set_auto_maskandscale(False)
+        iy, ix, w = weights_of(ds, cfg, sites, method)
+        rows, cols = np.unique(iy), np.unique(ix)
+        key = []
+        for k, dim in enumerate(var.dimensions):
+            if dim == cfg['latname']:
+                key.append(rows)
+            elif dim == cfg['lonname']:
+                key.append(cols)
+            else:
+                key.append(slice(None) if k == 0 else 0)      # time, z dimension (hightdim)
+        block = np.asarray(var[tuple(key)], dtype=np.float64)
+        # dimensions kept in the order of var: time first, then lat / lon in their order
+        kept  = [d for d, k in zip(var.dimensions, key) if not isinstance(k, (int, np.integer))]
+        block = block.transpose([kept.index(var.dimensions[0]), kept.index(cfg['latname']),
+                                 kept.index(cfg['lonname'])])
+        fills = [getattr(var, a) for a in (cfg['missing'], '_FillValue', 'missing_value') if a and hasattr(var, a)]
+        for fill in fills:
+            block[block == np.asarray(fill).ravel()[0]] = np.nan
+        block[np.abs(block) >= 1.e30] = np.nan
+        block = block * getattr(var, 'scale_factor', 1.) + getattr(var, 'add_offset', 0.)
+        times, index = record_times(ds, var.dimensions[0], block.shape[0], cfg, ivar)
+
+    vals = block[:, np.searchsorted(rows, iy), np.searchsorted(cols, ix)]      # (time, site, corner)
+    wt   = np.where(np.isnan(vals), 0., w[None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = np.nansum(vals * wt, axis=2) / wt.sum(axis=2)
+    return ivar, times, out.T[:, index].astype(np.float32)
+
+
+def merge_records(parts):
+    '''
+    Record dates and values (site, record) of the files of one variable, sorted, the first
+    file holding a date wins
+    '''
+    times  = np.concatenate([p[0] for p in parts])
+    values = np.concatenate([p[1] for p in parts], axis=1)
+    order  = np.argsort(times, kind='stable')
+    keep   = np.ones(len(order), dtype=bool)
+    keep[1:] = np.diff(times[order]) != 0
+    return times[order][keep], values[:, order[keep]]
+
+
+def coverage(times, dtime, timelog):
+    '''
+    Period (start, end) covered by the records
+    '''
+    if timelog == 'instant':
+        return times[0], times[-1]
+    shift = -dtime if timelog == 'backward' else 0
+    return times[0] + shift, times[-1] + shift + dtime
+
+
+def resample(times, values, dtime, src, dst, axis, dt):
+    '''
+    Values (site, axis) of records of timelog src as timelog dst on the axis of step dt
+    '''
+    out = np.full((values.shape[0], len(axis)), np.nan)
+    if src == 'instant':
+        at = axis + (dt / 2. if dst != 'instant' else 0.)
+        for s in range(values.shape[0]):
+            out[s] = np.interp(at, times, values[s], left=np.nan, right=np.nan)
+        return out
+
+    # averages over [start, start + dtime): on a regular grid of the records, gaps as NaN
+    start = times - (dtime if src == 'backward' else 0)
+    n     = int((start[-1] - start[0]) // dtime) + 1
+    full  = np.full((values.shape[0], n), np.nan)
+    full[:, (start - start[0]) // dtime] = values
+    if dst == 'instant':
+        k  = np.clip((axis - start[0]) // dtime, -1, n).astype(np.int64)
+        ok = (k >= 0) & (k < n)
+        out[:, ok] = full[:, k[ok]]
+        return out
+    edges = start[0] + np.arange(n + 1, dtype=np.float64) * dtime
+    valid = ~np.isnan(full)
+    cumv  = np.concatenate([np.zeros((len(full), 1)), np.cumsum(np.where(valid, full, 0.) * dtime, axis=1)], axis=1)
+    cumm  = np.concatenate([np.zeros((len(full), 1)), np.cumsum(valid * float(dtime), axis=1)], axis=1)
+    for s in range(len(full)):
+        v = np.interp(axis + dt, edges, cumv[s]) - np.interp(axis, edges, cumv[s])
+        m = np.interp(axis + dt, edges, cumm[s]) - np.interp(axis, edges, cumm[s])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[s] = np.where(m >= dt / 2., v / m, np.nan)
+    out[:, (axis < edges[0]) | (axis + dt > edges[-1])] = np.nan
+    return out
+
+
+def time_axis(records, cfg, point_log, years, dt, offset=0):
+    '''
+    Common axis (seconds since 1900) of the variables inside the years asked
+    '''
+    lo = (np.datetime64(f'{years[0]:04d}-01-01T00:00:00', 's') - EPOCH).astype(np.int64)
+    hi = (np.datetime64(f'{years[1] + 1:04d}-01-01T00:00:00', 's') - EPOCH).astype(np.int64)
+    for i, (times, _) in records.items():
+        start, end = coverage(times, cfg['dtime'][i], cfg['timelog'][i])
+        lo = max(lo, start)
+        hi = min(hi, end - (dt if point_log[i] != 'instant' else 0) + 1)
+    first = -(-(lo - offset) // dt) * dt + offset
+    return np.arange(first, hi, dt, dtype=np.int64)
+
+
+def point_variables(records, cfg, point, axis, dt):
+    '''
+    {POINT name: values (site, axis)} of the records in the units of colm.x
+    '''
+    data = {}
+    conv = CONVERT.get(cfg['dataset'], {})
+    for i, (times, values) in records.items():
+        scale, add = conv.get(i + 1, (1., 0.))
+        vals = resample(times, values.astype(np.float64) * scale + add, cfg['dtime'][i], cfg['timelog'][i],
+                        point['timelog'][i], axis, dt)
+        if i + 1 in NONNEGATIVE:
+            vals = np.maximum(vals, 0.)
+        data[i] = vals
+    if cfg['dataset'] == 'QIAN' and all(k in data for k in (0, 1, 2)):
+        t, q, p = data[0], data[1], data[2]
+        e  = p * q / (0.622 + 0.378 * q)
+        data[7] = (0.70 + 5.95e-05 * 0.01 * e * np.exp(1500. / t)) * STEFNC * t ** 4
+
+    out = {}
+    for i, name in enumerate(point['vname']):
+        if name == 'NULL' or name == 'Wind':
+            continue
+        if i in data:
+            out[name] = data[i]
+    winds = [data[i] for i in (4, 5) if i in data]
+    if winds:
+        out['Wind'] = np.sqrt(sum(w ** 2 for w in winds))
+    if 'Precip' in out:
+        out['Rainf'] = out['Precip']
+        out['Snowf'] = np.zeros_like(out['Precip'])
+    return out
+
+
+def write_site(path, site, cfg, method, axis, data, s):
+    import netCDF4 as nc
+    day  = EPOCH + np.timedelta64(int(axis[0] // 86400 * 86400), 's')
+    ref  = str(day).replace('T', ' ')
+    tmp  = f'{path}.{os.getpid()}.tmp'
+    with nc.Dataset(tmp, 'w', format='NETCDF4') as ds:
+        ds.createDimension('time', len(axis))
+        ds.createDimension('y', 1)
+        ds.createDimension('x', 1)
+        t = ds.createVariable('time', 'f8', ('time',))
+        t.units, t.calendar = f'seconds since {ref}', 'standard'
+        t[:] = axis - (day - EPOCH).astype(np.int64)
+        for name, (coord, value) in {'latitude': ('degrees_north', site[1]),
+                                     'longitude': ('degrees_east', site[2])}.items():
+            v = ds.createVariable(name, 'f4', ('y', 'x'))
+            v.units = coord
+            v[:] = value
+        for name in [n for n in UNITS if n in data]:
+            v = ds.createVariable(name, 'f4', ('time', 'y', 'x'), zlib=True, complevel=4,
+                                  chunksizes=(len(axis), 1, 1))
+            v.units, v.long_name = UNITS[name]
+            v[:] = data[name][s][:, None, None]
+        ds.site = site[0]
+        ds.source = f'{cfg["dataset"]} ({method}), point_extract.py'
+    os.replace(tmp, path)
+
+
+def write_namelist(path, forcing, cfg, point, point_text, axis):
+    first = EPOCH + np.timedelta64(int(axis[0]), 's')
+    last  = EPOCH + np.timedelta64(int(axis[-1]), 's')
+    f = 'DEF_forcing%'
+    updates = {'DEF_dir_forcing': os.path.dirname(os.path.abspath(forcing)) + '/',
+               f + 'startyr': int(str(first)[:4]), f + 'startmo': int(str(first)[5:7]),
+               f + 'endyr': int(str(last)[:4]), f + 'endmo': int(str(last)[5:7])}
+    updates.update({f'{f}fprefix({i + 1})': os.path.basename(forcing) for i in range(point['nvar'])})
+    updates.update({f + k.upper() if k != 'height_mode' else f + 'HEIGHT_mode': v for k, v in cfg['heights'].items()})
+    with open(path, 'w') as fo:
+        fo.write(site_namelist.render(point_text, updates))
+
+
+def extract(nml, sites, years, out, root=None, method='nearest', dt=None, offset=0, nprocs=4, verbose=True):
+    '''
+    Point forcing files of the sites from the product of a forcing namelist; returns their paths
+    '''
+    cfg = read_forcing_nml(nml)
+    if not cfg['data2d'] or cfg['dim2d']:
+        raise SystemExit(f'{cfg["dataset"]}: only products on a 2-D grid of 1-D lat / lon are supported')
+    with open(POINT_NML) as f:
+        point_text = f.read()
+    point = read_forcing_nml(POINT_NML)
+    files = forcing_files(cfg, years, root)
+    missing = [cfg['vname'][i] for i, paths in files.items() if not paths]
+    if missing:
+        raise SystemExit(f'no file found for {", ".join(missing)} in {root or cfg["dir"]}')
+
+    # weights of the sites on the grid of the first file, before the workers start
+    import netCDF4 as nc
+    for paths in files.values():
+        with nc.Dataset(paths[0]) as ds:
+            weights_of(ds, cfg, sites, method)
+    tasks = [(i, p, cfg, sites, method) for i, paths in files.items() for p in paths]
+
+    t0, nbytes, parts = time.time(), 0, {i: [] for i in files}
+    with multiprocessing.get_context('fork').Pool(max(1, min(nprocs, len(tasks)))) as pool:
+        for k, res in enumerate(pool.imap_unordered(read_file, tasks)):
+            if res is not None:
+                parts[res[0]].append(res[1:])
+            if verbose and (k + 1) % 50 == 0:
+                print(f'  {k + 1}/{len(tasks)} files read ({time.time() - t0:.0f} s)')
+    nbytes = sum(os.path.getsize(t[1]) for t in tasks)
+    records = {i: merge_records(p) for i, p in parts.items() if p}
+
+    dt = dt or min(cfg['dtime'][i] for i in records)
+    axis = time_axis(records, cfg, point['timelog'], years, dt, offset)
+    if not len(axis):
+        raise SystemExit('the variables have no common period in the years asked')
+    data = point_variables(records, cfg, point, axis, dt)
+
+    os.makedirs(out, exist_ok=True)
+    y0, y1 = str(EPOCH + np.timedelta64(int(axis[0]), 's'))[:4], str(EPOCH + np.timedelta64(int(axis[-1]), 's'))[:4]
+    written = []
+    for s, site in enumerate(sites):
+        path = os.path.join(out, f'{site[0]}_{cfg["dataset"]}_{y0}-{y1}_Met.nc')
+        write_site(path, site, cfg, method, axis, data, s)
+        write_namelist(os.path.join(out, f'{site[0]}_{cfg["dataset"]}.nml'), path, cfg, point, point_text, axis)
+        written.append(path)
+        gaps = {n: int(np.isnan(v[s]).sum()) for n, v in data.items() if np.isnan(v[s]).any()}
+        if verbose and gaps:
+            print(f'  ✗ {site[0]}: missing values {gaps}')
+    if verbose:
+        sec = time.time() - t0
+        print(f'{len(tasks)} files ({nbytes / 2**30:.2f} GB) read once for {len(sites)} sites, '
+              f'{len(axis)} steps of {dt} s, in {sec:.0f} s ({nbytes / 2**20 / max(sec, 1e-9):.0f} MB/s)')
+    return written
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='point forcing of sites from a gridded forcing product')
+    parser.add_argument('nml', help='forcing namelist of the product (run/forcing/*.nml)')
+    parser.add_argument('sites', help='csv table of the sites: site, lat, lon')
+    parser.add_argument('--years', type=int, nargs=2, required=True, metavar=('Y0', 'Y1'))
+    parser.add_argument('--dir', default=None, help='forcing directory (default: DEF_dir_forcing)')
+    parser.add_argument('--out', default='point_forcing', help='output directory')
+    parser.add_argument('--method', default='nearest', choices=['nearest', 'bilinear'])
+    parser.add_argument('--dt', type=int, default=None, help='time step of the output (s, default: smallest dtime)')
+    parser.add_argument('--offset', type=int, default=0, help='offset of the output steps (s)')
+    parser.add_argument('--nprocs', type=int, default=4)
+    args = parser.parse_args()
+
+    extract(args.nml, read_sites(args.sites), args.years, args.out, args.dir, args.method, args.dt,
+            args.offset, args.nprocs)
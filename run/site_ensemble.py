@@ -0,0 +1,461 @@
+'''
+Parallel ensemble runner of the site cases (run/ISA_compare)
+
+Urban_site_run.sh starts mksrfdata.x, mkinidata.x and colm.x of every Site_*.nml at once in
+the background, so colm.x may start before its surface and initial data exist and all the
+cases compete for the cores.  Here every case is a chain
+
+    mksrf (mksrfdata.x)  ->  mkini (mkinidata.x)  ->  colm (colm.x)
+
+and the chains are scheduled over a bounded pool of workers (one per core by default), each
+running one stage at a time.  The output of every stage goes to the log of Urban_site_run.sh
+(log_{nml}, log_mkin_{nml}, log_run_{nml} next to the namelist).  CoLM_stop ends with a
+plain STOP, whose exit code is 0, so a stage succeeds only with exit code 0 and its
+completion message in the log; a failed stage is run again up to --retries times, then the
+rest of its chain is skipped and the other cases go on.  With --skip-done a stage whose log
+already holds its completion message is not run again.  With --prep-cache the products of
+mksrfdata and mkinidata are taken from the content-addressed cache of site_prepcache when
+their inputs did not change (the two stages are then reported as cached), and the products
+of the cases that miss it are kept there.
+
+With --resume a case that was interrupted goes on from its latest valid restart in
+output/{case}/restart (all the restart files of the date present and readable, and the
+history before the date on disk: with USE_SITE_HistWriteBack a history file is written only
+when it is complete, so such a case goes on from the start of its unfinished file) instead
+of from the start: colm.x runs a derived namelist resume_{nml} starting at that date, and the
+history file holding the restart date, which colm.x creates anew, is stitched with the
+records written before that date by the interrupted run, so the history is the one of an
+uninterrupted run.  mksrfdata and mkinidata are not run again for such a case
+(site_resume_check.py checks this path with a fake colm.x).
+
+With --generate the namelists of the cases are first written from the case matrix
+(ISA_compare/base.nml and matrix.json, see site_namelist), restricted to --sites and
+--products, so a new site or impervious product is run by adding it to the matrix.
+
+At the end a report gives, per case, the status, the wall time of every stage and the
+throughput of colm.x in simulated years per hour (the simulated period, spin-up repeats
+included, over the colm.x wall time); it is also written as ensemble_report.csv.
+
+Usage:
+    python site_ensemble.py [NML ...] [--bin DIR] [--nprocs N] [--retries N] [--skip-done]
+    python site_ensemble.py --resume [NML ...]
+    python site_ensemble.py --generate [--sites SITE ...] [--products GAIA ...]
+
+Oct 2026
+'''
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import glob
+import os
+import re
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+import site_namelist
+import site_prepcache
+
+
+# stage, executable, log name, completion message
+STAGES = (
+    ('mksrf', 'mksrfdata.x', 'log_{nml}',      'Successful in surface data making'),
+    ('mkini', 'mkinidata.x', 'log_mkin_{nml}', 'CoLM Initialization Execution Completed'),
+    ('colm',  'colm.x',      'log_run_{nml}',  'CoLM Execution Completed'),
+)
+ERROR_MARKERS = ('forrtl: severe', 'Segmentation fault', 'Program received signal', 'ERROR')
+REPORT_FILE = 'ensemble_report.csv'
+# history file name of DEF_HIST_groupby
+HIST_GROUPS = {'YEAR': '%Y', 'MONTH': '%Y-%m', 'DAY': '%Y-%m-%d'}
+# longest interval (minutes) between two records of DEF_HIST_FREQ
+HIST_PERIODS = {'HOURLY': 60, 'DAILY': 1440, 'MONTHLY': 31 * 1440, 'YEARLY': 366 * 1440}
+
+_print_lock = threading.Lock()
+
+
+
+def log(msg):
+    with _print_lock:
+        print(msg, flush=True)
+
+
+def read_nml_values(path):
+    '''
+    {key: value} of a namelist file, keys in lower case
+    '''
+    return site_namelist.lower_keys(site_namelist.read_namelist(path))
+
+
+def simulated_years(values):
+    '''
+    Years simulated by colm.x: start to end, plus the spin-up period for every extra repeat
+    '''
+    def stamp(kind):
+        t = 'def_simulation_time%' + kind
+        try:
+            return datetime.datetime(int(values[t + '_year']), int(values[t + '_month']),
+                                     int(values[t + '_day'])) + \
+                   datetime.timedelta(seconds=float(values[t + '_sec']))
+        except (KeyError, ValueError):
+            return None
+    start, end, spinup = stamp('start'), stamp('end'), stamp('spinup')
+    if start is None or end is None:
+        return None
+    days = (end - start).total_seconds() / 86400
+    repeat = int(values.get('def_simulation_time%spinup_repeat', 0) or 0)
+    if spinup is not None and repeat > 1:
+        days += (spinup - start).total_seconds() / 86400 * (repeat - 1)
+    return days / 365.25
+
+
+def restart_date(values, kind='start'):
+    '''
+    Restart directory name (yyyy-ddd-sssss) of the start, end or spinup time of a case
+    '''
+    t = 'def_simulation_time%' + kind
+    day = datetime.date(int(values[t + '_year']), int(values[t + '_month']), int(values[t + '_day']))
+    sec = int(values[t + '_sec'])
+    if sec == 86400:                    # adj2begin
+        day, sec = day + datetime.timedelta(days=1), 0
+    return f'{day.year:04d}-{day.timetuple().tm_yday:03d}-{sec:05d}'
+
+
+def date_of(cdate):
+    year, day, sec = map(int, cdate.split('-'))
+    return datetime.datetime(year, 1, 1) + datetime.timedelta(days=day - 1, seconds=sec)
+
+
+def valid_restart(restart, cdate, kinds):
+    '''
+    True if the restart files of a date are all readable and hold every kind of kinds
+    (file names with the date left out)
+    '''
+    import netCDF4 as nc
+
+    files = glob.glob(os.path.join(restart, cdate, '*.nc'))
+    if not files or not kinds <= {os.path.basename(f).replace(cdate, '') for f in files}:
+        return False
+    try:
+        for path in files:
+            with nc.Dataset(path) as ds:
+                for var in ds.variables.values():
+                    var[:]
+    except (OSError, RuntimeError, ValueError, IndexError):
+        return False
+    return True
+
+
+def latest_restart(nml, values):
+    '''
+    Date of the latest valid restart of a case between its start and end, None if there is
+    none (or the case repeats its spin-up, whose restarts cannot be placed)
+    '''
+    restart = os.path.join(site_prepcache.output_dir(nml, values), 'restart')
+    if int(values.get('def_simulation_time%spinup_repeat', 0) or 0) > 1 or not os.path.isdir(restart):
+        return None
+    start, end = restart_date(values, 'start'), restart_date(values, 'end')
+    # the restart files of every date are the kinds of the one of the start made by mkinidata
+    kinds = {os.path.basename(f).replace(start, '') for f in glob.glob(os.path.join(restart, start, '*.nc'))}
+    kinds = kinds or {f'{values.get("def_case_name", "")}_restart_'}
+    dates = [d for d in os.listdir(restart) if re.match(r'\d{4}-\d{3}-\d{5}$', d)
+             and date_of(start) < date_of(d) < date_of(end)]
+    for cdate in sorted(dates, key=date_of, reverse=True):
+        if valid_restart(restart, cdate, kinds) and history_before(nml, values, cdate):
+            return cdate
+    return None
+
+
+def resume_path(nml):
+    return os.path.join(os.path.dirname(os.path.abspath(nml)), 'resume_' + os.path.basename(nml))
+
+
+def resume_nml(nml, cdate):
+    '''
+    Derived namelist resume_{nml} of a case starting at the restart date cdate
+    '''
+    t, date = 'DEF_simulation_time%', date_of(cdate)
+    with open(nml) as f:
+        text = f.read()
+    path = resume_path(nml)
+    with open(path, 'w') as f:
+        f.write(site_namelist.render(text, {
+            t + 'start_year': date.year, t + 'start_month': date.month, t + 'start_day': date.day,
+            t + 'start_sec': date.hour * 3600 + date.minute * 60 + date.second, t + 'spinup_repeat': 0}))
+    return path
+
+
+def history_file(nml, values, cdate):
+    '''
+    History file of the first records after the restart date cdate
+    '''
+    fmt = HIST_GROUPS.get(str(values.get('def_hist_groupby', 'MONTH')).upper(), '%Y-%m')
+    name = f'{values.get("def_case_name", "")}_hist_{(date_of(cdate) + datetime.timedelta(seconds=1)).strftime(fmt)}.nc'
+    return os.path.join(site_prepcache.output_dir(nml, values), 'history', name)
+
+
+def history_before(nml, values, cdate):
+    '''
+    True if the history file holding the restart date cdate has the records up to it (or
+    cdate starts a new file)
+    '''
+    import netCDF4 as nc
+
+    fmt = HIST_GROUPS.get(str(values.get('def_hist_groupby', 'MONTH')).upper(), '%Y-%m')
+    date, second = date_of(cdate), datetime.timedelta(seconds=1)
+    if (date - second).strftime(fmt) != (date + second).strftime(fmt):
+        return True
+    cut = (date - datetime.datetime(1900, 1, 1)).total_seconds() / 60
+    period = HIST_PERIODS.get(str(values.get('def_hist_freq', 'HOURLY')).upper(), 60)
+    try:
+        with nc.Dataset(history_file(nml, values, cdate)) as ds:
+            times = np.asarray(ds['time'][:])
+    except (OSError, IndexError, KeyError):
+        return False
+    times = times[times < cut]
+    return len(times) > 0 and cut - times.max() <= period
+
+
+def stitch_history(old, path, cut):
+    '''
+    Put the records of old (history file of the interrupted run) before cut (minutes since
+    1900) in front of the ones of path (same file written by the resumed run)
+    '''
+    import netCDF4 as nc
+
+    tmp = path + '.stitch'
+    with nc.Dataset(old) as a, nc.Dataset(path) as b:
+        if 'time' not in a.variables or 'time' not in b.variables:
+            return 0
+        keep = np.flatnonzero(np.asarray(a['time'][:]) < cut)
+        if not len(keep):
+            return 0
+        with nc.Dataset(tmp, 'w', format=b.data_model) as out:
+            out.setncatts({k: b.getncattr(k) for k in b.ncattrs()})
+            for name, dim in b.dimensions.items():
+                out.createDimension(name, None if dim.isunlimited() else
+                                    len(dim) + len(keep) if name == 'time' else len(dim))
+            for name, var in b.variables.items():
+                attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+                v = out.createVariable(name, var.dtype, var.dimensions, fill_value=attrs.pop('_FillValue', None))
+                v.setncatts(attrs)
+                data = var[:]
+                if 'time' in var.dimensions and name in a.variables:
+                    axis = var.dimensions.index('time')
+                    data = np.ma.concatenate([a[name][:].take(keep, axis=axis), data], axis=axis)
+                v[:] = data
+    os.replace(tmp, path)
+    return len(keep)
+
+
+def run_resumed(nml, values, cdate, bin_dir, launcher=(), retries=0):
+    '''
+    colm stage of a case from the restart date cdate, its history stitched to the one of
+    the interrupted run
+    '''
+    hist = history_file(nml, values, cdate)
+    backup = hist + '.before_resume'
+    if os.path.exists(hist) and not os.path.exists(backup):
+        os.replace(hist, backup)
+    stage = run_stage(resume_nml(nml, cdate), 'colm', bin_dir, launcher, retries)
+    if os.path.exists(backup):
+        if stage['status'] == 'ok' and os.path.exists(hist):
+            cut = (date_of(cdate) - datetime.datetime(1900, 1, 1)).total_seconds() / 60
+            n = stitch_history(backup, hist, cut)
+            log(f'  {os.path.basename(nml)}: {n} records before {cdate} stitched to {os.path.basename(hist)}')
+            os.remove(backup)
+        elif stage['status'] != 'ok':
+            os.replace(backup, hist)     # keep the history of the interrupted run
+    return stage
+
+
+def log_path(nml, stage):
+    name = dict((s[0], s[2]) for s in STAGES)[stage]
+    return os.path.join(os.path.dirname(os.path.abspath(nml)), name.format(nml=os.path.basename(nml)))
+
+
+def check_log(path, marker):
+    '''
+    (completed, first error line) of a stage log
+    '''
+    completed, error = False, None
+    try:
+        with open(path, errors='replace') as f:
+            for line in f:
+                if marker in line:
+                    completed = True
+                elif error is None and any(m in line for m in ERROR_MARKERS):
+                    error = line.strip()
+    except OSError:
+        pass
+    return completed, error
+
+
+def run_stage(nml, stage, bin_dir, launcher=(), retries=0, skip_done=False):
+    '''
+    Run one stage of a case; returns {status, seconds, attempts, reason}
+    '''
+    exe, marker = {s[0]: (s[1], s[3]) for s in STAGES}[stage]
+    path = log_path(nml, stage)
+    done = [path] + ([log_path(resume_path(nml), stage)] if stage == 'colm' else [])
+    if skip_done and any(check_log(p, marker)[0] for p in done):
+        return {'status': 'done', 'seconds': 0.0, 'attempts': 0, 'reason': ''}
+    if stage in ('mksrf', 'mkini'):
+        # never write through the links of files taken from the prep cache
+        site_prepcache.unshare(site_prepcache.output_dir(nml, read_nml_values(nml)))
+
+    cmd = list(launcher) + [os.path.join(bin_dir, exe), os.path.basename(nml)]
+    t0 = time.time()
+    for attempt in range(1, retries + 2):
+        with open(path, 'w') as out:
+            proc = subprocess.run(cmd, stdout=out, stderr=subprocess.STDOUT,
+                                  cwd=os.path.dirname(os.path.abspath(nml)))
+        completed, error = check_log(path, marker)
+        if proc.returncode == 0 and completed:
+            return {'status': 'ok', 'seconds': time.time() - t0, 'attempts': attempt, 'reason': ''}
+        reason = error or (f'exit code {proc.returncode}' if proc.returncode else 'no completion message')
+        log(f'  ✗ {os.path.basename(nml)} {stage} (attempt {attempt}): {reason}')
+    return {'status': 'failed', 'seconds': time.time() - t0, 'attempts': retries + 1, 'reason': reason}
+
+
+def run_chain(nml, bin_dir, launcher=(), retries=0, skip_done=False, stages=None, prep_cache=None,
+              resume=False):
+    '''
+    Stages of one case in order; after a failure the next stages are skipped.  With
+    prep_cache (a directory, '' for the default one) mksrf and mkini are taken from the cache
+    of their products when possible; with resume an interrupted case goes on from its latest
+    restart
+    '''
+    values = read_nml_values(nml)
+    report = {'nml': os.path.basename(nml), 'case': values.get('def_case_name', ''),
+              'years': simulated_years(values)}
+    t0, failed = time.time(), False
+    key, since, cdate = None, None, None
+    if resume and (stages is None or 'colm' in stages) and \
+            not (skip_done and check_log(log_path(nml, 'colm'), STAGES[-1][3])[0]):
+        cdate = latest_restart(nml, values)
+    if cdate is not None:
+        for stage in ('mksrf', 'mkini'):
+            report[stage] = {'status': 'done', 'seconds': 0.0, 'attempts': 0, 'reason': ''}
+        report['resumed'] = cdate
+        report['years'] = (date_of(restart_date(values, 'end')) - date_of(cdate)).total_seconds() / 86400 / 365.25
+        log(f'  {os.path.basename(nml)}: resumed from the restart of {cdate}')
+    elif prep_cache is not None and (stages is None or {'mksrf', 'mkini'} <= set(stages)):
+        key = site_prepcache.fingerprint(nml, values, bin_dir)
+        nfiles = site_prepcache.restore(nml, values, key, prep_cache)
+        if nfiles:
+            for stage in ('mksrf', 'mkini'):
+                report[stage] = {'status': 'cached', 'seconds': 0.0, 'attempts': 0, 'reason': ''}
+            log(f'  {os.path.basename(nml)}: {nfiles} files of mksrfdata / mkinidata from the cache')
+            key = None
+    for stage, *_ in STAGES:
+        if stages is not None and stage not in stages or stage in report:
+            continue
+        if failed:
+            report[stage] = {'status': 'skipped', 'seconds': 0.0, 'attempts': 0, 'reason': ''}
+            continue
+        if stage == 'mkini':
+            since = time.time() - 1
+        if stage == 'colm' and cdate is not None:
+            report[stage] = run_resumed(nml, values, cdate, bin_dir, launcher, retries)
+        else:
+            report[stage] = run_stage(nml, stage, bin_dir, launcher, retries, skip_done)
+        failed = report[stage]['status'] == 'failed'
+        if key is not None and stage == 'mkini' and not failed and \
+                report['mksrf']['status'] == report['mkini']['status'] == 'ok':
+            site_prepcache.store(nml, values, key, prep_cache, since)
+    report['status'] = 'failed' if failed else 'ok'
+    report['seconds'] = time.time() - t0
+    return report
+
+
+def run_ensemble(nmls, bin_dir, nprocs=None, retries=0, skip_done=False, launcher=(), stages=None,
+                 prep_cache=None, resume=False):
+    '''
+    Run the chains of all the cases over nprocs workers; returns the case reports in order
+    '''
+    nprocs = max(1, min(nprocs or os.cpu_count() or 1, len(nmls) or 1))
+    log(f'{len(nmls)} cases on {nprocs} workers')
+    reports = {}
+    with concurrent.futures.ThreadPoolExecutor(nprocs) as pool:
+        futures = {pool.submit(run_chain, nml, bin_dir, launcher, retries, skip_done, stages, prep_cache, resume): nml
+                   for nml in nmls}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            rep = future.result()
+            reports[futures[future]] = rep
+            log(f'[{done}/{len(nmls)}] {rep["nml"]}: {rep["status"]} ({rep["seconds"]:.0f} s)')
+    return [reports[nml] for nml in nmls]
+
+
+def throughput(report):
+    '''
+    Simulated years per hour of colm.x
+    '''
+    colm = report.get('colm', {})
+    if report.get('years') is None or colm.get('status') != 'ok' or not colm.get('seconds'):
+        return None
+    return report['years'] / (colm['seconds'] / 3600)
+
+
+def write_report(reports, path):
+    stages = [s[0] for s in STAGES]
+    with open(path, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['nml', 'case', 'status'] + [f'{s}_{k}' for s in stages for k in ('status', 'seconds')] +
+                   ['seconds', 'simulated_years', 'years_per_hour', 'resumed_from', 'reason'])
+        for rep in reports:
+            reason = next((rep[s]['reason'] for s in stages if s in rep and rep[s]['reason']), '')
+            w.writerow([rep['nml'], rep['case'], rep['status']] +
+                       [x for s in stages for x in ((rep[s]['status'], f'{rep[s]["seconds"]:.1f}')
+                                                    if s in rep else ('', ''))] +
+                       [f'{rep["seconds"]:.1f}', '' if rep['years'] is None else f'{rep["years"]:.3f}',
+                        '' if throughput(rep) is None else f'{throughput(rep):.2f}', rep.get('resumed', ''), reason])
+
+
+def print_report(reports):
+    print(f'\n{"case":<40} {"status":<8} {"mksrf":>8} {"mkini":>8} {"colm":>9} {"yr/h":>8}')
+    for rep in reports:
+        secs = [('cached' if rep[s]['status'] == 'cached' else f'{rep[s]["seconds"]:.0f}s') if s in rep else '-'
+                for s in ('mksrf', 'mkini', 'colm')]
+        tput = throughput(rep)
+        print(f'{rep["case"] or rep["nml"]:<40} {rep["status"]:<8} {secs[0]:>8} {secs[1]:>8} {secs[2]:>9} '
+              f'{"-" if tput is None else f"{tput:.2f}":>8}')
+    nok = sum(r['status'] == 'ok' for r in reports)
+    print(f'{nok}/{len(reports)} cases completed')
+
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='run the site cases as mksrfdata -> mkinidata -> colm chains')
+    parser.add_argument('nmls', nargs='*', help='case namelists (default: ISA_compare/Site_*.nml)')
+    parser.add_argument('--bin', default=here, help='directory of mksrfdata.x, mkinidata.x and colm.x')
+    parser.add_argument('--nprocs', type=int, default=None, help='workers (default: number of cores)')
+    parser.add_argument('--retries', type=int, default=1, help='runs again of a failed stage')
+    parser.add_argument('--skip-done', action='store_true', help='skip the stages completed in their log')
+    parser.add_argument('--stages', nargs='+', default=None, choices=[s[0] for s in STAGES])
+    parser.add_argument('--launcher', default='', help='command prefix of the executables, e.g. "mpirun -np 1"')
+    parser.add_argument('--prep-cache', nargs='?', const='', default=None, metavar='DIR',
+                        help='reuse the mksrfdata / mkinidata products (default DIR: prep_cache in DEF_dir_output)')
+    parser.add_argument('--resume', action='store_true', help='go on from the latest restart of interrupted cases')
+    parser.add_argument('--generate', action='store_true', help='write the namelists from the case matrix first')
+    parser.add_argument('--sites', nargs='+', default=None, help='sites of the matrix to generate')
+    parser.add_argument('--products', nargs='+', default=None, help='products of the matrix to generate')
+    parser.add_argument('--report', default=None, help=f'report file (default: {REPORT_FILE} next to the namelists)')
+    args = parser.parse_args()
+
+    if args.generate:
+        nmls = site_namelist.generate(site_namelist.CASE_DIR, sites=args.sites, products=args.products)
+    else:
+        nmls = args.nmls or sorted(glob.glob(os.path.join(here, 'ISA_compare', 'Site_*.nml')))
+    nmls = [n for n in nmls if not os.path.basename(n).startswith(('log_', 'resume_'))]    # logs end in .nml too
+    if not nmls:
+        raise SystemExit('no case namelist found')
+    reports = run_ensemble(nmls, os.path.abspath(args.bin), args.nprocs, args.retries, args.skip_done,
+                           args.launcher.split(), args.stages, args.prep_cache, args.resume)
+    print_report(reports)
+    path = args.report or os.path.join(os.path.dirname(os.path.abspath(nmls[0])), REPORT_FILE)
+    write_report(reports, path)
+    print(f'report written to {path}')
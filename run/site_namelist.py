@@ -0,0 +1,369 @@
+'''
+Namelist generator of the site case matrix (run/ISA_compare)
+
+The Site_{site}{,_gaia,_gisa,_gisd,_wsf}.nml files of ISA_compare are full copies of one
+namelist that differ in a few keys.  They are generated here from
+
+    ISA_compare/base.nml        the common namelist (comments and layout are kept)
+    ISA_compare/matrix.json     the override table:
+        set         keys common to all cases that are templates, e.g. the forcing namelist
+        paths       directories used in the templates, e.g. the impervious input data
+                    {impervious}/{GAIA,GISA,GISD,WSF}/... and the site data {sitedata}/...
+        products    per product: nml file name and keys (DEF_CASE_NAME, SITE_fsitedata)
+        sites       per site: keys that differ from base.nml (simulation period, ...) and
+                    optionally nml_site / site_file when the file names differ from the site
+        cases       per "site/product": the remaining exceptions
+
+A case is base.nml updated with the keys of set, of its site, of its product, then of the case;
+null removes a key.  String values are templates of {site}, {nml_site}, {site_file},
+{product} and the paths.  Keys are namelist names as written, derived-type members included
+(DEF_simulation_time%start_year); the comparison is case-insensitive as in Fortran.
+
+parse_namelist is a real namelist parser (strings with quotes and '' escapes, logicals,
+integers, reals with d exponents, r*value repeats, arrays, several assignments per line,
+comments), used by site_ensemble to read the cases.
+
+Usage:
+    python site_namelist.py generate [--sites ...] [--products ...] [--out DIR]
+    python site_namelist.py check            # generated == existing Site_*.nml (values)
+    python site_namelist.py extract          # rebuild base.nml / matrix.json from Site_*.nml
+
+Oct 2026
+'''
+import argparse
+import collections
+import glob
+import json
+import os
+import re
+
+
+HERE      = os.path.dirname(os.path.abspath(__file__))
+CASE_DIR  = os.path.join(HERE, 'ISA_compare')
+BASE_FILE = 'base.nml'
+MATRIX_FILE = 'matrix.json'
+
+TOKEN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[^\s,=/]+|=|,|/")
+NUMBER_INT  = re.compile(r'[+-]?\d+$')
+NUMBER_REAL = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eEdD][+-]?\d+)?$')
+
+
+
+def strip_comment(line):
+    '''
+    Line without its ! comment (a ! inside quotes is kept)
+    '''
+    quote = None
+    for i, c in enumerate(line):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c == '!':
+            return line[:i]
+    return line
+
+
+def parse_value(token):
+    if token[0] in '\'"':
+        q = token[0]
+        return token[1:-1].replace(q + q, q)
+    low = token.lower()
+    if low in ('.true.', '.t.', 't', '.true', 'true'):
+        return True
+    if low in ('.false.', '.f.', 'f', '.false', 'false'):
+        return False
+    if NUMBER_INT.match(token):
+        return int(token)
+    if NUMBER_REAL.match(token):
+        return float(re.sub('[dD]', 'e', token))
+    return token
+
+
+def parse_namelist(text):
+    '''
+    {group: {key: value}} of the groups of a namelist text; keys keep their case, a value
+    is a scalar or a list for several values
+    '''
+    body = '\n'.join(strip_comment(line) for line in text.splitlines())
+    groups = collections.OrderedDict()
+    tokens = TOKEN.findall(body)
+    values, key, i = None, None, 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok.startswith('&') and values is None:
+            values, key = collections.OrderedDict(), None
+            groups[tok[1:]] = values
+        elif values is None or tok == ',':
+            pass
+        elif tok == '/' or tok.lower() in ('&end', '$end'):
+            for k, v in values.items():
+                values[k] = v[0] if len(v) == 1 else v
+            values = None
+        elif i + 1 < len(tokens) and tokens[i + 1] == '=':
+            key = tok
+            values[key] = []
+            i += 1
+        elif key is not None:
+            rep = re.match(r'(\d+)\*(.+)$', tok) if tok[0] not in '\'"' else None
+            if rep:
+                values[key].extend([parse_value(rep.group(2))] * int(rep.group(1)))
+            else:
+                values[key].append(parse_value(tok))
+        i += 1
+    return groups
+
+
+def read_namelist(path, group=None):
+    '''
+    {key: value} of one group (the first one by default) of a namelist file
+    '''
+    with open(path) as f:
+        groups = parse_namelist(f.read())
+    if not groups:
+        return collections.OrderedDict()
+    return groups[group] if group is not None else next(iter(groups.values()))
+
+
+def lower_keys(values):
+    return {k.lower(): v for k, v in values.items()}
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '.true.' if value else '.false.'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return ', '.join(format_value(v) for v in value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def render(text, updates):
+    '''
+    Namelist text with the values of updates ({key: value, None to remove}) replaced in
+    place; keys that are not in text are added before the end of the group
+    '''
+    todo = {k.lower(): (k, v) for k, v in updates.items()}
+    lines = []
+    for line in text.splitlines():
+        m = re.match(r'(\s*)([A-Za-z_][\w%()]*)(\s*=\s*)', line)
+        if m and m.group(2).lower() in todo:
+            name, value = todo.pop(m.group(2).lower())
+            if value is not None:
+                code = strip_comment(line)
+                comment = line[len(code):]
+                new = format_value(value)
+                if comment:     # keep the comment column
+                    old = code[m.end():]
+                    new = new.ljust(len(old)) if len(new) < len(old) else new + ' '
+                lines.append(f'{m.group(1)}{m.group(2)}{m.group(3)}{new}{comment}')
+            continue
+        if re.match(r'\s*/\s*$', line):
+            lines.extend(f' {name} = {format_value(value)}' for name, value in todo.values()
+                         if value is not None)
+            todo = {}
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def load_matrix(case_dir=CASE_DIR):
+    with open(os.path.join(case_dir, MATRIX_FILE)) as f:
+        matrix = json.load(f)
+    with open(os.path.join(case_dir, matrix.get('base', BASE_FILE))) as f:
+        base = f.read()
+    return base, matrix
+
+
+def case_updates(matrix, site, product):
+    '''
+    (nml file name, {key: value}) of one case of the matrix
+    '''
+    sinfo = matrix['sites'][site]
+    pinfo = matrix['products'][product]
+    fields = dict(matrix.get('paths', {}), site=site, product=product,
+                  nml_site=sinfo.get('nml_site', site), site_file=sinfo.get('site_file', site))
+    updates = collections.OrderedDict()
+    for layer in (matrix.get('set', {}), sinfo.get('set', {}), pinfo.get('set', {}),
+                  matrix.get('cases', {}).get(f'{site}/{product}', {}).get('set', {})):
+        for key, value in layer.items():
+            updates.pop(next((k for k in updates if k.lower() == key.lower()), key), None)
+            updates[key] = value.format_map(fields) if isinstance(value, str) else value
+    return pinfo['nml'].format_map(fields), updates
+
+
+def generate(case_dir=CASE_DIR, out_dir=None, sites=None, products=None):
+    '''
+    Write the namelists of the selected cases of the matrix (those of an existing file with
+    the same values are kept); returns their paths
+    '''
+    base, matrix = load_matrix(case_dir)
+    out_dir = out_dir or case_dir
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for site in matrix['sites']:
+        if sites is not None and site not in sites:
+            continue
+        for product in matrix['products']:
+            if products is not None and product not in products:
+                continue
+            name, updates = case_updates(matrix, site, product)
+            path = os.path.join(out_dir, name)
+            text = render(base, updates)
+            # an existing namelist with the same values is left as it is
+            new = lower_keys(next(iter(parse_namelist(text).values())))
+            if not os.path.exists(path) or lower_keys(read_namelist(path)) != new:
+                with open(path, 'w') as f:
+                    f.write(text)
+            paths.append(path)
+    return paths
+
+
+def check(case_dir=CASE_DIR):
+    '''
+    Cases whose generated values differ from the existing namelist: {nml: {key: (new, old)}}
+    '''
+    base, matrix = load_matrix(case_dir)
+    diffs = {}
+    for site in matrix['sites']:
+        for product in matrix['products']:
+            name, updates = case_updates(matrix, site, product)
+            new = lower_keys(next(iter(parse_namelist(render(base, updates)).values())))
+            path = os.path.join(case_dir, name)
+            old = lower_keys(read_namelist(path)) if os.path.exists(path) else {}
+            diff = {k: (new.get(k), old.get(k)) for k in set(new) | set(old) if new.get(k) != old.get(k)}
+            if diff:
+                diffs[name] = diff
+    return diffs
+
+
+def split_name(path, products):
+    '''
+    (nml_site, product) of Site_{nml_site}{suffix}.nml
+    '''
+    stem = os.path.basename(path)[len('Site_'):-len('.nml')]
+    for product, suffix in products.items():
+        if suffix and stem.endswith(suffix):
+            return stem[:-len(suffix)], product
+    return stem, next(p for p, s in products.items() if not s)
+
+
+def extract(case_dir=CASE_DIR, suffixes=None):
+    '''
+    Build base.nml and matrix.json from the existing Site_*.nml: the most common value of
+    every key goes to the base, the keys varying with the product to the product and the
+    keys that are the same template of the site for all sites to set (templates of {site} or
+    {nml_site}), the other keys equal for all products of a site to the site, the rest to the
+    cases; paths are left for the user to factor out
+    '''
+    suffixes = suffixes or {'sitedata': '', 'GAIA': '_gaia', 'GISA': '_gisa', 'GISD': '_gisd', 'WSF': '_wsf'}
+    files = sorted(glob.glob(os.path.join(case_dir, 'Site_*.nml')))
+    cases, names = {}, {}
+    for path in files:
+        nml_site, product = split_name(path, suffixes)
+        values = read_namelist(path)
+        for k in values:
+            names.setdefault(k.lower(), k)
+        site = str(lower_keys(values).get('def_case_name', nml_site)).split('_')[0]
+        cases[(site, product)] = {'nml_site': nml_site, 'path': path, 'values': lower_keys(values)}
+    sites = list(dict.fromkeys(s for s, _ in cases))
+    keys = list(names)
+    dump = lambda v: json.dumps(v, sort_keys=True)
+
+    # base: the most common value of the keys present in at least half of the cases
+    base = {}
+    for k in keys:
+        present = [c['values'][k] for c in cases.values() if k in c['values']]
+        if 2 * len(present) >= len(cases):
+            base[k] = json.loads(collections.Counter(dump(v) for v in present).most_common(1)[0][0])
+
+    def template(values):
+        # template of {site} / {nml_site} shared by most sites, and the number of these sites
+        cands = collections.Counter()
+        for (site, nml_site), v in values.items():
+            forms = {v.replace(site, '{site}'), v.replace(nml_site, '{nml_site}')} if isinstance(v, str) else {v}
+            cands.update(dump(f) for f in forms)
+        best, n = cands.most_common(1)[0]
+        return json.loads(best), n
+
+    def product_key(k):
+        return any(len({dump(cases[(s, p)]['values'].get(k)) for p in suffixes if (s, p) in cases}) > 1
+                   for s in sites)
+
+    nml_sites = {s: next(c['nml_site'] for (site, _), c in cases.items() if site == s) for s in sites}
+    matrix = {'base': BASE_FILE, 'set': {}, 'paths': {}, 'products': {}, 'sites': {}, 'cases': {}}
+    common = set()
+    for k in keys:
+        if product_key(k):
+            continue
+        value, n = template({(s, nml_sites[s]): next(c['values'].get(k) for (site, _), c in cases.items() if site == s)
+                             for s in sites})
+        if n == len(sites) and isinstance(value, str) and '{' in value:
+            matrix['set'][names[k]] = value
+            common.add(k)
+    for product, suffix in suffixes.items():
+        pset = {}
+        for k in keys:
+            if product_key(k):
+                pset[names[k]] = template({(s, nml_sites[s]): cases[(s, product)]['values'].get(k)
+                                           for s in sites if (s, product) in cases})[0]
+        matrix['products'][product] = {'nml': 'Site_{nml_site}' + suffix + '.nml', 'set': pset}
+    for site in sites:
+        sinfo, sset = {}, {}
+        if nml_sites[site] != site:
+            sinfo['nml_site'] = nml_sites[site]
+        for k in keys:
+            if product_key(k) or k in common:
+                continue
+            v = next(c['values'].get(k) for (s, _), c in cases.items() if s == site)
+            if dump(v) != dump(base.get(k)):
+                sset[names[k]] = v
+        sinfo['set'] = sset
+        matrix['sites'][site] = sinfo
+
+    # what the layers do not give goes to the cases
+    for (site, product), c in cases.items():
+        _, updates = case_updates(matrix, site, product)
+        expect = dict(base, **lower_keys(updates))
+        cset = {names[k]: c['values'].get(k) for k in set(expect) | set(c['values'])
+                if dump(expect.get(k)) != dump(c['values'].get(k))}
+        if cset:
+            matrix['cases'][f'{site}/{product}'] = {'set': dict(sorted(cset.items()))}
+
+    # base text: the first case with the base values
+    with open(files[0]) as f:
+        text = f.read()
+    first = cases[next(iter(cases))]['values']
+    updates = {names[k]: base.get(k) for k in set(base) | set(first) if dump(base.get(k)) != dump(first.get(k))}
+    with open(os.path.join(case_dir, BASE_FILE), 'w') as f:
+        f.write(render(text, updates))
+    with open(os.path.join(case_dir, MATRIX_FILE), 'w') as f:
+        json.dump(matrix, f, indent=1)
+        f.write('\n')
+    return matrix
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='namelists of the site case matrix')
+    parser.add_argument('command', choices=['generate', 'check', 'extract'])
+    parser.add_argument('--dir', default=CASE_DIR, help='directory of base.nml and matrix.json')
+    parser.add_argument('--out', default=None, help='output directory of generate (default: --dir)')
+    parser.add_argument('--sites', nargs='+', default=None)
+    parser.add_argument('--products', nargs='+', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        paths = generate(args.dir, args.out, args.sites, args.products)
+        print(f'{len(paths)} namelists written to {args.out or args.dir}')
+    elif args.command == 'check':
+        diffs = check(args.dir)
+        for name, diff in sorted(diffs.items()):
+            for key, (new, old) in sorted(diff.items()):
+                print(f'{name}: {key} = {new!r} (existing {old!r})')
+        print('all cases match' if not diffs else f'{len(diffs)} cases differ')
+    else:
+        matrix = extract(args.dir)
+        print(f'{len(matrix["sites"])} sites x {len(matrix["products"])} products, '
+              f'{len(matrix["cases"])} case exceptions')
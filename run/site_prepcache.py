@@ -0,0 +1,215 @@
+'''
+Content-addressed cache of the mksrfdata / mkinidata products of the site cases
+
+mksrfdata.x writes the surface data of a case to output/{case}/landdata and mkinidata.x the
+time-constant and initial restart files to output/{case}/restart (const/*_restart_const_lc*.nc,
+const/*_restart_urb_const_lc*.nc and the restart of the start date).  They only depend on
+the namelist keys read by the two programs, on the input files named in the namelist
+(SITE_fsitedata, the forcing namelist, ...) and on the executables, so a case rerun after a
+change of its history settings, or another case with the same inputs, makes the same files.
+
+The fingerprint of a case is the sha256 of these keys (all the keys but the ones used by
+colm.x only: case name, output directory, history, restart frequency, spin-up), of the
+content of the input files and of mksrfdata.x / mkinidata.x.  The products of a case are
+kept in
+
+    {DEF_dir_output}/prep_cache/{fingerprint}/    (or --prep-cache DIR, shared by all runs)
+
+with the case name in the file names replaced by {case}, and are hard linked (copied across
+file systems) into a new case whose fingerprint is found, so only colm.x runs.  The files
+linked into a case are unlinked before mksrfdata / mkinidata run there again, so these never
+write into the cache.  site_ensemble uses the cache with --prep-cache.
+
+Usage:
+    python site_prepcache.py [NML ...] [--bin DIR] [--cache DIR]     # fingerprints and hits
+
+Oct 2026
+'''
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import site_namelist
+
+
+CACHE_DIR  = 'prep_cache'
+MANIFEST   = 'manifest.json'
+EXECUTABLES = ('mksrfdata.x', 'mkinidata.x')
+# keys read by colm.x only (lower case prefixes)
+COLM_ONLY  = ('def_case_name', 'def_dir_output', 'def_hist', 'def_wrst', 'def_simulation_time%spinup_')
+CASE_MARK  = '{case}'
+
+_digests = {}
+
+
+
+def read_values(nml):
+    return site_namelist.lower_keys(site_namelist.read_namelist(nml))
+
+
+def output_dir(nml, values):
+    '''
+    output/{case} of a case (DEF_dir_output is relative to the directory of the namelist)
+    '''
+    return os.path.join(os.path.dirname(os.path.abspath(nml)), str(values.get('def_dir_output', '')),
+                        str(values.get('def_case_name', '')).strip())
+
+
+def cache_root(nml, values, cache=None):
+    if cache:
+        return os.path.abspath(cache)
+    return os.path.join(os.path.dirname(os.path.abspath(nml)), str(values.get('def_dir_output', '')), CACHE_DIR)
+
+
+def file_digest(path):
+    '''
+    sha256 of the content of a file, memoized on its (path, size, mtime)
+    '''
+    st = os.stat(path)
+    ident = (path, st.st_size, st.st_mtime_ns)
+    if ident not in _digests:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _digests[ident] = h.hexdigest()
+    return _digests[ident]
+
+
+def fingerprint(nml, values, bin_dir):
+    '''
+    sha256 of what the products of mksrfdata and mkinidata depend on
+    '''
+    base = os.path.dirname(os.path.abspath(nml))
+    h = hashlib.sha256()
+    for key in sorted(values):
+        if key.startswith(COLM_ONLY):
+            continue
+        value = values[key]
+        h.update(f'{key}={value!r};'.encode())
+        # input files by content (directories of raw data by name only)
+        for item in (value if isinstance(value, list) else [value]):
+            if isinstance(item, str) and item.strip():
+                path = os.path.join(base, item.strip())
+                if os.path.isfile(path):
+                    h.update(f'{key}:{file_digest(path)};'.encode())
+    for exe in EXECUTABLES:
+        path = os.path.join(bin_dir, exe)
+        h.update(f'{exe}:{file_digest(path) if os.path.isfile(path) else None};'.encode())
+    return h.hexdigest()
+
+
+def products(case_dir, since=None):
+    '''
+    Files of mksrfdata and mkinidata in output/{case} (paths relative to it): landdata,
+    restart/const and the restarts written after since (the restart of the start date)
+    '''
+    files = []
+    for sub in ('landdata', 'restart'):
+        for root, _, names in os.walk(os.path.join(case_dir, sub)):
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, case_dir)
+                if sub == 'landdata' or rel.startswith(os.path.join('restart', 'const', '')) or \
+                        (since is not None and os.stat(path).st_mtime >= since):
+                    files.append(rel)
+    return sorted(files)
+
+
+def place(src, dst):
+    '''
+    Hard link src to dst, copy it if a link is not possible
+    '''
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def unshare(case_dir):
+    '''
+    Unlink the product files of a case that are linked to the cache, before mksrfdata or
+    mkinidata write them again
+    '''
+    for rel in products(case_dir, since=0):
+        path = os.path.join(case_dir, rel)
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+
+
+def store(nml, values, key, cache=None, since=None):
+    '''
+    Keep the products of a case under its fingerprint; returns the number of files
+    '''
+    case_dir = output_dir(nml, values)
+    case = os.path.basename(case_dir)
+    entry = os.path.join(cache_root(nml, values, cache), key)
+    if os.path.exists(os.path.join(entry, MANIFEST)):
+        return 0
+    files = products(case_dir, since)
+    if not files:
+        return 0
+    tmp = f'{entry}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.rmtree(entry, ignore_errors=True)     # left incomplete
+    names = [rel.replace(case, CASE_MARK) for rel in files]
+    for rel, name in zip(files, names):
+        place(os.path.join(case_dir, rel), os.path.join(tmp, name))
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump({'files': names, 'case': case, 'nml': os.path.abspath(nml), 'time': time.ctime()}, f, indent=1)
+    try:
+        os.rename(tmp, entry)
+    except OSError:                       # stored meanwhile by another case
+        shutil.rmtree(tmp, ignore_errors=True)
+        return 0
+    return len(names)
+
+
+def restore(nml, values, key, cache=None):
+    '''
+    Link the products kept under the fingerprint into the case; returns the number of files,
+    0 if the fingerprint is not in the cache
+    '''
+    entry = os.path.join(cache_root(nml, values, cache), key)
+    try:
+        with open(os.path.join(entry, MANIFEST)) as f:
+            names = json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return 0
+    if not all(os.path.exists(os.path.join(entry, name)) for name in names):
+        return 0
+    case_dir = output_dir(nml, values)
+    case = os.path.basename(case_dir)
+    unshare(case_dir)
+    for name in names:
+        place(os.path.join(entry, name), os.path.join(case_dir, name.replace(CASE_MARK, case)))
+    os.utime(entry)
+    return len(names)
+
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='fingerprints of the mksrfdata / mkinidata products of the site cases')
+    parser.add_argument('nmls', nargs='*', help='case namelists (default: ISA_compare/Site_*.nml)')
+    parser.add_argument('--bin', default=here, help='directory of mksrfdata.x and mkinidata.x')
+    parser.add_argument('--cache', default=None, help=f'cache directory (default: {CACHE_DIR} in DEF_dir_output)')
+    args = parser.parse_args()
+
+    nmls = args.nmls or sorted(glob.glob(os.path.join(here, 'ISA_compare', 'Site_*.nml')))
+    nmls = [n for n in nmls if not os.path.basename(n).startswith('log_')]
+    hits = 0
+    for nml in nmls:
+        values = read_values(nml)
+        key = fingerprint(nml, values, os.path.abspath(args.bin))
+        found = os.path.exists(os.path.join(cache_root(nml, values, args.cache), key, MANIFEST))
+        hits += found
+        print(f'{os.path.basename(nml):<40} {key[:16]}  {"cached" if found else "-"}')
+    print(f'{hits}/{len(nmls)} cases in the cache')
@@ -0,0 +1,221 @@
+'''
+Runtime profile of the site cases from the colm.x logs and the history files
+
+colm.x prints for every time step (main/CoLM.F90, formats 99 to 103)
+
+    TIMESTEP = 1234 | DATE = 2003-02-21-43200 [Spinup (2 repeat left)]
+    Time elapsed :    1 hours 12 minutes  5 seconds.
+
+the time elapsed being the wall time since the start of the program, initialization and
+forcing read-ahead included.  parse_log turns a log_run_{nml} into the series of (step,
+date, spin-up repeats left, elapsed seconds).  The model has no timer of its parts, so these
+are estimated from this series:
+
+    init        elapsed at the first step (namelist, surface data, restart and, with
+                USE_SITE_ForcingReadAhead, the whole forcing of the run)
+    hist_write  with USE_SITE_HistWriteBack (the default of the site runs) the history of a
+                file group (DEF_HIST_groupby) is kept in memory and written at its last
+                step: the wall time of the days holding these steps over the median day
+    forcing     without read-ahead, the same excess on the days the forcing is read (first
+                day of every month and year), with read-ahead the init time
+    steps       the rest
+
+and the simulated days per wall second of the run (over the time loop and over the whole run).
+The history files of the case (output/{case}/history) give the volume written; their
+modification times, with the end of the log, place the writes in the run.
+
+The cases are ranked from the slowest, with their urban options (DEF_URBAN_BEM, LUCY,
+TREE, WATER), time step and product, and the mean speed of every option is printed so that
+slow configurations stand out; the report is written as site_profile.csv.
+
+Usage:
+    python site_profile.py [NML ...] [--nprocs N]
+
+Oct 2026
+'''
+import argparse
+import datetime
+import glob
+import multiprocessing
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import site_ensemble
+import site_prepcache
+
+
+STEP_LINE    = re.compile(r'TIMESTEP\s*=\s*(\d+)\s*\|\s*DATE\s*=\s*(\d{4})-(\d{2})-(\d{2})-(\d{5})'
+                          r'(?:\s*Spinup\s*\(\s*(\d+)\s*repeat left\))?')
+ELAPSED_LINE = re.compile(r'Time elapsed\s*:\s*(?:(\d+)\s*hours)?\s*(?:(\d+)\s*minutes)?\s*(\d+)\s*seconds')
+OPTIONS      = ('def_urban_bem', 'def_urban_lucy', 'def_urban_tree', 'def_urban_water')
+PRODUCTS     = ('GAIA', 'GISA', 'GISD', 'WSF')
+REPORT_FILE  = 'site_profile.csv'
+
+
+
+def parse_log(path):
+    '''
+    DataFrame step, date, spinup_left, elapsed of the steps of a colm.x log
+    '''
+    rows, step = [], None
+    with open(path, errors='replace') as f:
+        for line in f:
+            m = STEP_LINE.search(line)
+            if m:
+                g = m.groups()
+                step = [int(g[0]), datetime.datetime(int(g[1]), int(g[2]), int(g[3])) +
+                        datetime.timedelta(seconds=int(g[4])), int(g[5]) if g[5] else 0]
+                continue
+            m = ELAPSED_LINE.search(line)
+            if m and step is not None:
+                h, mi, s = (int(x) if x else 0 for x in m.groups())
+                rows.append(step + [h * 3600 + mi * 60 + s])
+                step = None
+    return pd.DataFrame(rows, columns=['step', 'date', 'spinup_left', 'elapsed'])
+
+
+def day_keys(steps):
+    # a simulated day is its date and the spin-up repeat it belongs to
+    return pd.MultiIndex.from_arrays([steps['date'].dt.floor('D'), steps['spinup_left']])
+
+
+def day_costs(steps):
+    '''
+    Wall seconds of every simulated day of the time loop
+    '''
+    dt = steps['elapsed'].diff().fillna(0).clip(lower=0)
+    return pd.Series(dt.to_numpy(), index=day_keys(steps)).groupby(level=[0, 1], sort=False).sum()
+
+
+def event_days(steps, kind, groupby='YEAR'):
+    '''
+    Days (as in day_costs) of the steps writing the history (kind 'hist': last step of a
+    DEF_HIST_groupby file) or reading the forcing (kind 'forcing': first step of a month)
+    '''
+    date = steps['date']                # begin of the step
+    if kind == 'hist':
+        group = {'DAY': date.dt.strftime('%Y%m%d'), 'YEAR': date.dt.year.astype(str)}.get(
+            groupby, date.dt.strftime('%Y%m'))
+        hit = group.ne(group.shift(-1))
+    else:
+        month = date.dt.strftime('%Y%m')
+        hit = month.ne(month.shift(1))
+    return set(day_keys(steps)[hit.to_numpy()])
+
+
+def history_volume(case_dir):
+    '''
+    (files, MB) of the history of a case
+    '''
+    files = glob.glob(os.path.join(case_dir, 'history', '*.nc'))
+    return len(files), sum(os.path.getsize(f) for f in files) / 2 ** 20
+
+
+def history_writes(case_dir, log, total):
+    '''
+    Elapsed seconds of the last modification of the history files written during the run,
+    placed from the end of the log
+    '''
+    try:
+        end = os.path.getmtime(log)
+    except OSError:
+        return []
+    start = end - total
+    return sorted(os.path.getmtime(f) - start for f in glob.glob(os.path.join(case_dir, 'history', '*.nc'))
+                  if os.path.getmtime(f) >= start)
+
+
+def profile_case(nml):
+    '''
+    Profile of one case: None if its colm.x log has no step
+    '''
+    values = site_ensemble.read_nml_values(nml)
+    log = site_ensemble.log_path(nml, 'colm')
+    if not os.path.exists(log):
+        return None
+    steps = parse_log(log)
+    if steps.empty:
+        return None
+
+    deltim = float(values.get('def_simulation_time%timestep', 1800.) or 1800.)
+    total = float(steps['elapsed'].iloc[-1])
+    init = float(steps['elapsed'].iloc[0])
+    sim_days = len(steps) * deltim / 86400
+    loop = max(total - init, 1e-9)
+
+    costs = day_costs(steps)
+    base = float(costs.median()) if len(costs) else 0.0
+    excess = (costs - base).clip(lower=0)
+    writeback = values.get('use_site_histwriteback', True)
+    groupby = str(values.get('def_hist_groupby', 'MONTH')).upper()
+    hist = float(excess[excess.index.isin(event_days(steps, 'hist', groupby))].sum()) if writeback else np.nan
+    if values.get('use_site_forcingreadahead', True):
+        forcing = init
+    else:
+        forcing = float(excess[excess.index.isin(event_days(steps, 'forcing'))].sum())
+
+    case_dir = site_prepcache.output_dir(nml, values)
+    nfiles, mb = history_volume(case_dir)
+    name = os.path.basename(nml)[:-len('.nml')]
+    product = next((p for p in PRODUCTS if name.lower().endswith('_' + p.lower())), 'sitedata')
+    row = {
+        'nml': os.path.basename(nml), 'case': values.get('def_case_name', ''), 'product': product,
+        'timestep': deltim, 'steps': len(steps), 'complete': site_ensemble.check_log(log, site_ensemble.STAGES[-1][3])[0],
+        'sim_days': sim_days, 'wall_s': total, 'init_s': init,
+        'days_per_s': sim_days / total if total else np.nan, 'loop_days_per_s': sim_days / loop,
+        'step_ms': 1000 * (loop - (0 if np.isnan(hist) else hist)) / len(steps),
+        'forcing_s': forcing, 'hist_write_s': hist,
+        'hist_files': nfiles, 'hist_mb': mb, 'hist_mb_per_year': mb / (sim_days / 365.25) if sim_days else np.nan,
+        'hist_writes': len(history_writes(case_dir, log, total)),
+    }
+    row.update({o[len('def_urban_'):]: bool(values.get(o, False)) for o in OPTIONS})
+    return row
+
+
+def profile(nmls, nprocs=4):
+    '''
+    Profiles of the cases (logs parsed over nprocs processes), ranked from the slowest
+    '''
+    with multiprocessing.get_context('fork').Pool(max(1, min(nprocs, len(nmls)))) as pool:
+        rows = [r for r in pool.map(profile_case, nmls) if r is not None]
+    table = pd.DataFrame(rows)
+    if table.empty:
+        return table
+    table['slowdown'] = table['days_per_s'].median() / table['days_per_s']
+    return table.sort_values('days_per_s').reset_index(drop=True)
+
+
+def print_report(table):
+    print(f'\n{"case":<36} {"opts":<5} {"dt":>5} {"days/s":>8} {"slow":>5} {"wall":>8} {"init":>6} '
+          f'{"forcing":>8} {"hist":>6} {"MB":>7}')
+    for r in table.itertuples():
+        opts = ''.join(c if getattr(r, o) else '-' for c, o in zip('BLTW', ('bem', 'lucy', 'tree', 'water')))
+        hist = '-' if np.isnan(r.hist_write_s) else f'{r.hist_write_s:.0f}s'
+        print(f'{r.case or r.nml:<36} {opts:<5} {r.timestep:>5.0f} {r.days_per_s:>8.2f} {r.slowdown:>5.2f} '
+              f'{r.wall_s:>7.0f}s {r.init_s:>5.0f}s {r.forcing_s:>7.0f}s {hist:>6} {r.hist_mb:>7.1f}')
+    print('\nmean simulated days per second by option (B: BEM, L: LUCY, T: tree, W: water)')
+    for col in ('bem', 'lucy', 'tree', 'water', 'product', 'timestep'):
+        means = table.groupby(col)['days_per_s'].mean()
+        print(f'  {col:<9} ' + '   '.join(f'{k}: {v:.2f}' for k, v in means.items()))
+
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='runtime profile of the site cases from their colm.x logs')
+    parser.add_argument('nmls', nargs='*', help='case namelists (default: ISA_compare/Site_*.nml)')
+    parser.add_argument('--nprocs', type=int, default=4, help='processes parsing the logs')
+    parser.add_argument('--report', default=None, help=f'report file (default: {REPORT_FILE} next to the namelists)')
+    args = parser.parse_args()
+
+    nmls = args.nmls or sorted(glob.glob(os.path.join(here, 'ISA_compare', 'Site_*.nml')))
+    table = profile(nmls, args.nprocs)
+    if table.empty:
+        raise SystemExit('no colm.x log with time steps found')
+    print_report(table)
+    path = args.report or os.path.join(os.path.dirname(os.path.abspath(nmls[0])), REPORT_FILE)
+    table.to_csv(path, index=False, float_format='%.4g')
+    print(f'\n{len(table)} cases profiled, report written to {path}')
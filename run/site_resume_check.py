@@ -0,0 +1,258 @@
+'''
+Check of the resume path of site_ensemble (--resume) with a fake hourly colm.x
+
+The fake model reads a case namelist as colm.x does (start / end, timestep, DEF_HIST_groupby,
+USE_SITE_HistWriteBack), starts from the restart of its start date, carries one state x from
+step to step and writes
+
+    history     {case}_hist_{group}.nc, one record per hour stamped at the middle of the
+                hour (minutes since 1900, end of the step - 30, as MOD_HistSingle), written
+                as the steps go or, with USE_SITE_HistWriteBack, only when a file is complete
+    restart     restart/{yyyy-ddd-sssss}/{case}_restart_{date}.nc at the start of every month
+
+so a run that is resumed from a wrong restart or stitched at a wrong boundary gives other
+values.  With FAKE_COLM_KILL set to a date the model dies there (exit code 137, no completion
+message), leaving a half-written restart of that date.
+
+For both history modes, a case is run once without interruption and once killed mid-year
+then resumed with site_ensemble.run_chain(resume=True); the check passes when the resume
+starts from the expected restart (the latest one with its history on disk) and every history
+file of the resumed case holds the same times and values as the uninterrupted one, the
+records around the restart date (time < cut from the interrupted run, the others from the
+resumed one) included.
+
+Usage:
+    python site_resume_check.py [--workdir DIR] [--keep]
+
+Oct 2026
+'''
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import site_ensemble
+
+
+CASE   = 'RESUME-Check'
+START  = (2004, 11, 1)
+END    = (2005, 3, 1)
+KILL   = '2005-02-10T10:00'
+# restart the resumed run has to start from, by USE_SITE_HistWriteBack
+EXPECTED = {False: '2005-032-00000', True: '2005-001-00000'}
+
+NML = '''&nl_colm
+   DEF_CASE_NAME = '{case}'
+   DEF_dir_output = '{output}'
+
+   DEF_simulation_time%greenwich     = .true.
+   DEF_simulation_time%start_year    = {start[0]}
+   DEF_simulation_time%start_month   = {start[1]}
+   DEF_simulation_time%start_day     = {start[2]}
+   DEF_simulation_time%start_sec     = 0
+   DEF_simulation_time%end_year      = {end[0]}
+   DEF_simulation_time%end_month     = {end[1]}
+   DEF_simulation_time%end_day       = {end[2]}
+   DEF_simulation_time%end_sec       = 0
+   DEF_simulation_time%spinup_year   = {start[0]}
+   DEF_simulation_time%spinup_month  = {start[1]}
+   DEF_simulation_time%spinup_day    = {start[2]}
+   DEF_simulation_time%spinup_sec    = 0
+   DEF_simulation_time%spinup_repeat = 0
+   DEF_simulation_time%timestep      = 3600.
+
+   USE_SITE_HistWriteBack = {writeback}
+   DEF_WRST_FREQ    = 'MONTHLY'
+   DEF_HIST_FREQ    = 'HOURLY'
+   DEF_HIST_groupby = 'YEAR'
+/
+'''
+
+FAKE_COLM = '''#!{python}
+import datetime, os, sys
+import numpy as np
+import netCDF4 as nc
+sys.path.insert(0, {run_dir!r})
+import site_ensemble, site_prepcache
+
+nml = sys.argv[1]
+values = site_ensemble.read_nml_values(nml)
+def stamp(kind):
+    t = 'def_simulation_time%' + kind
+    return datetime.datetime(int(values[t + '_year']), int(values[t + '_month']), int(values[t + '_day'])) + \\
+        datetime.timedelta(seconds=float(values[t + '_sec']))
+start, end = stamp('start'), stamp('end')
+dt = datetime.timedelta(seconds=float(values['def_simulation_time%timestep']))
+case = values['def_case_name']
+out = site_prepcache.output_dir(nml, values)
+writeback = values.get('use_site_histwriteback', True)
+fmt = site_ensemble.HIST_GROUPS[values['def_hist_groupby'].upper()]
+kill = os.environ.get('FAKE_COLM_KILL')
+kill = datetime.datetime.fromisoformat(kill) if kill else None
+
+def cdate(t):
+    return f'{{t.year:04d}}-{{t.timetuple().tm_yday:03d}}-{{t.hour * 3600 + t.minute * 60 + t.second:05d}}'
+
+def write_history(group, records):
+    path = os.path.join(out, 'history', f'{{case}}_hist_{{group}}.nc')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with nc.Dataset(path, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('patch', 1)
+        t = ds.createVariable('time', 'f8', ('time',))
+        t.units = 'minutes since 1900-1-1 0:0:0'
+        t[:] = [r[0] for r in records]
+        ds.createVariable('f_x', 'f8', ('time', 'patch'))[:] = np.array([[r[1]] for r in records])
+
+with nc.Dataset(os.path.join(out, 'restart', cdate(start), f'{{case}}_restart_{{cdate(start)}}.nc')) as ds:
+    x = float(ds['x'][0])
+print('CoLM fake model from', start, 'to', end)
+t, group, records = start, None, []
+while t < end:
+    t_end = t + dt
+    hour = t.hour + t.minute / 60
+    x = 0.9 * x + np.sin(2 * np.pi * hour / 24) + 0.001 * t.timetuple().tm_yday
+    key = (t_end - datetime.timedelta(seconds=1)).strftime(fmt)
+    if group is not None and key != group:
+        write_history(group, records)
+        records = []
+    group = key
+    records.append(((t_end - datetime.datetime(1900, 1, 1)).total_seconds() / 60 - 30, x))
+    if t_end == kill:
+        if not writeback:
+            write_history(group, records)      # the records written as the steps went
+        os.makedirs(os.path.join(out, 'restart', cdate(t_end)), exist_ok=True)
+        with open(os.path.join(out, 'restart', cdate(t_end), f'{{case}}_restart_{{cdate(t_end)}}.nc'), 'wb') as f:
+            f.write(b'CDF\\x02 half-written')
+        print('TIMESTEP killed at', t_end)
+        sys.exit(137)
+    if t_end.day == 1 and t_end.hour == 0 and t_end < end:
+        path = os.path.join(out, 'restart', cdate(t_end), f'{{case}}_restart_{{cdate(t_end)}}.nc')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with nc.Dataset(path, 'w') as ds:
+            ds.createDimension('n', 1)
+            ds.createVariable('x', 'f8', ('n',))[:] = [x]
+    t = t_end
+write_history(group, records)
+print('CoLM Execution Completed')
+'''
+
+
+
+def make_bin(workdir):
+    '''
+    Directory holding the fake colm.x
+    '''
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, 'colm.x')
+    with open(path, 'w') as f:
+        f.write(FAKE_COLM.format(python=sys.executable, run_dir=os.path.dirname(os.path.abspath(__file__))))
+    os.chmod(path, 0o755)
+    return bin_dir
+
+
+def make_case(workdir, output, writeback):
+    '''
+    Namelist of the check case and the restart of its start date (as mkinidata makes it)
+    '''
+    import netCDF4 as nc
+    os.makedirs(workdir, exist_ok=True)
+    nml = os.path.join(workdir, 'Site_RESUME-Check.nml')
+    with open(nml, 'w') as f:
+        f.write(NML.format(case=CASE, output=output, start=START, end=END,
+                           writeback='.true.' if writeback else '.false.'))
+    values = site_ensemble.read_nml_values(nml)
+    cdate = site_ensemble.restart_date(values, 'start')
+    path = os.path.join(workdir, output, CASE, 'restart', cdate, f'{CASE}_restart_{cdate}.nc')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with nc.Dataset(path, 'w') as ds:
+        ds.createDimension('n', 1)
+        ds.createVariable('x', 'f8', ('n',))[:] = [0.]
+    return nml
+
+
+def compare_history(dir_ref, dir_new):
+    '''
+    Differences between the history files of two runs
+    '''
+    import netCDF4 as nc
+    diffs = []
+    names = sorted(os.path.basename(p) for p in glob.glob(os.path.join(dir_ref, '*.nc')))
+    found = sorted(os.path.basename(p) for p in glob.glob(os.path.join(dir_new, '*')))
+    if found != names:
+        diffs.append(f'files {found} instead of {names}')
+    for name in names:
+        if not os.path.exists(os.path.join(dir_new, name)):
+            continue
+        with nc.Dataset(os.path.join(dir_ref, name)) as a, nc.Dataset(os.path.join(dir_new, name)) as b:
+            ta, tb = np.asarray(a['time'][:]), np.asarray(b['time'][:])
+            if not np.array_equal(ta, tb):
+                extra, lost = np.setdiff1d(tb, ta), np.setdiff1d(ta, tb)
+                diffs.append(f'{name}: {len(tb)} records instead of {len(ta)} '
+                             f'(extra {extra[:3]}, missing {lost[:3]})')
+            elif not np.array_equal(np.asarray(a['f_x'][:]), np.asarray(b['f_x'][:])):
+                bad = np.flatnonzero(np.asarray(a['f_x'][:, 0]) != np.asarray(b['f_x'][:, 0]))
+                diffs.append(f'{name}: values differ from minute {ta[bad[0]]:.0f} ({len(bad)} records)')
+    return diffs
+
+
+def check_resume(workdir, writeback):
+    '''
+    Killed and resumed case vs. the same case run without interruption
+    '''
+    bin_dir = make_bin(workdir)
+    root = os.path.join(workdir, 'writeback' if writeback else 'incremental')
+    ref, cut = make_case(os.path.join(root, 'ref'), 'output', writeback), \
+        make_case(os.path.join(root, 'cut'), 'output', writeback)
+    diffs = []
+    if site_ensemble.run_stage(ref, 'colm', bin_dir)['status'] != 'ok':
+        return False, ['uninterrupted run failed']
+    os.environ['FAKE_COLM_KILL'] = KILL
+    try:
+        killed = site_ensemble.run_stage(cut, 'colm', bin_dir)
+    finally:
+        del os.environ['FAKE_COLM_KILL']
+    if killed['status'] != 'failed':
+        diffs.append(f'killed run reported {killed["status"]}')
+
+    report = site_ensemble.run_chain(cut, bin_dir, stages=['colm'], resume=True)
+    if report['status'] != 'ok':
+        return False, diffs + [f'resumed run failed: {report["colm"]["reason"]}']
+    if report.get('resumed') != EXPECTED[writeback]:
+        diffs.append(f'resumed from {report.get("resumed")} instead of {EXPECTED[writeback]}')
+    diffs += compare_history(os.path.join(root, 'ref', 'output', CASE, 'history'),
+                             os.path.join(root, 'cut', 'output', CASE, 'history'))
+    return len(diffs) == 0, diffs
+
+
+#-- checks: name -> function(workdir) returning (ok, details)
+CHECKS = {
+    'resume_incremental_history': lambda workdir: check_resume(workdir, False),
+    'resume_history_writeback'  : lambda workdir: check_resume(workdir, True),
+}
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check the resume path of site_ensemble with a fake colm.x')
+    parser.add_argument('--workdir', default=None, help='where the check cases are run (default: a temporary one)')
+    parser.add_argument('--keep', action='store_true', help='keep the check cases')
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='resume_check_')
+    failed = 0
+    try:
+        for name, func in CHECKS.items():
+            ok, details = func(workdir)
+            failed += not ok
+            print(f'[check {name}] {"ok" if ok else "FAILED"}', '' if ok else details)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if failed:
+        sys.exit(1)
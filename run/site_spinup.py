@@ -0,0 +1,262 @@
+'''
+Spin-up controller of the site cases: spin-up cycles until equilibrium
+
+colm.x repeats the spin-up period (start to DEF_simulation_time%spinup_*) spinup_repeat times
+before it runs on to the end, with a number of repeats chosen by hand.  Here every cycle is a
+separate colm.x run of the spin-up period (a derived namelist spinup_{nml}: end = spinup
+date, no repeat), after which the restart written at the end of the period is copied back
+to the restart of the start date, so the next cycle starts from the state reached, as the
+repeats of colm.x do.  After each cycle the state variables of this restart are compared
+with the ones of the previous cycle (of the initial state for the first one):
+
+    soil            t_soisno (K), wliq_soisno, wice_soisno (relative)
+    urban           t_roofsno, t_wallsun, t_wallsha, t_gimpsno, t_gpersno, t_room,
+                    troof_inner, twsun_inner, twsha_inner (K), wliq_gpersno (relative)
+
+and the spin-up stops at the first cycle where all are within TOLERANCES (largest absolute
+difference for temperatures, largest difference relative to the mean magnitude for water).
+The main run (spunup_{nml}: the case without spin-up repeats) then starts from this state,
+unless --no-run.  The restart of the start date made by mkinidata is kept as
+restart/{date}.init and put back at every new spin-up, so the controller can be run again.
+
+The budget of a case is its spinup_repeat (--max-cycles when it is 0 or 1).  The cycles
+saved are counted against what colm.x would have run, its baseline: with spinup_repeat = N
+colm.x runs the spin-up period N - 1 times and then once more on its way from start to end
+(main/CoLM.F90), as the main run here does after the cycles, so the baseline is N - 1 extra
+passes (none for 0 or 1, as in site_ensemble.simulated_years).  A case that needs more
+cycles than that is reported with a negative saving, and its extra cycles are reported
+apart: a case of spinup_repeat = 0 converged after one cycle cost one extra spin-up period.  The
+report gives the cycles run, the largest differences of the last one and the cycles saved
+and extra, and is written as spinup_report.csv.
+
+Usage:
+    python site_spinup.py [NML ...] [--bin DIR] [--max-cycles N] [--nprocs N] [--no-run]
+
+Oct 2026
+'''
+import argparse
+import concurrent.futures
+import csv
+import glob
+import os
+import shutil
+
+import numpy as np
+
+import site_ensemble
+import site_namelist
+import site_prepcache
+
+
+# variable: (kind, tolerance); kind abs (K) or rel (relative to the mean magnitude)
+TOLERANCES = {
+    't_soisno'    : ('abs', 0.05),
+    'wliq_soisno' : ('rel', 1e-3),
+    'wice_soisno' : ('rel', 1e-3),
+    't_roofsno'   : ('abs', 0.05),
+    't_wallsun'   : ('abs', 0.05),
+    't_wallsha'   : ('abs', 0.05),
+    't_gimpsno'   : ('abs', 0.05),
+    't_gpersno'   : ('abs', 0.05),
+    't_room'      : ('abs', 0.05),
+    'troof_inner' : ('abs', 0.05),
+    'twsun_inner' : ('abs', 0.05),
+    'twsha_inner' : ('abs', 0.05),
+    'wliq_gpersno': ('rel', 1e-3),
+}
+MAX_CYCLES  = 20
+SPVAL_LIMIT = 1e30                      # spval (-1e36) marks the empty snow layers
+REPORT_FILE = 'spinup_report.csv'
+
+
+
+def read_state(restart_dir):
+    '''
+    {variable: values} of the compared state variables in the restart files of a date
+    '''
+    import netCDF4 as nc
+
+    state = {}
+    for path in sorted(glob.glob(os.path.join(restart_dir, '*.nc'))):
+        with nc.Dataset(path) as ds:
+            for name in TOLERANCES:
+                if name in ds.variables and name not in state:
+                    state[name] = np.ma.filled(ds.variables[name][:].astype(np.float64), np.nan)
+    return state
+
+
+def compare(prev, this):
+    '''
+    {variable: (difference, converged)} of two states
+    '''
+    out = {}
+    for name, (kind, tol) in TOLERANCES.items():
+        if name not in prev or name not in this or prev[name].shape != this[name].shape:
+            continue
+        a, b = prev[name], this[name]
+        ok = np.isfinite(a) & np.isfinite(b) & (np.abs(a) < SPVAL_LIMIT) & (np.abs(b) < SPVAL_LIMIT)
+        if not ok.any():
+            continue
+        diff = float(np.abs(a[ok] - b[ok]).max())
+        if kind == 'rel':
+            diff /= max(float(np.abs(a[ok]).mean()), 1e-12)
+        out[name] = (diff, diff <= tol)
+    return out
+
+
+def snapshot(restart):
+    '''
+    {path: mtime} of the restart files of the dates of a case
+    '''
+    return {p: os.stat(p).st_mtime_ns for p in glob.glob(os.path.join(restart, '*', '*'))
+            if not os.path.dirname(p).endswith('.init')}
+
+
+def copy_fresh(src, dst):
+    '''
+    Copy src to dst as a new file (never through a hard link of dst)
+    '''
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    shutil.copy2(src, dst)
+
+
+def rewind(restart, end, start):
+    '''
+    Restart files of the date end copied as the ones of the date start
+    '''
+    for path in glob.glob(os.path.join(restart, end, '*')):
+        copy_fresh(path, os.path.join(restart, start, os.path.basename(path).replace(end, start)))
+
+
+def derived_nml(nml, prefix, updates):
+    with open(nml) as f:
+        text = f.read()
+    path = os.path.join(os.path.dirname(os.path.abspath(nml)), prefix + os.path.basename(nml))
+    with open(path, 'w') as f:
+        f.write(site_namelist.render(text, updates))
+    return path
+
+
+def spinup_case(nml, bin_dir, max_cycles=MAX_CYCLES, launcher=(), run=True):
+    '''
+    Spin-up cycles of one case until equilibrium, then its main run; returns the report
+    '''
+    values = site_ensemble.read_nml_values(nml)
+    repeat = int(values.get('def_simulation_time%spinup_repeat', 0) or 0)
+    budget = repeat if repeat > 1 else max_cycles
+    report = {'nml': os.path.basename(nml), 'case': values.get('def_case_name', ''), 'budget': budget,
+              'baseline': max(repeat, 1) - 1,
+              'cycles': 0, 'converged': False, 'diffs': {}, 'status': 'ok', 'reason': ''}
+
+    restart = os.path.join(site_prepcache.output_dir(nml, values), 'restart')
+    start, spin = site_ensemble.restart_date(values, 'start'), site_ensemble.restart_date(values, 'spinup')
+    if spin <= start:
+        report.update(status='skipped', reason='no spin-up period')
+        return report
+    init = os.path.join(restart, start + '.init')
+    if not os.path.isdir(init):
+        if not os.path.isdir(os.path.join(restart, start)):
+            report.update(status='failed', reason=f'no restart of the start date {start} (run mkinidata first)')
+            return report
+        shutil.copytree(os.path.join(restart, start), init)
+    for path in glob.glob(os.path.join(init, '*')):
+        copy_fresh(path, os.path.join(restart, start, os.path.basename(path)))
+
+    t = 'DEF_simulation_time%'
+    seg = derived_nml(nml, 'spinup_', {
+        t + 'end_year': values['def_simulation_time%spinup_year'],
+        t + 'end_month': values['def_simulation_time%spinup_month'],
+        t + 'end_day': values['def_simulation_time%spinup_day'],
+        t + 'end_sec': values['def_simulation_time%spinup_sec'],
+        t + 'spinup_repeat': 0})
+
+    prev = read_state(os.path.join(restart, start))
+    for cycle in range(1, budget + 1):
+        before = snapshot(restart)
+        stage = site_ensemble.run_stage(seg, 'colm', bin_dir, launcher)
+        report['cycles'] = cycle
+        if stage['status'] != 'ok':
+            report.update(status='failed', reason=f'cycle {cycle}: {stage["reason"]}')
+            return report
+        # restart of the end of the period: the latest date written by this cycle
+        written = sorted({os.path.basename(os.path.dirname(p)) for p, m in snapshot(restart).items()
+                          if before.get(p) != m} - {'const', start})
+        if not written:
+            report.update(status='failed', reason=f'cycle {cycle}: no restart written')
+            return report
+        end = written[-1]
+        this = read_state(os.path.join(restart, end))
+        report['diffs'] = compare(prev, this)
+        rewind(restart, end, start)
+        site_ensemble.log(f'  {report["nml"]} cycle {cycle}: ' + ', '.join(
+            f'{k} {d:.3g}{"" if ok else "*"}' for k, (d, ok) in report['diffs'].items()))
+        if report['diffs'] and all(ok for _, ok in report['diffs'].values()):
+            report['converged'] = True
+            break
+        prev = this
+
+    if run:
+        main = derived_nml(nml, 'spunup_', {t + 'spinup_repeat': 0})
+        stage = site_ensemble.run_stage(main, 'colm', bin_dir, launcher)
+        if stage['status'] != 'ok':
+            report.update(status='failed', reason=f'main run: {stage["reason"]}')
+    return report
+
+
+def saved(report):
+    '''
+    Spin-up passes saved against the N - 1 extra passes of colm.x, negative when more were run
+    '''
+    return report['baseline'] - report['cycles'] if report['status'] == 'ok' else 0
+
+
+def extra(report):
+    return max(0, -saved(report))
+
+
+def write_report(reports, path):
+    names = list(TOLERANCES)
+    with open(path, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['nml', 'case', 'status', 'baseline', 'budget', 'cycles', 'converged', 'cycles_saved',
+                    'extra_cycles'] + names + ['reason'])
+        for rep in reports:
+            w.writerow([rep['nml'], rep['case'], rep['status'], rep['baseline'], rep['budget'], rep['cycles'],
+                        rep['converged'], saved(rep), extra(rep)] + [f'{rep["diffs"][n][0]:.4g}' if n in rep['diffs'] else '' for n in names] +
+                       [rep['reason']])
+
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='spin-up of the site cases until equilibrium')
+    parser.add_argument('nmls', nargs='*', help='case namelists (default: ISA_compare/Site_*.nml)')
+    parser.add_argument('--bin', default=here, help='directory of colm.x')
+    parser.add_argument('--max-cycles', type=int, default=MAX_CYCLES, help='cycles of the cases without spinup_repeat')
+    parser.add_argument('--nprocs', type=int, default=None, help='cases at once (default: number of cores)')
+    parser.add_argument('--launcher', default='', help='command prefix of colm.x, e.g. "mpirun -np 1"')
+    parser.add_argument('--no-run', action='store_true', help='stop after the spin-up')
+    parser.add_argument('--report', default=None, help=f'report file (default: {REPORT_FILE} next to the namelists)')
+    args = parser.parse_args()
+
+    nmls = args.nmls or sorted(glob.glob(os.path.join(here, 'ISA_compare', 'Site_*.nml')))
+    nmls = [n for n in nmls if os.path.basename(n).startswith('Site_')]    # not the logs and derived namelists
+    if not nmls:
+        raise SystemExit('no case namelist found')
+    nprocs = max(1, min(args.nprocs or os.cpu_count() or 1, len(nmls)))
+    with concurrent.futures.ThreadPoolExecutor(nprocs) as pool:
+        reports = list(pool.map(lambda n: spinup_case(n, os.path.abspath(args.bin), args.max_cycles,
+                                                      args.launcher.split(), not args.no_run), nmls))
+
+    print(f'\n{"case":<40} {"status":<8} {"cycles":>7} {"base":>5} {"budget":>7} {"saved":>6}')
+    for rep in reports:
+        print(f'{rep["case"] or rep["nml"]:<40} {rep["status"]:<8} {rep["cycles"]:>7} {rep["baseline"]:>5} '
+              f'{rep["budget"]:>7} {saved(rep):>6}'
+              f'{"" if rep["converged"] or rep["status"] != "ok" else "  (not converged)"}')
+    print(f'{sum(max(0, saved(r)) for r in reports)} spin-up cycles saved, {sum(extra(r) for r in reports)} '
+          f'extra cycles run over {len(reports)} cases')
+    path = args.report or os.path.join(os.path.dirname(os.path.abspath(nmls[0])), REPORT_FILE)
+    write_report(reports, path)
+    print(f'report written to {path}')